@@ -1,11 +1,31 @@
 # -*- coding: utf-8 -*-
 import ctypes
 import json
+import os
 import platform
-from threading import Lock
+import sys
+import time
+from threading import Condition, Lock
 
 mutex = Lock()
 
+# Bounds, in seconds, of the backoff used by the wait_for_* methods while a native video
+# source is connected.  Frames from those threads do not signal Python waiters
+_MIN_WAIT_POLL = 0.001
+_MAX_WAIT_POLL = 0.05
+
+_monotonic = getattr(time, "monotonic", time.time)
+_perf_counter = getattr(time, "perf_counter", time.time)
+
+# Environment variable holding the full path of libalprstream, overriding the platform default
+LIBRARY_PATH_ENV = "ALPRSTREAM_LIBRARY"
+
+# Environment variable that, when set to anything but 0, enables allocation tracking on every new AlprStream
+DEBUG_ALLOCATIONS_ENV = "ALPRSTREAM_DEBUG_ALLOCATIONS"
+
+# Loaded libraries keyed by path, shared by every AlprStream in the process
+_libraries = {}
+
 # We need to do things slightly differently for Python 2 vs. 3
 # ... because the way str/unicode have changed to bytes/str
 if platform.python_version_tuple()[0] == '2':
@@ -33,6 +53,63 @@ def _convert_from_charp(charp):
     else:
         return charp
 
+
+def _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight):
+    # Resolves a raw BGR frame to something that can be passed as a void* without copying.
+    # Returns a (pointer, keepalive) pair.  The keepalive object must stay referenced until
+    # the native call has returned, otherwise the memory behind the pointer may be released.
+    if type(pixelData) == unicode:
+        raise TypeError("pixelData must be a bytes-like object, not a text string")
+
+    expected_size = bytesPerPixel * imgWidth * imgHeight
+    if bytesPerPixel <= 0 or imgWidth <= 0 or imgHeight <= 0:
+        raise ValueError("Invalid frame geometry %dx%d with %d bytes per pixel" %
+                         (imgWidth, imgHeight, bytesPerPixel))
+
+    if type(pixelData) == bytes:
+        # Immutable bytes are handed to C as a pointer to their internal storage
+        if len(pixelData) != expected_size:
+            raise ValueError("pixelData is %d bytes, expected %d (%dx%dx%d)" %
+                             (len(pixelData), expected_size, imgWidth, imgHeight, bytesPerPixel))
+        return pixelData, pixelData
+
+    view = memoryview(pixelData)
+    if not getattr(view, "c_contiguous", True):
+        raise ValueError("pixelData must be a C-contiguous buffer")
+    if view.itemsize != 1:
+        raise ValueError("pixelData must contain 8-bit samples, got itemsize %d" % view.itemsize)
+    if view.ndim == 3:
+        if tuple(view.shape) != (imgHeight, imgWidth, bytesPerPixel):
+            raise ValueError("pixelData shape %s does not match (%d, %d, %d)" %
+                             (tuple(view.shape), imgHeight, imgWidth, bytesPerPixel))
+    elif view.ndim == 2:
+        if tuple(view.shape) != (imgHeight, imgWidth * bytesPerPixel):
+            raise ValueError("pixelData shape %s does not match %dx%d with %d bytes per pixel" %
+                             (tuple(view.shape), imgWidth, imgHeight, bytesPerPixel))
+    elif view.ndim > 3:
+        raise ValueError("pixelData has %d dimensions, expected at most 3" % view.ndim)
+    if view.nbytes != expected_size:
+        raise ValueError("pixelData is %d bytes, expected %d (%dx%dx%d)" %
+                         (view.nbytes, expected_size, imgWidth, imgHeight, bytesPerPixel))
+
+    if not view.readonly:
+        # bytearray, writable mmap, writable ndarray or a memoryview over one of them
+        return ctypes.addressof((ctypes.c_char * view.nbytes).from_buffer(view)), view
+
+    # Read-only buffers cannot be wrapped with from_buffer().  NumPy arrays (and memoryviews
+    # over an entire array, such as img.data) still publish their address
+    owner = view.obj if view.obj is not None else pixelData
+    interface = getattr(owner, "__array_interface__", None)
+    if interface is not None and interface.get("strides") is None and memoryview(owner).nbytes == view.nbytes:
+        return interface["data"][0], (view, owner)
+    if type(owner) == bytes and len(owner) == view.nbytes:
+        return owner, (view, owner)
+
+    # Anything else read-only (e.g. a sliced read-only memoryview) falls back to a single copy
+    data = view.tobytes()
+    return data, data
+
+
 class AlprStreamRecognizedFrameC(ctypes.Structure):
     _fields_ = [("image_available",     ctypes.c_bool),
                 ("jpeg_bytes",          ctypes.c_void_p),
@@ -43,129 +120,371 @@ class AlprStreamRecognizedFrameC(ctypes.Structure):
                ]
 
 
-class AlprStream:
-    def __init__(self, frame_queue_size, use_motion_detection=1):
+class AlprStreamRecognizedBatchC(ctypes.Structure):
+    _fields_ = [("results_array",       ctypes.POINTER(AlprStreamRecognizedFrameC)),
+                ("results_size",        ctypes.c_int)
+               ]
+
+
+class AlprStreamRecognizedFrame(object):
+    """
+    The result for a single processed frame, copied out of the native response.
+    The recognition JSON is kept as raw bytes and only decoded when .results is read.
+    """
+    __slots__ = ("image_available", "jpeg_bytes", "frame_epoch_time_ms", "frame_number", "results_str", "_results",
+                 "jpeg_handle")
+
+    def __init__(self, image_available, jpeg_bytes, frame_epoch_time_ms, frame_number, results_str, jpeg_handle=None):
+        self.image_available = image_available
+        self.jpeg_bytes = jpeg_bytes
+        self.frame_epoch_time_ms = frame_epoch_time_ms
+        self.frame_number = frame_number
+        self.results_str = results_str
+        self._results = None
+        self.jpeg_handle = jpeg_handle
+
+    @classmethod
+    def from_struct(cls, frame_struct, jpeg_store=None):
         """
-        Initializes an AlprStream instance in memory.
-        :param frame_queue_size: The size of the video buffer to be filled by incoming video frames
-        :param use_motion_detection: Whether or not to enable motion detection on this stream
+        Copies a native AlprStreamRecognizedFrameC.  The struct may be freed once this returns.
+        :param frame_struct: An AlprStreamRecognizedFrameC instance
+        :param jpeg_store: Optional store with put_from_pointer(address, length), such as an
+            alprstream_blobstore.MmapBlobStore.  The JPEG is copied there and jpeg_handle is set instead of jpeg_bytes
+        :return: A new AlprStreamRecognizedFrame
+        """
+        jpeg_bytes = None
+        jpeg_handle = None
+        if frame_struct.image_available and frame_struct.jpeg_bytes and frame_struct.jpeg_bytes_size > 0:
+            if jpeg_store is not None:
+                jpeg_handle = jpeg_store.put_from_pointer(frame_struct.jpeg_bytes, frame_struct.jpeg_bytes_size)
+            else:
+                jpeg_bytes = ctypes.string_at(frame_struct.jpeg_bytes, frame_struct.jpeg_bytes_size)
+        return cls(bool(frame_struct.image_available), jpeg_bytes, frame_struct.frame_epoch_time_ms,
+                   frame_struct.frame_number, frame_struct.results_str, jpeg_handle)
+
+    @property
+    def results(self):
+        """
+        The OpenALPR recognition results for this frame, parsed from JSON on first access.
+        :return: A dict with the recognition results, or None if the frame carries no results
+        """
+        if self._results is None and self.results_str:
+            self._results = json.loads(_convert_from_charp(self.results_str))
+        return self._results
+
+    def __repr__(self):
+        return "AlprStreamRecognizedFrame(frame_number=%d, frame_epoch_time_ms=%d, image_available=%s)" % \
+               (self.frame_number, self.frame_epoch_time_ms, self.image_available)
+
+
+def _frame_response_bytes(frame_struct, frame):
+    # Native size of one frame of a response: the struct, its JPEG and its NUL-terminated results string
+    return (ctypes.sizeof(AlprStreamRecognizedFrameC) + max(frame_struct.jpeg_bytes_size, 0) +
+            len(frame.results_str or b"") + 1)
+
+
+class NativeAllocations(object):
+    """
+    Debug counters of the native responses one stream has taken from the library and not yet freed.
+    Every response is freed before the call that took it returns, so outstanding and outstanding_bytes
+    go back to 0 between calls.  A value that keeps growing is a leak.
+    Sizes are those of the data copied out of each response, not of the library's allocator blocks.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.taken = 0
+        self.freed = 0
+        self.outstanding = 0
+        self.outstanding_bytes = 0
+        self.peak_outstanding = 0
+        self.peak_bytes = 0
+        self.bytes_freed = 0
+        self.outstanding_by_kind = {"string": 0, "frame": 0, "batch": 0}
+
+    def record_taken(self, kind):
+        with self._lock:
+            self.taken += 1
+            self.outstanding += 1
+            self.outstanding_by_kind[kind] = self.outstanding_by_kind.get(kind, 0) + 1
+            self.peak_outstanding = max(self.peak_outstanding, self.outstanding)
+
+    def record_size(self, size):
+        with self._lock:
+            self.outstanding_bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.outstanding_bytes)
+
+    def record_freed(self, kind, size):
+        with self._lock:
+            self.freed += 1
+            self.outstanding -= 1
+            self.outstanding_by_kind[kind] -= 1
+            self.outstanding_bytes -= size
+            self.bytes_freed += size
+
+    def snapshot(self):
+        """
+        :return: The counters as a dict
+        """
+        with self._lock:
+            return {"taken": self.taken, "freed": self.freed, "outstanding": self.outstanding,
+                    "outstanding_bytes": self.outstanding_bytes, "peak_outstanding": self.peak_outstanding,
+                    "peak_bytes": self.peak_bytes, "bytes_freed": self.bytes_freed,
+                    "outstanding_by_kind": dict(self.outstanding_by_kind)}
+
+    def __repr__(self):
+        return "NativeAllocations(%d outstanding, %d bytes, %d taken, %d freed)" % (
+            self.outstanding, self.outstanding_bytes, self.taken, self.freed)
+
+
+class NativeResponse(object):
+    """
+    Owns one response allocated by the native library and frees it exactly once: on release(), when a
+    with block around it ends, or, if neither happened, when the handle is garbage collected.
+    A handle is used by the thread that took the response and is not shared.
+    """
+    __slots__ = ("pointer", "kind", "size", "_free", "_allocations")
+
+    def __init__(self, pointer, free, kind, allocations=None):
+        """
+        :param pointer: The response, or a NULL pointer for none
+        :param free: The library function that frees it
+        :param kind: "string", "frame" or "batch"
+        :param allocations: Optional NativeAllocations counting the response until it is freed
+        """
+        self.pointer = pointer if pointer else None
+        self.kind = kind
+        self.size = 0
+        self._free = free
+        self._allocations = allocations
+        if self.pointer is not None and allocations is not None:
+            allocations.record_taken(kind)
+
+    def set_size(self, size):
         """
+        Records the size of the response once it is known, for the allocation counters.
+        """
+        if self.pointer is not None and self._allocations is not None:
+            self._allocations.record_size(size - self.size)
+        self.size = size
+
+    def release(self):
+        """
+        Frees the response.  Calling release more than once is harmless.
+        """
+        pointer = self.pointer
+        if pointer is None:
+            return
+        self.pointer = None
+        self._free(pointer)
+        if self._allocations is not None:
+            self._allocations.record_freed(self.kind, self.size)
+
+    def __bool__(self):
+        return self.pointer is not None
+
+    __nonzero__ = __bool__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __del__(self):
+        if getattr(self, "pointer", None) is not None:
+            self.release()
+
+    def __repr__(self):
+        return "NativeResponse(%s, %s)" % (self.kind, "freed" if self.pointer is None else "%d bytes" % self.size)
+
 
-        # platform.system() calls popen which is not threadsafe on Python 2.x
-        mutex.acquire()
+class _AlprStreamLibrary(object):
+    """
+    The loaded ALPRStream shared library together with its typed function prototypes.
+    One instance per library path is shared by every AlprStream, see _load_library().
+    """
+
+    def __init__(self, library_path):
         try:
-            # Load the .dll for Windows and the .so for Unix-based
-            if platform.system().lower().find("windows") != -1:
-                self._alprstreampy_lib = ctypes.cdll.LoadLibrary("libalprstream.dll")
-            elif platform.system().lower().find("darwin") != -1:
-                self._alprstreampy_lib = ctypes.cdll.LoadLibrary("libalprstream.dylib")
-            else:
-                self._alprstreampy_lib = ctypes.cdll.LoadLibrary("/storage/projects/alpr/modules/alprstream/build/libalprstream.so")
+            library = ctypes.cdll.LoadLibrary(library_path)
         except OSError as e:
-            nex = OSError("Unable to locate the ALPRStream library. Please make sure that ALPRStream is properly "
-                          "installed on your system and that the libraries are in the appropriate paths.")
+            nex = OSError("Unable to locate the ALPRStream library (%s). Please make sure that ALPRStream is properly "
+                          "installed on your system and that the libraries are in the appropriate paths, or set "
+                          "%s to the full library path." % (library_path, LIBRARY_PATH_ENV))
             if _PYTHON_3:
                 nex.__cause__ = e
             raise nex
 
-        self.is_loaded = False
+        self.library_path = library_path
+        self.library = library
+
+        self.initialize_func = library.alprstream_init
+        self.initialize_func.restype = ctypes.c_void_p
+        self.initialize_func.argtypes = [ctypes.c_uint, ctypes.c_uint]
+
+        self.dispose_func = library.alprstream_cleanup
+        self.dispose_func.argtypes = [ctypes.c_void_p]
+        self.dispose_func.restype = ctypes.c_bool
+
+        self.get_queue_size_func = library.alprstream_get_queue_size
+        self.get_queue_size_func.restype = ctypes.c_uint
+        self.get_queue_size_func.argtypes = [ctypes.c_void_p]
+
+        self.connect_video_stream_url_func = library.alprstream_connect_video_stream_url
+        self.connect_video_stream_url_func.restype = ctypes.c_void_p
+        self.connect_video_stream_url_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+
+        self.disconnect_video_stream_func = library.alprstream_disconnect_video_stream
+        self.disconnect_video_stream_func.restype = ctypes.c_void_p
+        self.disconnect_video_stream_func.argtypes = [ctypes.c_void_p]
+
+        self.connect_video_file_func = library.alprstream_connect_video_file
+        self.connect_video_file_func.restype = ctypes.c_void_p
+        self.connect_video_file_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_longlong]
+
+        self.disconnect_video_file_func = library.alprstream_disconnect_video_file
+        self.disconnect_video_file_func.restype = ctypes.c_void_p
+        self.disconnect_video_file_func.argtypes = [ctypes.c_void_p]
 
-        self._initialize_func = self._alprstreampy_lib.alprstream_init
-        self._initialize_func.restype = ctypes.c_void_p
-        self._initialize_func.argtypes = [ctypes.c_uint, ctypes.c_uint]
+        self.video_file_active_func = library.alprstream_video_file_active
+        self.video_file_active_func.restype = ctypes.c_uint
+        self.video_file_active_func.argtypes = [ctypes.c_void_p]
 
-        self._dispose_func = self._alprstreampy_lib.alprstream_cleanup
-        self._dispose_func.argtypes = [ctypes.c_void_p]
-        self._dispose_func.restype = ctypes.c_bool
+        self.get_stream_url_func = library.alprstream_get_stream_url
+        self.get_stream_url_func.restype = ctypes.c_void_p
+        self.get_stream_url_func.argtypes = [ctypes.c_void_p]
 
-        self._get_queue_size_func = self._alprstreampy_lib.alprstream_get_queue_size
-        self._get_queue_size_func.restype = ctypes.c_uint
-        self._get_queue_size_func.argtypes = [ctypes.c_void_p]
+        self.get_video_file_fps_func = library.alprstream_get_video_file_fps
+        self.get_video_file_fps_func.restype = ctypes.c_double
+        self.get_video_file_fps_func.argtypes = [ctypes.c_void_p]
 
-        self._connect_video_stream_url_func = self._alprstreampy_lib.alprstream_connect_video_stream_url
-        self._connect_video_stream_url_func.restype = ctypes.c_void_p
-        self._connect_video_stream_url_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        self.process_frame_func = library.alprstream_process_frame
+        self.process_frame_func.restype = ctypes.POINTER(AlprStreamRecognizedFrameC)
+        self.process_frame_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
-        self._disconnect_video_stream_func = self._alprstreampy_lib.alprstream_disconnect_video_stream
-        self._disconnect_video_stream_func.restype = ctypes.c_void_p
-        self._disconnect_video_stream_func.argtypes = [ctypes.c_void_p]
+        self.free_frame_response_func = library.alprstream_free_frame_response
+        self.free_frame_response_func.restype = ctypes.c_void_p
+        self.free_frame_response_func.argtypes = [ctypes.c_void_p]
 
-        self._connect_video_file_func = self._alprstreampy_lib.alprstream_connect_video_file
-        self._connect_video_file_func.restype = ctypes.c_void_p
-        self._connect_video_file_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint]
+        self.push_frame_encoded_func = library.alprstream_push_frame_encoded
+        self.push_frame_encoded_func.restype = ctypes.c_uint
+        self.push_frame_encoded_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_longlong, ctypes.c_longlong]
 
-        self._disconnect_video_file_func = self._alprstreampy_lib.alprstream_disconnect_video_file
-        self._disconnect_video_file_func.restype = ctypes.c_void_p
-        self._disconnect_video_file_func.argtypes = [ctypes.c_void_p]
+        self.push_frame_func = library.alprstream_push_frame
+        self.push_frame_func.restype = ctypes.c_uint
+        self.push_frame_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_longlong]
 
-        self._video_file_active_func = self._alprstreampy_lib.alprstream_video_file_active
-        self._video_file_active_func.restype = ctypes.c_uint
-        self._video_file_active_func.argtypes = [ctypes.c_void_p]
+        self.process_batch_func = library.alprstream_process_batch
+        self.process_batch_func.restype = ctypes.POINTER(AlprStreamRecognizedBatchC)
+        self.process_batch_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
-        self._process_frame_func = self._alprstreampy_lib.alprstream_process_frame
-        self._process_frame_func.restype = ctypes.c_void_p
-        self._process_frame_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self.free_batch_response_func = library.alprstream_free_batch_response
+        self.free_batch_response_func.restype = ctypes.c_void_p
+        self.free_batch_response_func.argtypes = [ctypes.c_void_p]
 
-        self._free_frame_response_func = self._alprstreampy_lib.alprstream_free_frame_response
-        self._free_frame_response_func.restype = ctypes.c_void_p
-        self._free_frame_response_func.argtypes = [ctypes.c_void_p]
+        self.pop_completed_groups_func = library.alprstream_pop_completed_groups
+        self.pop_completed_groups_func.restype = ctypes.c_void_p
+        self.pop_completed_groups_func.argtypes = [ctypes.c_void_p]
 
-        self._push_frame_encoded_func = self._alprstreampy_lib.alprstream_push_frame
-        self._push_frame_encoded_func.restype = ctypes.c_uint
-        self._push_frame_encoded_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_longlong, ctypes.c_uint]
+        self.free_response_string_func = library.alprstream_free_response_string
+        self.free_response_string_func.restype = None
+        self.free_response_string_func.argtypes = [ctypes.c_void_p]
 
-        self._push_frame_func = self._alprstreampy_lib.alprstream_push_frame
-        self._push_frame_func.restype = ctypes.c_uint
-        self._push_frame_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint, ctypes.c_uint, ctypes.c_uint, ctypes.c_uint]
+        self.peek_active_groups_func = library.alprstream_peek_active_groups
+        self.peek_active_groups_func.restype = ctypes.c_void_p
+        self.peek_active_groups_func.argtypes = [ctypes.c_void_p]
 
-        self._process_batch_func = self._alprstreampy_lib.alprstream_process_batch
-        self._process_batch_func.restype = ctypes.c_void_p
-        self._process_batch_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self.combine_grouping_func = library.alprstream_combine_grouping
+        self.combine_grouping_func.restype = ctypes.c_void_p
+        self.combine_grouping_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
 
-        self._free_batch_response_func = self._alprstreampy_lib.alprstream_free_batch_response
-        self._free_batch_response_func.restype = ctypes.c_void_p
-        self._free_batch_response_func.argtypes = [ctypes.c_void_p]
+        self.set_uuid_format_func = library.alprstream_set_uuid_format
+        self.set_uuid_format_func.restype = ctypes.c_void_p
+        self.set_uuid_format_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
 
-        self._pop_completed_groups_func = self._alprstreampy_lib.alprstream_pop_completed_groups
-        self._pop_completed_groups_func.restype = ctypes.c_void_p
-        self._pop_completed_groups_func.argtypes = [ctypes.c_void_p]
+        self.set_env_parameters_func = library.alprstream_set_env_parameters
+        self.set_env_parameters_func.restype = ctypes.c_void_p
+        self.set_env_parameters_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
 
-        self._free_response_string_func = self._alprstreampy_lib.alprstream_free_response_string
-        self._free_response_string_func.argtypes = [ctypes.c_void_p]
+        self.set_detection_mask_encoded_func = library.alprstream_set_detection_mask_encoded
+        self.set_detection_mask_encoded_func.restype = ctypes.c_void_p
+        self.set_detection_mask_encoded_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_longlong,
+                                                         ctypes.c_longlong]
 
-        self._peek_active_groups_func = self._alprstreampy_lib.alprstream_peek_active_groups
-        self._peek_active_groups_func.restype = ctypes.c_char_p
-        self._peek_active_groups_func.argtypes = [ctypes.c_void_p]
+        self.set_detection_mask_func = library.alprstream_set_detection_mask
+        self.set_detection_mask_func.restype = ctypes.c_void_p
+        self.set_detection_mask_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                                 ctypes.c_int, ctypes.c_longlong]
 
-        self._combine_grouping_func = self._alprstreampy_lib.alprstream_combine_grouping
-        self._combine_grouping_func.restype = ctypes.c_void_p
-        self._combine_grouping_func.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self.set_jpeg_compression_func = library.alprstream_set_jpeg_compression
+        self.set_jpeg_compression_func.restype = ctypes.c_void_p
+        self.set_jpeg_compression_func.argtypes = [ctypes.c_void_p, ctypes.c_int]
 
-        self._set_uuid_format_func = self._alprstreampy_lib.alprstream_set_uuid_format
-        self._set_uuid_format_func.restype = ctypes.c_void_p
-        self._set_uuid_format_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        self.set_encode_jpeg_func = library.alprstream_set_encode_jpeg
+        self.set_encode_jpeg_func.restype = ctypes.c_void_p
+        self.set_encode_jpeg_func.argtypes = [ctypes.c_void_p, ctypes.c_int]
 
-        self._set_env_parameters_func = self._alprstreampy_lib.alprstream_set_env_parameters
-        self._set_env_parameters_func.restype = ctypes.c_void_p
-        self._set_env_parameters_func.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
 
-        self._set_detection_mask_encoded_func = self._alprstreampy_lib.alprstream_set_detection_mask
-        self._set_detection_mask_encoded_func.restype = ctypes.c_void_p
-        self._set_detection_mask_encoded_func.argtypes = [ctypes.c_void_p, ctypes.c_ubyte, ctypes.c_longlong]
+def _default_library_path():
+    # Load the .dll for Windows and the .so for Unix-based.  sys.platform is used rather than
+    # platform.system(), which calls popen and is not threadsafe on Python 2.x
+    path = os.environ.get(LIBRARY_PATH_ENV)
+    if path:
+        return path
+    if sys.platform.startswith("win"):
+        return "libalprstream.dll"
+    elif sys.platform == "darwin":
+        return "libalprstream.dylib"
+    return "libalprstream.so"
 
-        self._set_detection_mask_func = self._alprstreampy_lib.alprstream_set_detection_mask
-        self._set_detection_mask_func.restype = ctypes.c_void_p
-        self._set_detection_mask_func.argypes = [ctypes.c_void_p, ctypes.c_ubyte, ctypes.c_int, ctypes.c_int, ctypes.c_int]
 
-        self._set_jpeg_compression_func = self._alprstreampy_lib.alprstream_set_jpeg_compression
-        self._set_jpeg_compression_func.restype = ctypes.c_void_p
-        self._set_jpeg_compression_func.argtypes = [ctypes.c_void_p, ctypes.c_int]
+def _load_library(library_path=None):
+    """
+    Returns the process-wide binding for the ALPRStream library, loading it on first use.
+    :param library_path: Path to the library, or None for the default location
+    :return: An _AlprStreamLibrary
+    """
+    if library_path is None:
+        library_path = _default_library_path()
+    binding = _libraries.get(library_path)
+    if binding is None:
+        with mutex:
+            binding = _libraries.get(library_path)
+            if binding is None:
+                binding = _AlprStreamLibrary(library_path)
+                _libraries[library_path] = binding
+    return binding
 
-        self._set_encode_jpeg_func = self._alprstreampy_lib.alprstream_set_encode_jpeg
-        self._set_encode_jpeg_func.restype = ctypes.c_void_p
-        self._set_encode_jpeg_func.argtypes = [ctypes.c_void_p, ctypes.c_int]
 
-        self.alprstream_pointer = self._initialize_func(frame_queue_size, use_motion_detection)
+class AlprStream:
+    def __init__(self, frame_queue_size, use_motion_detection=1, library_path=None):
+        """
+        Initializes an AlprStream instance in memory.
+        :param frame_queue_size: The size of the video buffer to be filled by incoming video frames
+        :param use_motion_detection: Whether or not to enable motion detection on this stream
+        :param library_path: Optional path to libalprstream.  Defaults to $ALPRSTREAM_LIBRARY, then the
+            platform library name resolved through the system search path
+        """
+
+        self.is_loaded = False
+        self.frame_queue_size = frame_queue_size
+        self._condition = Condition()
+        self._waiters = 0
+        self._wake_callbacks = ()
+        self._native_source = False
+        self._wait_poll = _MIN_WAIT_POLL
+        self._metrics = None
+        self._jpeg_store = None
+        self._ingest_policy = None
+        self._active_groups = None
+        self._allocations = None
+        if os.environ.get(DEBUG_ALLOCATIONS_ENV, "0") not in ("", "0"):
+            self._allocations = NativeAllocations()
+        self._lib = _load_library(library_path)
+
+        self.alprstream_pointer = self._lib.initialize_func(frame_queue_size, use_motion_detection)
+        self.is_loaded = bool(self.alprstream_pointer)
 
     def initialize(self, frame_queue_size, use_motion_detection=True):
         self.alprstream_init(frame_queue_size, use_motion_detection)
@@ -174,10 +493,12 @@ class AlprStream:
     def get_queue_size(self):
         """
         Check the size of the video buffer
-        :return: The total number of images waiting to be processed on the video buffer
+        :return: The total number of images waiting to be processed on the video buffer, or 0 once the stream is closed
         """
-        size = self._get_queue_size_func(self.alprstream_pointer)
-        return size
+        with self._condition:
+            if not self.is_loaded:
+                return 0
+            return self._lib.get_queue_size_func(self.alprstream_pointer)
 
     def connect_video_stream_url(self, url, gstreamer_pipeline_format=""):
         """
@@ -187,13 +508,14 @@ class AlprStream:
         """
         url = _convert_to_charp(url)
         gstreamer_pipeline_format = _convert_to_charp(gstreamer_pipeline_format)
-        self._connect_video_stream_url_func(self.alprstream_pointer, url, gstreamer_pipeline_format)
+        self._lib.connect_video_stream_url_func(self.alprstream_pointer, url, gstreamer_pipeline_format)
+        self._native_source = True
 
     def disconnect_video_stream(self):
         """
         Disconnect the video stream if you no longer wish for it to push frames to the video buffer.
         """
-        self._disconnect_video_stream_func(self.alprstream_pointer)
+        self._lib.disconnect_video_stream_func(self.alprstream_pointer)
 
     def connect_video_file(self, video_file_path, video_start_time):
         """
@@ -202,20 +524,21 @@ class AlprStream:
         :param video_start_time: The start time of the video in epoch ms. This time is used as an offset for identifying the epoch time for each frame in the video
         """
         video_file_path = _convert_to_charp(video_file_path)
-        self._connect_video_file_func(self.alprstream_pointer, video_file_path, video_start_time)
+        self._lib.connect_video_file_func(self.alprstream_pointer, video_file_path, video_start_time)
+        self._native_source = True
 
     def disconnect_video_file(self):
         """
         If you wish to stop the video, calling this function will remove it from the stream
         """
-        self._disconnect_video_file_func(self.alprstream_pointer)
+        self._lib.disconnect_video_file_func(self.alprstream_pointer)
 
     def video_file_active(self):
         """
         Check the status of the video file thread
         :return: True if currently active, false if inactive or complete
         """
-        status = self._video_file_active_func(self.alprstream_pointer)
+        status = self._lib.video_file_active_func(self.alprstream_pointer)
         return status
 
     def get_stream_url(self):
@@ -223,33 +546,168 @@ class AlprStream:
         Get the stream URL.
         :return: the stream URL that is currently being used to stream
         """
-        url = self._get_stream_url_func(self.alprstream_pointer)
-        url = _convert_to_charp(url)
-        return url
+        ptr = self._lib.get_stream_url_func(self.alprstream_pointer)
+        if not ptr:
+            return ""
+        return _convert_from_charp(self._take_response_string(ptr))
 
     def get_video_file_fps(self):
         """
         Get the frames per second for the video file.
         return: Get the frames per second for the video file.
         """
-        frames = self._get_video_file_fps_func(self.alprstream_pointer)
+        frames = self._lib.get_video_file_fps_func(self.alprstream_pointer)
         return frames
 
     def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
         """
         Push raw image data onto the video input buffer.
+        The pixel data is passed to the native library by address and is never copied on the
+        Python side, provided it is a C-contiguous buffer (bytes, bytearray, mmap, memoryview
+        or a NumPy array such as the image returned by cv2.imread).
         :param pixelData: raw image bytes for BGR channels
         :param bytesPerPixel: Number of bytes for each pixel (e.g., 3)
         :param imgWidth: Width of the image in pixels
         :param imgHeight: Height of the image in pixels
         :param frame_epoch_time: The time when the image was captured. If not specified current time will be used
         :return: The video input buffer size after adding this image
+        :raises RuntimeError: If the stream has been closed
         """
-        pixelData = _convert_to_charp(pixelData)
-        videoBufferSize = self._push_frame_func(self.alprstream_pointer, pixelData, bytesPerPixel, imgWidth, imgHeight,
-                                                frame_epoch_time)
+        policy = self._ingest_policy
+        if policy is not None and not policy.admit(self, frame_epoch_time):
+            return self.get_queue_size()
+        metrics = self._metrics
+        if metrics is not None:
+            started = _perf_counter()
+        pointer, keepalive = _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        if metrics is not None:
+            native_started = _perf_counter()
+        # Pushed under the condition so close() cannot dispose the stream during the call
+        with self._condition:
+            if not self.is_loaded:
+                raise RuntimeError("push_frame called on a closed AlprStream")
+            videoBufferSize = self._lib.push_frame_func(self.alprstream_pointer, pointer, bytesPerPixel, imgWidth,
+                                                        imgHeight, frame_epoch_time)
+            if self._waiters:
+                self._wake()
+        del keepalive
+        if metrics is not None:
+            metrics.record_push(started, native_started, _perf_counter(), bytesPerPixel * imgWidth * imgHeight,
+                                videoBufferSize)
         return videoBufferSize
 
+    def _notify_waiters(self):
+        with self._condition:
+            self._wake()
+
+    def _wake(self):
+        # Caller holds the condition
+        self._condition.notify_all()
+        for callback in self._wake_callbacks:
+            callback()
+
+    def add_wake_callback(self, callback):
+        """
+        Registers a callable that is called whenever threads in wait_for_frames, wait_for_room or
+        wait_for_completed_groups would be woken: after push_frame, process_frame and process_batch, and on
+        close().  This lets one thread wait on many streams.  The callback runs on the calling thread with the stream's condition held,
+        so it must return quickly and must not call into the stream.
+        :param callback: A callable taking no arguments
+        """
+        with self._condition:
+            self._wake_callbacks = self._wake_callbacks + (callback,)
+            self._waiters += 1
+
+    def remove_wake_callback(self, callback):
+        """
+        Unregisters one registration of a callback added with add_wake_callback.  Unknown callbacks are ignored.
+        """
+        with self._condition:
+            callbacks = list(self._wake_callbacks)
+            if callback in callbacks:
+                callbacks.remove(callback)
+                self._wake_callbacks = tuple(callbacks)
+                self._waiters -= 1
+
+    def _wait(self, ready, timeout):
+        # Calls ready() until it returns a true value or the timeout expires, and returns its last value.
+        # push_frame and process_batch wake waiters directly.  Frames added by a native video thread
+        # do not, so while one is connected the check is repeated with an adaptive backoff
+        deadline = None if timeout is None else _monotonic() + timeout
+        with self._condition:
+            self._waiters += 1
+            try:
+                poll = self._wait_poll
+                while True:
+                    value = ready()
+                    if value or not self.is_loaded:
+                        # Work turned up: start the next wait with a shorter poll interval
+                        self._wait_poll = max(_MIN_WAIT_POLL, poll / 2.0)
+                        return value
+                    remaining = None if deadline is None else deadline - _monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return value
+                    wait = remaining
+                    if self._native_source:
+                        wait = poll if remaining is None else min(poll, remaining)
+                        poll = min(poll * 2, _MAX_WAIT_POLL)
+                    self._condition.wait(wait)
+            finally:
+                self._waiters -= 1
+
+    def wait_for_frames(self, min_count=1, timeout=None):
+        """
+        Blocks until the video buffer holds at least min_count frames.
+        Frames pushed with push_frame wake the caller immediately.  Frames from connect_video_file or
+        connect_video_stream_url are noticed by polling with a backoff between 1 and 50 ms.
+        :param min_count: The number of queued frames to wait for
+        :param timeout: Maximum seconds to wait, or None to wait indefinitely
+        :return: The queue size when the wait ended.  Less than min_count if the timeout expired or the stream was closed
+        """
+        min_count = max(1, min_count)
+
+        def ready():
+            if not self.is_loaded:
+                return 0
+            size = self.get_queue_size()
+            return size if size >= min_count else 0
+
+        size = self._wait(ready, timeout)
+        if size:
+            return size
+        # Checked under the condition, so a concurrent close() cannot dispose the stream in between
+        with self._condition:
+            return self.get_queue_size() if self.is_loaded else 0
+
+    def wait_for_room(self, timeout=None):
+        """
+        Blocks until the video buffer has room for another frame, so that a producer can push without the
+        library dropping frames.  The caller is woken by process_frame and process_batch on this stream.
+        :param timeout: Maximum seconds to wait, or None to wait indefinitely
+        :return: The number of free places in the buffer.  0 if the timeout expired or the stream was closed
+        """
+        def ready():
+            if not self.is_loaded:
+                return 0
+            return max(0, self.frame_queue_size - self.get_queue_size())
+
+        return self._wait(ready, timeout)
+
+    def wait_for_completed_groups(self, timeout=None):
+        """
+        Blocks until at least one plate group is complete, then pops all completed groups.
+        Groups complete while batches are processed, so the caller is woken by process_batch and
+        process_frame on this stream, including calls made from other threads.
+        :param timeout: Maximum seconds to wait, or None to wait indefinitely
+        :return: The completed plate groups, or an empty list if the timeout expired or the stream was closed
+        """
+        def ready():
+            if not self.is_loaded:
+                return []
+            return self.pop_completed_groups()
+
+        return self._wait(ready, timeout)
+
     def set_encode_jpeg(self, always_return_jpeg):
         """
         By default, OpenALPR only encodes/returns a JPEG image if a plate is found
@@ -261,14 +719,73 @@ class AlprStream:
         :param always_return_jpeg:0=Never, 1=On Found Plates, 2=Alway
         :return:
         """
-        return self._set_encode_jpeg_func(self.alprstream_pointer, always_return_jpeg)
+        return self._lib.set_encode_jpeg_func(self.alprstream_pointer, always_return_jpeg)
+
+    def set_ingest_policy(self, policy):
+        """
+        Sets the policy deciding which frames push_frame lets into the queue.  See alprstream_policy.
+        Frames queued by connect_video_file and connect_video_stream_url are not subject to the policy.
+        :param policy: An alprstream_policy.IngestPolicy, or None to push every frame
+        """
+        self._ingest_policy = policy
+
+    @property
+    def ingest_policy(self):
+        """
+        The IngestPolicy set with set_ingest_policy, or None.
+        """
+        return self._ingest_policy
+
+    def set_jpeg_store(self, jpeg_store):
+        """
+        Routes the JPEG images of processed frames into a store instead of Python bytes.
+        Frames returned by process_frame and process_batch then have jpeg_bytes set to None and
+        jpeg_handle set to the handle returned by the store.
+        :param jpeg_store: An object with put_from_pointer(address, length), such as an
+            alprstream_blobstore.MmapBlobStore, or None to return jpeg_bytes again
+        """
+        self._jpeg_store = jpeg_store
+
+    def enable_allocation_tracking(self):
+        """
+        Starts counting the native responses this stream takes from the library and frees, a debugging aid
+        for leaks in long-running processes.  Set $ALPRSTREAM_DEBUG_ALLOCATIONS=1 to enable it on every stream.
+        :return: The NativeAllocations counters, which stay readable after the stream is closed
+        """
+        if self._allocations is None:
+            self._allocations = NativeAllocations()
+        return self._allocations
+
+    def disable_allocation_tracking(self):
+        """
+        Stops counting native responses.  Responses taken while tracking was enabled are still counted when freed.
+        """
+        self._allocations = None
+
+    @property
+    def native_allocations(self):
+        """
+        :return: The NativeAllocations of this stream, or None if allocation tracking is disabled
+        """
+        return self._allocations
+
+    def _own(self, pointer, free, kind):
+        # Takes ownership of a native response, see NativeResponse
+        return NativeResponse(pointer, free, kind, self._allocations)
+
+    def _take_response_string(self, char_ptr):
+        # Copies a char* response into Python bytes and releases the native string.  Returns None for NULL
+        with self._own(char_ptr, self._lib.free_response_string_func, "string") as response:
+            if not response:
+                return None
+            json_data = ctypes.string_at(char_ptr)
+            response.set_size(len(json_data) + 1)
+            return json_data
 
     def _convert_char_ptr_to_json(self, char_ptr):
 
-        json_data = ctypes.cast(char_ptr, ctypes.c_char_p).value
-        json_data = _convert_from_charp(json_data)
+        json_data = _convert_from_charp(self._take_response_string(char_ptr) or b"[]")
         response_obj = json.loads(json_data)
-        self._free_response_string_func(ctypes.c_void_p(char_ptr))
         return response_obj
 
     def pop_completed_groups(self):
@@ -278,19 +795,64 @@ class AlprStream:
         @return a vector containing all completed plate groups
         :return:
         """
-        ptr = self._pop_completed_groups_func(self.alprstream_pointer)
-        json_result = self._convert_char_ptr_to_json(ptr)
-        
+        metrics = self._metrics
+        if metrics is None:
+            ptr = self._lib.pop_completed_groups_func(self.alprstream_pointer)
+            return self._convert_char_ptr_to_json(ptr)
+
+        started = _perf_counter()
+        ptr = self._lib.pop_completed_groups_func(self.alprstream_pointer)
+        native_finished = _perf_counter()
+        json_data = self._take_response_string(ptr) or b"[]"
+        copied = _perf_counter()
+        json_result = json.loads(_convert_from_charp(json_data))
+        metrics.record_pop(started, native_finished, copied, _perf_counter(), len(json_data), len(json_result))
         return json_result
 
+    def pop_completed_groups_raw(self):
+        """
+        Same as pop_completed_groups, but returns the undecoded JSON array.
+        Useful when the groups are forwarded elsewhere and parsing them here would be wasted work.
+        :return: The completed plate groups as UTF-8 encoded JSON bytes
+        """
+        metrics = self._metrics
+        if metrics is None:
+            ptr = self._lib.pop_completed_groups_func(self.alprstream_pointer)
+            return self._take_response_string(ptr) or b"[]"
+
+        started = _perf_counter()
+        ptr = self._lib.pop_completed_groups_func(self.alprstream_pointer)
+        native_finished = _perf_counter()
+        json_data = self._take_response_string(ptr) or b"[]"
+        finished = _perf_counter()
+        metrics.record_pop(started, native_finished, finished, finished, len(json_data), None)
+        return json_data
+
     def peek_active_groups(self):
         """
         Checks the grouping list for active groups.  Calling this function does not
         remove any entries from the grouping queue.
         @return a full list of all currently active groups.
-        :return:
+        :return: The active plate groups as UTF-8 encoded JSON bytes
+        """
+        ptr = self._lib.peek_active_groups_func(self.alprstream_pointer)
+        if not ptr:
+            return None
+        return self._take_response_string(ptr)
+
+    def diff_active_groups(self):
+        """
+        Compares the active groups with those of the previous call.  Only groups whose JSON changed
+        are parsed, so polling costs little while few groups change; when most changed, the JSON is
+        parsed whole instead.
+        See alprstream_groups for the returned objects.
+        :return: An ActiveGroupDelta with the groups added, updated and closed since the previous call.
+            The first call reports every active group as added
         """
-        return self._peek_active_groups_func(self.alprstream_pointer)
+        if self._active_groups is None:
+            import alprstream_groups
+            self._active_groups = alprstream_groups.ActiveGroupTracker()
+        return self._active_groups.update(self.peek_active_groups())
 
     def combine_grouping(self, other_stream):
         """
@@ -299,7 +861,7 @@ class AlprStream:
         @param other_stream another AlprStream pointer for the grouping to be combined
         :return:
         """
-        return self._combine_grouping_func(self.alprstream_pointer, other_stream)
+        return self._lib.combine_grouping_func(self.alprstream_pointer, other_stream)
 
     def set_uuid_format(self, format):
         """
@@ -313,15 +875,66 @@ class AlprStream:
         :return:
         """
         format = _convert_to_charp(format)
-        self.set_uuid_format_func(self.alprstream_pointer, format)
+        self._lib.set_uuid_format_func(self.alprstream_pointer, format)
 
-    def process_frame(self, alpr_instance):
+    def set_detection_mask_encoded(self, mask_bytes, frame_epoch_time=-1):
+        """
+        Sets a mask limiting where plates are detected.  White areas are searched, black areas are ignored.
+        The frames are still pushed and processed in full, see alprstream_roi to crop them instead.
+        :param mask_bytes: The mask as an encoded image (e.g., the bytes of a PNG file)
+        :param frame_epoch_time: Time from which the mask applies.  If not specified current time will be used
+        :return:
+        """
+        mask_bytes = bytes(mask_bytes)
+        self._lib.set_detection_mask_encoded_func(self.alprstream_pointer, mask_bytes, len(mask_bytes),
+                                                  frame_epoch_time)
 
-        struct_response = self._process_batch_func(self.alprstream_pointer, alpr_instance.alpr_pointer)
-        copy_val = ctypes.cast(struct_response, ctypes.POINTER(AlprStreamRecognizedFrameC))
-        self._free_frame_response_func(ctypes.c_void_p(struct_response))
-        return copy_val
+    def set_detection_mask(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Sets a mask limiting where plates are detected, from raw pixels laid out like push_frame's.
+        :param pixelData: raw mask image bytes, white where plates may be detected
+        :param bytesPerPixel: Number of bytes for each pixel (e.g., 3)
+        :param imgWidth: Width of the mask in pixels
+        :param imgHeight: Height of the mask in pixels
+        :param frame_epoch_time: Time from which the mask applies.  If not specified current time will be used
+        :return:
+        """
+        pointer, keepalive = _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        self._lib.set_detection_mask_func(self.alprstream_pointer, pointer, bytesPerPixel, imgWidth, imgHeight,
+                                          frame_epoch_time)
+        del keepalive
 
+    def process_frame(self, alpr_instance):
+        """
+        Process the image at the front of the queue and return the result.
+        :param: alpr The Alpr instance that you wish to use for processing the image
+        :return: An AlprStreamRecognizedFrame, or None if no frame was processed
+        """
+        metrics = self._metrics
+        policy = self._ingest_policy
+        if metrics is not None or policy is not None:
+            started = _perf_counter()
+        struct_response = self._lib.process_frame_func(self.alprstream_pointer, alpr_instance.alpr_pointer)
+        if metrics is not None:
+            native_finished = _perf_counter()
+        if self._waiters:
+            self._notify_waiters()
+        if not struct_response:
+            if metrics is not None:
+                metrics.record_process("process_frame", started, native_finished, _perf_counter(), 0, False)
+            return None
+        try:
+            with self._own(struct_response, self._lib.free_frame_response_func, "frame") as response:
+                frame_struct = struct_response.contents
+                frame = AlprStreamRecognizedFrame.from_struct(frame_struct, self._jpeg_store)
+                if self._allocations is not None:
+                    response.set_size(_frame_response_bytes(frame_struct, frame))
+            if policy is not None:
+                policy.observe_batch(self, [frame], _perf_counter() - started)
+            return frame
+        finally:
+            if metrics is not None:
+                metrics.record_process("process_frame", started, native_finished, _perf_counter(), 1, True)
 
     def process_batch(self, alpr_instance):
         """
@@ -331,22 +944,93 @@ class AlprStream:
         You should make sure that the video buffer size for this AlprStream object is
         greater than or equal to the configured GPU batch size (in openalpr.conf).
         :param: alpr The Alpr instance that you wish to use for processing the images
-        :return: An array of the results for all recognized frames that were processed
+        :return: A list of AlprStreamRecognizedFrame results for all recognized frames that were processed
         """
-        struct_response = self._process_batch_func(self.alprstream_pointer, alpr_instance.alpr_pointer)
-        copy_val = ""
-        self._free_batch_response_func(ctypes.c_void_p(struct_response))
-        return copy_val
+        metrics = self._metrics
+        policy = self._ingest_policy
+        if metrics is not None or policy is not None:
+            started = _perf_counter()
+        struct_response = self._lib.process_batch_func(self.alprstream_pointer, alpr_instance.alpr_pointer)
+        if metrics is not None:
+            native_finished = _perf_counter()
+        if self._waiters:
+            self._notify_waiters()
+        if not struct_response:
+            if metrics is not None:
+                metrics.record_process("process_batch", started, native_finished, _perf_counter(), 0, False)
+            return []
+        results = []
+        try:
+            with self._own(struct_response, self._lib.free_batch_response_func, "batch") as response:
+                batch = struct_response.contents
+                results_array = batch.results_array
+                jpeg_store = self._jpeg_store
+                results = [AlprStreamRecognizedFrame.from_struct(results_array[i], jpeg_store)
+                           for i in range(batch.results_size)]
+                if self._allocations is not None:
+                    response.set_size(ctypes.sizeof(AlprStreamRecognizedBatchC) +
+                                      sum(_frame_response_bytes(results_array[i], frame)
+                                          for i, frame in enumerate(results)))
+            if policy is not None:
+                policy.observe_batch(self, results, _perf_counter() - started)
+            return results
+        finally:
+            if metrics is not None:
+                metrics.record_process("process_batch", started, native_finished, _perf_counter(), len(results),
+                                       True)
 
-    def __del__(self):
-        if self.is_loaded:
+    def enable_metrics(self, name=None, registry=None):
+        """
+        Starts recording latency histograms and counters for this stream's hot-path calls.
+        See alprstream_metrics for the exported metrics and the HTTP exporter.
+        :param name: The stream label used when exporting.  Defaults to a generated "stream-N"
+        :param registry: Optional alprstream_metrics.MetricsRegistry.  Defaults to its default_registry
+        :return: The StreamMetrics that this stream records into
+        """
+        import alprstream_metrics
+        registry = registry or alprstream_metrics.default_registry
+        self._metrics = registry.stream(name)
+        return self._metrics
+
+    def disable_metrics(self):
+        """
+        Stops recording metrics.  Values recorded so far stay in the registry.
+        """
+        self._metrics = None
+
+    @property
+    def metrics(self):
+        """
+        :return: The StreamMetrics this stream records into, or None if metrics are disabled
+        """
+        return self._metrics
+
+    def close(self):
+        """
+        Stops any connected video source and releases the native stream.
+        The instance cannot be used afterwards.  Calling close more than once is harmless.
+        """
+        # Disposed under the condition: waiters only call into the library while holding it and
+        # after checking is_loaded, so none can use the pointer once it is freed
+        with self._condition:
+            if not self.is_loaded:
+                return
             self.is_loaded = False
-            self._dispose_func(self.alprstream_pointer)
+            self._wake()
+            self._lib.dispose_func(self.alprstream_pointer)
+
+    def __del__(self):
+        if getattr(self, "is_loaded", False):
+            self.close()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.is_loaded:
-            self.is_loaded = False
-            self._dispose_func(self.alprstream_pointer)
+        self.close()
+
+
+if __name__ == '__main__':
+    # python -m alprstream run|bench, see alprstream_runner
+    from alprstream_runner import main
+    sys.exit(main())
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio front-end for AlprStream.
+
+Native calls that block (process_batch, push_frame, pop_completed_groups and cleanup) run
+on a small thread pool that is shared by every AsyncAlprStream, so any number of cameras
+can be driven from one event loop:
+
+    async def watch(stream, alpr):
+        async with AsyncAlprStream(stream, alpr) as camera:
+            async for group in camera.completed_groups():
+                print(group["best_plate_number"])
+
+Each AsyncAlprStream keeps at most one native call in flight, so calls against a single
+stream stay ordered and the worker pool bounds the total number of concurrent calls.
+The Alpr instance handed to a stream must not be used by another stream at the same time.
+Idle streams do not hold a thread each: a single waiter thread watches all of them.
+"""
+import asyncio
+import collections
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads in the pool shared by streams that are not given their own executor
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Bounds of the backoff, in seconds, with which the waiter checks for frames queued by a native video source
+_MIN_POLL = 0.001
+_MAX_POLL = 0.05
+
+_default_executor = None
+_frame_waiter = None
+_default_executor_lock = threading.Lock()
+
+
+class StreamClosedError(RuntimeError):
+    """Raised when a call is made on an AsyncAlprStream after aclose()."""
+
+
+def get_default_executor():
+    """
+    Returns the thread pool shared by all AsyncAlprStream instances, creating it on first use.
+    :return: A ThreadPoolExecutor with DEFAULT_WORKERS threads
+    """
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS,
+                                                       thread_name_prefix="alprstream")
+    return _default_executor
+
+
+def _resolve(future, size):
+    # Runs on the future's event loop
+    if not future.done():
+        future.set_result(size)
+
+
+class _FrameWaiter(object):
+    # One thread waiting for frames on behalf of every idle AsyncAlprStream.  push_frame and close() wake it
+    # through AlprStream.add_wake_callback, and then only the stream that woke it is checked.  Frames queued by a
+    # native video source wake nothing, so every waiting stream is also checked with a backoff from 1 to 50 ms
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._added = []
+        self._woken = set()
+        self._thread = None
+
+    def wait(self, stream, timeout):
+        # Returns a future of the running loop, resolved with the queue size once the stream has frames, is
+        # closed or timeout seconds have passed
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        wake = functools.partial(self._wake, stream)
+        stream.add_wake_callback(wake)
+        with self._condition:
+            self._added.append((stream, wake, loop, future, time.monotonic() + timeout))
+            self._woken.add(stream)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="alprstream-wait")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _wake(self, stream):
+        # Called with the stream's condition held, so it must not call into the stream
+        with self._condition:
+            self._woken.add(stream)
+            self._condition.notify()
+
+    def _run(self):
+        entries = []
+        poll = _MIN_POLL
+        next_poll = 0.0
+        while True:
+            with self._condition:
+                entries.extend(self._added)
+                del self._added[:]
+                woken = self._woken
+                self._woken = set()
+            # Streams are only called without the waiter's condition held, see _wake
+            now = time.monotonic()
+            polling = now >= next_poll
+            polled_frames = False
+            waiting = []
+            for entry in entries:
+                stream, wake, loop, future, deadline = entry
+                if not (polling or stream in woken or now >= deadline):
+                    waiting.append(entry)
+                    continue
+                size = 0 if future.done() else stream.get_queue_size()
+                if not size and not future.done() and stream.is_loaded and now < deadline:
+                    waiting.append(entry)
+                    continue
+                polled_frames = polled_frames or (size > 0 and stream not in woken)
+                stream.remove_wake_callback(wake)
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, size)
+                except RuntimeError:
+                    pass    # the loop was closed
+            entries = waiting
+            if polling:
+                poll = _MIN_POLL if polled_frames else min(poll * 2, _MAX_POLL)
+                next_poll = now + poll
+            with self._condition:
+                if self._added or self._woken:
+                    continue
+                if not entries:
+                    poll = _MIN_POLL
+                    self._condition.wait()
+                    continue
+                timeout = min(next_poll, min(entry[4] for entry in entries)) - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+
+
+def _get_frame_waiter():
+    global _frame_waiter
+    if _frame_waiter is None:
+        with _default_executor_lock:
+            if _frame_waiter is None:
+                _frame_waiter = _FrameWaiter()
+    return _frame_waiter
+
+
+class AsyncAlprStream(object):
+    def __init__(self, stream, alpr_instance, executor=None, wait_timeout=0.25):
+        """
+        Wraps an AlprStream for use from asyncio.
+        :param stream: The AlprStream to drive.  It is closed by aclose()
+        :param alpr_instance: The Alpr instance used to process batches for this stream
+        :param executor: The executor running the native calls.  Defaults to a process-wide shared pool
+        :param wait_timeout: Longest single wait, in seconds, for frames while the stream has no work.  Bounds
+            how long aclose() and cancellation wait for an idle completed_groups loop
+        """
+        self.stream = stream
+        self.alpr_instance = alpr_instance
+        self.wait_timeout = wait_timeout
+        self._executor = executor if executor is not None else get_default_executor()
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self._pending_groups = collections.deque()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _check_open(self):
+        if self._closed:
+            raise StreamClosedError("AsyncAlprStream is closed")
+
+    async def _call(self, func, *args):
+        # Runs func(*args) on the executor while holding the per-stream lock.  The native call
+        # cannot be interrupted, so when the awaiting task is cancelled the lock is only
+        # released once the call has actually returned.  That keeps aclose() from freeing the
+        # stream underneath a running call.
+        await self._lock.acquire()
+        try:
+            self._check_open()
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except BaseException:
+            self._lock.release()
+            raise
+        future.add_done_callback(lambda _: self._lock.release())
+        return await asyncio.shield(future)
+
+    def get_queue_size(self):
+        """
+        Check the size of the video buffer.  This does not block and is called directly.
+        :return: The total number of images waiting to be processed on the video buffer
+        """
+        self._check_open()
+        return self.stream.get_queue_size()
+
+    async def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Push raw image data onto the video input buffer, see AlprStream.push_frame.
+        :return: The video input buffer size after adding this image
+        """
+        return await self._call(self.stream.push_frame, pixelData, bytesPerPixel, imgWidth, imgHeight,
+                                frame_epoch_time)
+
+    async def process_batch(self):
+        """
+        Process a batch from the front of the queue, see AlprStream.process_batch.
+        :return: A list of AlprStreamRecognizedFrame results
+        """
+        return await self._call(self.stream.process_batch, self.alpr_instance)
+
+    def _pop_into_pending(self):
+        # Runs on the executor.  Groups go into the pending queue rather than being returned,
+        # so none are lost if the awaiting task is cancelled while the call is running
+        self._pending_groups.extend(self.stream.pop_completed_groups())
+
+    def _step(self, until_idle):
+        # Runs on the executor: processes a batch if frames are queued and pops the completed groups.
+        # Returns (idle, done)
+        if self.stream.get_queue_size() > 0:
+            self.stream.process_batch(self.alpr_instance)
+        self._pop_into_pending()
+        idle = self.stream.get_queue_size() == 0
+        return idle, until_idle and idle and not self.stream.video_file_active()
+
+    async def pop_completed_groups(self):
+        """
+        Pops all completed groups, see AlprStream.pop_completed_groups.
+        :return: A list of completed plate groups
+        """
+        await self._call(self._pop_into_pending)
+        groups = list(self._pending_groups)
+        self._pending_groups.clear()
+        return groups
+
+    async def completed_groups(self, until_idle=False):
+        """
+        Processes batches as frames arrive and yields every completed plate group.
+        Groups complete as batches are processed, so when the queue is empty the loop waits for frames,
+        for at most wait_timeout at a time, on a waiter thread shared by all streams.  Frames pushed with
+        push_frame wake it at once; frames from a connected video source within 50 ms.
+        :param until_idle: Stop once no video file is active and the queue is empty, instead of
+            running until the stream is closed.  Useful when processing video files
+        :return: An async iterator of plate groups
+        """
+        while True:
+            try:
+                idle, done = await self._call(self._step, until_idle)
+            except StreamClosedError:
+                return
+
+            while self._pending_groups:
+                yield self._pending_groups.popleft()
+
+            if done:
+                return
+            if idle:
+                # Not under the per-stream lock, so push_frame from other tasks is not held up.  close() wakes
+                # the waiter, which then sees the stream is no longer loaded
+                if self._closed:
+                    return
+                await _get_frame_waiter().wait(self.stream, self.wait_timeout)
+
+    async def aclose(self):
+        """
+        Waits for any native call in flight, then releases the stream with alprstream_cleanup.
+        Safe to call more than once.
+        """
+        async with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.stream.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
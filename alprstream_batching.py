@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Latency-driven batching for AlprStream.process_batch.
+
+Instead of a fixed BATCH_SIZE and a fixed sleep, AdaptiveBatchController watches how
+frames arrive on the queue and how long process_batch takes for different batch sizes,
+and from that decides when to flush:
+
+    controller = AdaptiveBatchController(stream, alpr, target_latency=0.25)
+    controller.run(on_groups=handle_groups)
+
+process_batch time is modelled as fixed_cost + per_frame_cost * frames, fitted over the
+most recent batches.  The batch size is the largest that can be processed within half
+of the target latency, and the rest of the budget is the longest the oldest queued
+frame may wait for the batch to fill.  When the fixed cost is small compared to the
+per-frame cost (typical on CPU), batching buys nothing and frames are flushed as soon
+as they arrive.
+"""
+import collections
+import threading
+import time
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * percentile / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+class AdaptiveBatchController(object):
+    def __init__(self, stream, alpr_instance, target_latency=0.5, max_batch_size=None, min_poll=0.001,
+                 window=64, latency_window=2048, use_frame_timestamps=False, batching_gain=0.1):
+        """
+        Creates a controller for one stream.
+        :param stream: The AlprStream to process
+        :param alpr_instance: The Alpr instance used for process_batch
+        :param target_latency: Target seconds from a frame entering the queue to its result being returned
+        :param max_batch_size: Upper bound for the batch size, e.g. the GPU batch size from openalpr.conf.
+            Defaults to the stream's frame_queue_size
+        :param min_poll: Shortest sleep between queue polls, in seconds
+        :param window: Number of recent batches used to fit the processing time model
+        :param latency_window: Number of recent frame latencies kept for the percentiles
+        :param use_frame_timestamps: Measure latency from each frame's frame_epoch_time_ms against the wall
+            clock.  Only meaningful for live sources.  Otherwise latency is measured from when the frame
+            arrived on the queue, placed by its frame_epoch_time_ms within the interval in which the
+            controller saw it arrive
+        :param batching_gain: Batching is disabled when the fixed cost per batch is below this fraction of
+            the per-frame cost
+        """
+        self.stream = stream
+        self.alpr_instance = alpr_instance
+        self.target_latency = target_latency
+        self.max_batch_size = max_batch_size or getattr(stream, "frame_queue_size", 0) or 10
+        self.min_poll = min_poll
+        self.use_frame_timestamps = use_frame_timestamps
+        self.batching_gain = batching_gain
+
+        self._samples = collections.deque(maxlen=window)
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._arrivals = collections.deque()     # (last time the queue was seen without the frame, first time with it)
+        self._clock_offsets = collections.deque(maxlen=window)
+        self._last_observed = None
+        self._last_queue_size = 0
+        self._fixed_cost = 0.0
+        self._per_frame_cost = 0.0
+        self._batch_size = self.max_batch_size
+        self._wait_budget = target_latency / 2.0
+        self._batches = 0
+        self._frames = 0
+
+    def _observe_queue(self, now):
+        # New frames are stamped with the interval in which they arrived: since the previous observation, until now
+        size = self.stream.get_queue_size()
+        if size > self._last_queue_size:
+            since = now if self._last_observed is None else self._last_observed
+            self._arrivals.extend([(since, now)] * (size - self._last_queue_size))
+        elif size < len(self._arrivals):
+            # Frames left the queue without us (dropped by the library or processed elsewhere)
+            for _ in range(len(self._arrivals) - size):
+                self._arrivals.popleft()
+        self._last_queue_size = size
+        self._last_observed = now
+        return size
+
+    def _fit(self):
+        # Least squares fit of duration = fixed_cost + per_frame_cost * frames over recent batches
+        count = len(self._samples)
+        if count == 0:
+            return
+        mean_n = sum(n for n, _ in self._samples) / float(count)
+        mean_t = sum(t for _, t in self._samples) / float(count)
+        variance = sum((n - mean_n) ** 2 for n, _ in self._samples)
+        identified = variance > 0
+        if identified:
+            slope = sum((n - mean_n) * (t - mean_t) for n, t in self._samples) / variance
+            per_frame = max(slope, 0.0)
+            fixed = max(mean_t - per_frame * mean_n, 0.0)
+        else:
+            # Every batch had the same size, so the split between fixed and per-frame cost is unknown.
+            # Attribute it all to the frames, which is the conservative choice for latency
+            per_frame = mean_t / mean_n if mean_n else 0.0
+            fixed = 0.0
+        self._fixed_cost, self._per_frame_cost = fixed, per_frame
+
+        budget = self.target_latency / 2.0
+        if identified and per_frame > 0 and fixed < self.batching_gain * per_frame:
+            batch_size = 1
+        elif per_frame > 0:
+            batch_size = int((budget - fixed) / per_frame)
+        else:
+            batch_size = self.max_batch_size
+        self._batch_size = max(1, min(self.max_batch_size, batch_size))
+        self._wait_budget = max(0.0, self.target_latency - self.predicted_duration(self._batch_size))
+
+    def predicted_duration(self, frames):
+        """
+        :return: The predicted process_batch time in seconds for a batch of this many frames
+        """
+        return self._fixed_cost + self._per_frame_cost * frames
+
+    def should_flush(self, now=None):
+        """
+        Decides whether a batch should be processed right now.
+        :return: True when the queue holds a full batch, or when the oldest frame cannot wait any longer
+        """
+        now = time.monotonic() if now is None else now
+        size = self._observe_queue(now)
+        if size == 0:
+            return False
+        if size >= self._batch_size:
+            return True
+        oldest_wait = now - self._arrivals[0][1] if self._arrivals else 0.0
+        return oldest_wait >= self._wait_budget
+
+    def flush(self):
+        """
+        Processes one batch and updates the model.
+        :return: The list of AlprStreamRecognizedFrame results
+        """
+        start = time.monotonic()
+        frames = self.stream.process_batch(self.alpr_instance)
+        done = time.monotonic()
+        if frames:
+            self._samples.append((len(frames), done - start))
+            self._batches += 1
+            self._frames += len(frames)
+            now_ms = time.time() * 1000.0
+            arrivals = [self._arrivals.popleft() if self._arrivals else (start, start) for _ in frames]
+            # The offset from frame epoch times to the monotonic clock is the smallest seen, i.e. that of the frame
+            # observed soonest after it arrived.  The estimate is kept within each frame's arrival interval, so
+            # timestamps that do not follow the wall clock (recorded video, replays) cannot move it outside
+            self._clock_offsets.append(min(seen - frame.frame_epoch_time_ms / 1000.0
+                                           for frame, (_, seen) in zip(frames, arrivals)))
+            offset = min(self._clock_offsets)
+            for frame, (since, seen) in zip(frames, arrivals):
+                if self.use_frame_timestamps:
+                    self._latencies.append((now_ms - frame.frame_epoch_time_ms) / 1000.0)
+                else:
+                    arrived = min(seen, max(since, frame.frame_epoch_time_ms / 1000.0 + offset))
+                    self._latencies.append(done - arrived)
+            self._fit()
+        self._last_queue_size = len(self._arrivals)
+        return frames
+
+    def next_poll(self, now=None):
+        """
+        :return: Seconds to sleep before the queue should be checked again
+        """
+        now = time.monotonic() if now is None else now
+        if self._arrivals:
+            remaining = self._wait_budget - (now - self._arrivals[0][1])
+            return max(self.min_poll, min(remaining, self._wait_budget / 4.0 or self.min_poll))
+        return max(self.min_poll, self._wait_budget / 4.0)
+
+    def run(self, on_frames=None, on_groups=None, stop_event=None, until_idle=False):
+        """
+        Processes the stream until stopped.
+        :param on_frames: Optional callback(frames) for each processed batch
+        :param on_groups: Optional callback(groups) for completed groups
+        :param stop_event: Optional threading.Event that ends the loop when set
+        :param until_idle: Return once the queue is empty and no video file is active
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if self.should_flush():
+                frames = self.flush()
+                if frames and on_frames is not None:
+                    on_frames(frames)
+                groups = self.stream.pop_completed_groups()
+                if groups and on_groups is not None:
+                    on_groups(groups)
+                continue
+            if until_idle and self._last_queue_size == 0 and not self.stream.video_file_active():
+                if self.stream.get_queue_size() == 0:
+                    return
+            # Sleep until a full batch is queued or the oldest frame's wait budget runs out
+            self.stream.wait_for_frames(self._batch_size, self.next_poll())
+
+    def parameters(self):
+        """
+        The parameters the controller is currently using.
+        :return: A dict with batch_size, wait_budget, fixed_cost and per_frame_cost (seconds)
+        """
+        return {"batch_size": self._batch_size, "wait_budget": self._wait_budget,
+                "fixed_cost": self._fixed_cost, "per_frame_cost": self._per_frame_cost,
+                "batches": self._batches, "frames": self._frames}
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Frame latency percentiles over the most recent latency_window frames.
+        :param percentiles: The percentiles to compute
+        :return: A dict mapping each percentile to seconds, or None if nothing was processed yet
+        """
+        values = sorted(self._latencies)
+        return dict((p, _percentile(values, p)) for p in percentiles)
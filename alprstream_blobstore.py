@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped, segmented store for the JPEG images of recognized frames.
+
+With a store attached, AlprStream copies each JPEG exactly once, from the native result
+straight into a memory-mapped segment file, instead of into a Python bytes object.  The
+frame then carries a small BlobHandle (segment, offset, length) in place of jpeg_bytes:
+
+    store = MmapBlobStore("/var/cache/alpr/jpeg", max_age=3600)
+    stream.set_jpeg_store(store)
+    for frame in stream.process_batch(alpr):
+        if frame.jpeg_handle is not None:
+            upload(store.get(frame.jpeg_handle))     # a memoryview over the mapped file
+            store.release(frame.jpeg_handle)
+
+Segments are preallocated files of segment_bytes each.  Whole segments are deleted once
+they are older than max_age or the store grows beyond max_bytes, and compact() moves the
+remaining live images out of mostly released segments.  The image data lives in the page
+cache rather than on the Python heap.
+"""
+import collections
+import ctypes
+import mmap
+import os
+import threading
+import time
+
+_SEGMENT_SUFFIX = ".seg"
+_ALIGNMENT = 8
+
+
+class BlobHandle(collections.namedtuple("BlobHandle", "segment offset length")):
+    """
+    Location of one blob.  str(handle) gives a reference that parse() turns back into a handle.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "%d:%d:%d" % self
+
+    @classmethod
+    def parse(cls, reference):
+        if isinstance(reference, cls):
+            return reference
+        segment, offset, length = reference.split(":")
+        return cls(int(segment), int(offset), int(length))
+
+
+class _Segment(object):
+    __slots__ = ("number", "path", "file", "map", "anchor", "base", "size", "used", "live", "created", "last_write")
+
+    def __init__(self, number, path, size, create):
+        self.number = number
+        self.path = path
+        self.file = open(path, "w+b" if create else "r+b")
+        if create:
+            self.file.truncate(size)
+        else:
+            size = os.fstat(self.file.fileno()).st_size
+        self.size = size
+        self.map = mmap.mmap(self.file.fileno(), size)
+        # The ctypes view pins the mapping so its address stays valid; it is dropped before unmapping
+        self.anchor = ctypes.c_char.from_buffer(self.map)
+        self.base = ctypes.addressof(self.anchor)
+        self.used = 0 if create else size
+        self.live = {}
+        self.created = time.time() if create else os.path.getmtime(path)
+        self.last_write = self.created
+
+    def close(self):
+        # Fails with BufferError while a memoryview returned by get() is still alive
+        self.anchor = None
+        self.map.close()
+        self.file.close()
+
+
+class MmapBlobStore(object):
+    def __init__(self, directory, segment_bytes=256 * 1024 * 1024, max_age=None, max_bytes=None):
+        """
+        Opens a store in a directory.  Segments left by an earlier run stay readable with a handle and are
+        subject to the same retention, counted from their modification time.
+        :param directory: Directory holding the segment files
+        :param segment_bytes: Size of each segment file.  A blob larger than this gets a segment of its own
+        :param max_age: Delete segments whose last write is older than this many seconds
+        :param max_bytes: Delete the oldest segments while the segment files take more than this
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._segments = collections.OrderedDict()
+        self._closing = []
+        self._compacting = set()
+        self._current = None
+        self._written = 0
+        self._deleted = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(_SEGMENT_SUFFIX) and os.path.getsize(os.path.join(directory, name)) > 0:
+                number = int(name[:-len(_SEGMENT_SUFFIX)])
+                segment = _Segment(number, os.path.join(directory, name), 0, False)
+                segment.live = None
+                self._segments[number] = segment
+        self._next_number = max(list(self._segments) or [0]) + 1
+
+    def _reserve(self, length):
+        # Caller holds the lock.  Returns (segment, offset) with room for length bytes
+        current = self._current
+        if current is None or current.used + length > current.size:
+            self._enforce_retention()
+            current = _Segment(self._next_number, os.path.join(self.directory, "%08d%s" % (
+                self._next_number, _SEGMENT_SUFFIX)), max(self.segment_bytes, length), True)
+            self._next_number += 1
+            self._segments[current.number] = current
+            self._current = current
+        offset = current.used
+        current.used += (length + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+        current.live[offset] = length
+        current.last_write = time.time()
+        self._written += length
+        return current, offset
+
+    def put_from_pointer(self, address, length):
+        """
+        Copies a blob from native memory into the store.
+        :param address: Address of the first byte, e.g. AlprStreamRecognizedFrameC.jpeg_bytes
+        :param length: Number of bytes to copy
+        :return: A BlobHandle
+        """
+        with self._lock:
+            segment, offset = self._reserve(length)
+            ctypes.memmove(segment.base + offset, address, length)
+            return BlobHandle(segment.number, offset, length)
+
+    def put(self, data, key=None):
+        """
+        Copies a bytes-like blob into the store.  Usable as the blob_store of a ResultSink.
+        :param data: The blob
+        :param key: Ignored.  Blobs are addressed by their handle
+        :return: A BlobHandle
+        """
+        view = memoryview(data).cast("B")
+        with self._lock:
+            segment, offset = self._reserve(view.nbytes)
+            segment.map[offset:offset + view.nbytes] = view
+            return BlobHandle(segment.number, offset, view.nbytes)
+
+    def get(self, handle, readonly=True):
+        """
+        :param handle: A BlobHandle, or its str() reference
+        :param readonly: False returns a writable view, which AlprStream.push_frame passes by address without
+            copying.  Writes go to the mapped file
+        :return: A memoryview over the blob.  Release it (or drop it) before the segment can be deleted
+        :raise KeyError: If the blob's segment was deleted
+        """
+        handle = BlobHandle.parse(handle)
+        with self._lock:
+            # Under the lock, so that compact or retention cannot unmap the segment in between
+            segment = self._segments.get(handle.segment)
+            if segment is None:
+                raise KeyError("Blob %s was deleted by retention" % (handle,))
+            view = memoryview(segment.map)[handle.offset:handle.offset + handle.length]
+        return view.toreadonly() if readonly else view
+
+    def release(self, handle):
+        """
+        Marks a blob as no longer needed.  Its space is reclaimed once its segment is compacted or expires.
+        """
+        handle = BlobHandle.parse(handle)
+        with self._lock:
+            segment = self._segments.get(handle.segment)
+            if segment is not None and segment.live is not None:
+                segment.live.pop(handle.offset, None)
+
+    def _delete(self, segment):
+        # Caller holds the lock
+        del self._segments[segment.number]
+        if segment is self._current:
+            self._current = None
+        os.unlink(segment.path)
+        self._deleted += 1
+        self._closing.append(segment)
+        self._close_pending()
+
+    def _close_pending(self):
+        still_open = []
+        for segment in self._closing:
+            try:
+                segment.close()
+            except BufferError:
+                still_open.append(segment)
+        self._closing = still_open
+
+    def _enforce_retention(self, now=None):
+        # Caller holds the lock.  A segment being compacted is left alone; compact deletes it itself
+        now = time.time() if now is None else now
+        if self.max_age is not None:
+            for segment in list(self._segments.values()):
+                if segment.last_write < now - self.max_age and segment.number not in self._compacting:
+                    self._delete(segment)
+        if self.max_bytes is not None:
+            total = sum(segment.size for segment in self._segments.values())
+            for segment in list(self._segments.values()):
+                if total <= self.max_bytes:
+                    break
+                if segment is self._current or segment.number in self._compacting:
+                    continue
+                total -= segment.size
+                self._delete(segment)
+        self._close_pending()
+
+    def expire(self, now=None):
+        """
+        Applies max_age and max_bytes now.  This also happens whenever a new segment is started.
+        """
+        with self._lock:
+            self._enforce_retention(now)
+
+    def compact(self, max_live_ratio=0.25, on_move=None):
+        """
+        Moves the live blobs out of sealed segments that are mostly released, then deletes those segments.
+        :param max_live_ratio: Compact segments whose live bytes are at most this fraction of their size
+        :param on_move: Optional callback(old_handle, new_handle) for each moved blob
+        :return: A dict mapping old handles to new handles
+        """
+        moved = {}
+        with self._lock:
+            for segment in list(self._segments.values()):
+                if segment.number not in self._segments:
+                    # Deleted by retention while an earlier segment was being compacted
+                    continue
+                if segment is self._current or segment.live is None:
+                    continue
+                if sum(segment.live.values()) > max_live_ratio * segment.size:
+                    continue
+                # Starting a new target segment may apply retention, which must not unmap this one
+                self._compacting.add(segment.number)
+                try:
+                    for offset, length in sorted(segment.live.items()):
+                        target, target_offset = self._reserve(length)
+                        ctypes.memmove(target.base + target_offset, segment.base + offset, length)
+                        moved[BlobHandle(segment.number, offset, length)] = BlobHandle(target.number, target_offset,
+                                                                                       length)
+                finally:
+                    self._compacting.discard(segment.number)
+                self._delete(segment)
+        if on_move is not None:
+            for old, new in moved.items():
+                on_move(old, new)
+        return moved
+
+    def flush(self):
+        """
+        Writes the current segment's dirty pages back to its file.
+        """
+        with self._lock:
+            if self._current is not None:
+                self._current.map.flush()
+
+    def sync(self):
+        # Called by ResultSink before it commits the references of a batch
+        self.flush()
+
+    def stats(self):
+        """
+        :return: A dict with the number of segments, bytes on disk, live bytes, bytes written and segments deleted
+        """
+        with self._lock:
+            return {"segments": len(self._segments), "disk_bytes": sum(s.size for s in self._segments.values()),
+                    "live_bytes": sum(sum(s.live.values()) for s in self._segments.values() if s.live is not None),
+                    "written_bytes": self._written, "deleted_segments": self._deleted}
+
+    def close(self):
+        """
+        Flushes and unmaps every segment.  The files are kept.
+        """
+        with self._lock:
+            for segment in self._segments.values():
+                segment.map.flush()
+                self._closing.append(segment)
+            self._segments.clear()
+            self._current = None
+            self._close_pending()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
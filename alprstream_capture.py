@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay of the raw frames pushed to an AlprStream.
+
+Live camera input cannot be repeated, which makes throughput and latency regressions seen
+on real traffic hard to reproduce.  CaptureRecorder wraps a stream and writes every frame
+pushed through it to a capture directory, and CaptureReplayer pushes a capture into a
+stream again, in real time, faster, or as fast as the stream takes it:
+
+    recorder = CaptureRecorder(stream, "/captures/gate-1")
+    recorder.push_frame(img, 3, width, height, epoch_ms)       # recorded, then pushed
+    ...
+    recorder.close()
+
+    replayer = CaptureReplayer("/captures/gate-1")
+    thread = threading.Thread(target=replayer.replay, args=(other_stream,), kwargs={"speed": None})
+
+The pixels are stored in the segment files of an alprstream_blobstore.MmapBlobStore, and
+frames.idx holds one fixed-size RECORD per frame with its blob handle, geometry, frame
+epoch time and arrival time.  Replayed frames are passed to push_frame by address
+straight from the mapped segments, so nothing is decoded or copied in Python.
+"""
+import ctypes
+import json
+import os
+import struct
+import threading
+import time
+
+from alprstream import _pixel_buffer
+from alprstream_blobstore import BlobHandle, MmapBlobStore
+from alprstream_policy import VideoSource
+
+CAPTURE_VERSION = 1
+
+# epoch ms, seconds since the recording started, blob segment, offset, length, bytes per pixel, width, height
+RECORD = struct.Struct("<qdIQIIII")
+
+_INDEX_FILE = "frames.idx"
+_META_FILE = "capture.json"
+
+
+class CapturedFrame(object):
+    """
+    One recorded frame.
+    """
+    __slots__ = ("index", "epoch_ms", "arrival", "handle", "bytes_per_pixel", "width", "height")
+
+    def __init__(self, index, epoch_ms, arrival, handle, bytes_per_pixel, width, height):
+        self.index = index
+        self.epoch_ms = epoch_ms
+        self.arrival = arrival
+        self.handle = handle
+        self.bytes_per_pixel = bytes_per_pixel
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "CapturedFrame(%d, %dx%dx%d, %d)" % (self.index, self.width, self.height, self.bytes_per_pixel,
+                                                    self.epoch_ms)
+
+
+class ReplayStats(object):
+    """
+    What one replay pushed.  max_lag is the largest delay, in seconds, behind the replay schedule.
+    """
+    __slots__ = ("frames", "elapsed", "max_lag")
+
+    def __init__(self, frames, elapsed, max_lag):
+        self.frames = frames
+        self.elapsed = elapsed
+        self.max_lag = max_lag
+
+    @property
+    def frames_per_second(self):
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return "ReplayStats(%d frames in %.2f s, %.1f frames/s, max lag %.3f s)" % (
+            self.frames, self.elapsed, self.frames_per_second, self.max_lag)
+
+
+class CaptureRecorder(object):
+    def __init__(self, stream, directory, segment_bytes=256 * 1024 * 1024):
+        """
+        Wraps a stream so that the frames pushed through it are recorded.  Other attributes are delegated to the
+        stream.
+        :param stream: The AlprStream frames are pushed to after being recorded
+        :param directory: A new or empty directory for the capture
+        :param segment_bytes: Size of each segment file of pixels
+        """
+        if os.path.exists(os.path.join(directory, _INDEX_FILE)):
+            raise ValueError("%s already holds a capture" % directory)
+        self.stream = stream
+        self.directory = directory
+        self.frames = 0
+        self.bytes = 0
+        self._store = MmapBlobStore(directory, segment_bytes)
+        self._index = open(os.path.join(directory, _INDEX_FILE), "wb")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._started_epoch_ms = int(time.time() * 1000)
+        self._source = None
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Records a raw frame and pushes it.  Takes the same arguments as AlprStream.push_frame.
+        :return: The video input buffer size after adding this image
+        """
+        if frame_epoch_time < 0:
+            # Stamped here rather than by the library, so a replay gives the same frame times
+            frame_epoch_time = int(time.time() * 1000)
+        pointer, keepalive = _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        if not isinstance(pointer, int):
+            pointer = ctypes.cast(ctypes.c_char_p(pointer), ctypes.c_void_p).value
+        length = bytesPerPixel * imgWidth * imgHeight
+        with self._lock:
+            if self._closed:
+                raise ValueError("The recorder is closed")
+            handle = self._store.put_from_pointer(pointer, length)
+            self._index.write(RECORD.pack(frame_epoch_time, time.monotonic() - self._started, handle.segment,
+                                          handle.offset, handle.length, bytesPerPixel, imgWidth, imgHeight))
+            self.frames += 1
+            self.bytes += length
+        del keepalive
+        return self.stream.push_frame(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time)
+
+    def connect_video_file(self, video_file_path, video_start_time):
+        """
+        Decodes a video file with OpenCV on a background thread and records and pushes its frames.  The library's
+        own file reader cannot be recorded, because its frames never pass through Python.
+        :param video_file_path: The video file
+        :param video_start_time: Epoch ms of the first frame
+        """
+        self.disconnect_video_file()
+        self._source = VideoSource(self, video_file_path, video_start_time).start()
+
+    def video_file_active(self):
+        """
+        :return: True while the file connected with connect_video_file is still being read
+        """
+        return self._source is not None and self._source.active()
+
+    def disconnect_video_file(self):
+        if self._source is not None:
+            self._source.stop()
+            self._source = None
+
+    def close(self):
+        """
+        Stops a connected video file and completes the capture.  The wrapped stream is left open.
+        """
+        self.disconnect_video_file()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._index.close()
+            self._store.close()
+            with open(os.path.join(self.directory, _META_FILE), "w") as meta:
+                json.dump({"version": CAPTURE_VERSION, "frames": self.frames, "bytes": self.bytes,
+                           "started_epoch_ms": self._started_epoch_ms,
+                           "seconds": time.monotonic() - self._started}, meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _wait_for_room(stream, stop_event, poll):
+    # Returns False if stop_event was set while waiting.  Streams without wait_for_room are polled
+    wait = getattr(stream, "wait_for_room", None)
+    while stream.get_queue_size() >= stream.frame_queue_size:
+        if stop_event is not None and stop_event.is_set():
+            return False
+        if wait is not None:
+            wait(poll)
+        elif stop_event is not None:
+            stop_event.wait(poll)
+        else:
+            time.sleep(poll)
+    return stop_event is None or not stop_event.is_set()
+
+
+class CaptureReplayer(object):
+    def __init__(self, directory):
+        """
+        Opens a capture written by CaptureRecorder.
+        :param directory: The capture directory
+        """
+        self.directory = directory
+        meta_path = os.path.join(directory, _META_FILE)
+        self.meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta:
+                self.meta = json.load(meta)
+            if self.meta.get("version", CAPTURE_VERSION) > CAPTURE_VERSION:
+                raise ValueError("%s was written by a newer version (%s)" % (directory, self.meta["version"]))
+        with open(os.path.join(directory, _INDEX_FILE), "rb") as index:
+            data = index.read()
+        # A record cut short by a crash while recording is ignored
+        data = data[:len(data) - len(data) % RECORD.size]
+        self.frames = [CapturedFrame(number, epoch_ms, arrival, BlobHandle(segment, offset, length), bytes_per_pixel,
+                                     width, height)
+                       for number, (epoch_ms, arrival, segment, offset, length, bytes_per_pixel, width, height)
+                       in enumerate(RECORD.iter_unpack(data))]
+        self._store = MmapBlobStore(directory)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def pixels(self, frame):
+        """
+        :param frame: A CapturedFrame of this capture
+        :return: A writable memoryview over the frame's pixels in the mapped segment
+        """
+        return self._store.get(frame.handle, readonly=False)
+
+    def replay(self, stream, speed=1.0, timing="epoch", rebase_epoch=False, wait_for_room=None, start=0, stop=None,
+               stop_event=None, poll=0.05):
+        """
+        Pushes the recorded frames into a stream.
+        :param stream: The AlprStream (or a wrapper with the same push_frame) to push to
+        :param speed: 1.0 for real time, 4.0 for four times faster, None for as fast as possible
+        :param timing: "epoch" paces frames by their frame epoch times, "arrival" by the times they were pushed
+            while recording
+        :param rebase_epoch: Shift the frame epoch times so the first frame is pushed with the current time.  By
+            default frames keep their recorded times, so repeated replays give the same results
+        :param wait_for_room: Wait while the stream's queue is full instead of letting the library drop frames.
+            Defaults to True when speed is None, like connect_video_file
+        :param start: Index of the first frame to push
+        :param stop: Index after the last frame to push
+        :param stop_event: Optional threading.Event that ends the replay early
+        :param poll: Seconds between checks of stop_event while waiting for room.  Room itself is noticed as soon
+            as the stream processes a frame
+        :return: ReplayStats
+        """
+        if timing not in ("epoch", "arrival"):
+            raise ValueError("timing must be 'epoch' or 'arrival'")
+        if wait_for_room is None:
+            wait_for_room = not speed
+        frames = self.frames[start:stop]
+        if not frames:
+            return ReplayStats(0, 0.0, 0.0)
+        first = frames[0]
+        shift = int(time.time() * 1000) - first.epoch_ms if rebase_epoch else 0
+        started = time.monotonic()
+        max_lag = 0.0
+        pushed = 0
+        for frame in frames:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if speed:
+                if timing == "epoch":
+                    offset = (frame.epoch_ms - first.epoch_ms) / 1000.0
+                else:
+                    offset = frame.arrival - first.arrival
+                delay = started + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            if wait_for_room and not _wait_for_room(stream, stop_event, poll):
+                break
+            stream.push_frame(self._store.get(frame.handle, readonly=False), frame.bytes_per_pixel, frame.width,
+                              frame.height, frame.epoch_ms + shift)
+            pushed += 1
+        return ReplayStats(pushed, time.monotonic() - started, max_lag)
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy de-duplication of completed plate groups across streams and processes.
+
+The native combine_grouping only merges streams living in the same process, and only on
+exact plate matches, so an OCR misread (8/B, 0/O, ...) on a second camera raises a second
+alert.  PlateDeduplicator merges groups from any number of sources into clusters when
+their plates are within an edit distance of each other and they occur within a time
+window:
+
+    dedup = PlateDeduplicator(window_ms=120000, max_distance=1)
+    for camera_id, group in runtime.completed_groups(timeout=0.1):
+        cluster, is_new = dedup.submit(group, source=camera_id)
+        if is_new:
+            raise_alert(group)
+
+Plates are first mapped to a canonical form in which commonly confused characters are
+equal, then compared with a bounded Levenshtein distance.  Candidate plates are found
+through an index of 4-grams, so a lookup only verifies the few plates that share most of
+their 4-grams with the query instead of every recent plate.  Clusters expire window_ms after they were last seen.
+"""
+import heapq
+import itertools
+import threading
+
+from alprstream_index import group_epoch_range
+
+# Characters OCR commonly confuses on plates, mapped to a shared canonical character
+CONFUSABLE_CHARACTERS = {"O": "0", "Q": "0", "D": "0", "I": "1", "Z": "2", "S": "5", "G": "6", "B": "8"}
+
+_CANONICAL_TABLE = dict((ord(key), value) for key, value in CONFUSABLE_CHARACTERS.items())
+
+_GRAM_SIZE = 4
+_PADDING = "^" * (_GRAM_SIZE - 1), "$" * (_GRAM_SIZE - 1)
+
+
+def canonical_plate(plate, confusable=CONFUSABLE_CHARACTERS):
+    """
+    Upper-cases a plate and replaces confusable characters, so that e.g. "ABC8" and "A8C8" are equal.
+    :return: The canonical plate string
+    """
+    plate = plate.upper()
+    if confusable is CONFUSABLE_CHARACTERS:
+        return plate.translate(_CANONICAL_TABLE)
+    return "".join(confusable.get(character, character) for character in plate)
+
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance between two strings, giving up early once it exceeds limit.
+    :return: The distance, or limit + 1 if it is larger than limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_best = i
+        for j, char_b in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            current.append(value)
+            if value < row_best:
+                row_best = value
+        if row_best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+def _grams(key):
+    padded = _PADDING[0] + key + _PADDING[1]
+    return [padded[i:i + _GRAM_SIZE] for i in range(len(padded) - _GRAM_SIZE + 1)]
+
+
+class PlateCluster(object):
+    """
+    Groups that were judged to be the same vehicle.
+    """
+    __slots__ = ("id", "plate", "confidence", "uuid", "first_seen", "last_seen", "sources", "count", "keys")
+
+    def __init__(self, cluster_id, plate, confidence, uuid, first_seen, last_seen, source):
+        self.id = cluster_id
+        self.plate = plate
+        self.confidence = confidence
+        self.uuid = uuid
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.sources = set([source])
+        self.count = 1
+        self.keys = set()
+
+    def __repr__(self):
+        return "PlateCluster(%s, %d groups from %d sources, %d-%d)" % \
+               (self.plate, self.count, len(self.sources), self.first_seen, self.last_seen)
+
+
+class PlateDeduplicator(object):
+    def __init__(self, window_ms=60000, max_distance=1, candidates=3, confusable=CONFUSABLE_CHARACTERS):
+        """
+        Creates an empty de-duplicator.
+        :param window_ms: Groups match a cluster that was last seen at most this long before them.  Clusters are
+            dropped once the newest group seen is this much later than their last group
+        :param max_distance: Largest edit distance, after canonicalisation, between matching plates
+        :param candidates: Number of each group's OCR candidates (besides best_plate_number) that are indexed and
+            matched.  Candidates only match exactly after canonicalisation
+        :param confusable: Character mapping used for canonicalisation
+        """
+        self.window_ms = window_ms
+        self.max_distance = max_distance
+        self.candidates = candidates
+        self.confusable = confusable
+        self._lock = threading.Lock()
+        self._clusters = {}
+        self._key_clusters = {}     # canonical plate -> set of cluster ids
+        self._postings = {}         # n-gram -> set of canonical plates
+        self._by_length = {}        # plate length -> set of canonical plates, for plates too short for n-grams
+        self._expiry = []           # heap of (last_seen, cluster id), lazily refreshed
+        self._ids = itertools.count()
+        self._newest = None
+        self._groups = 0
+        self._duplicates = 0
+
+    def _group_keys(self, group):
+        # Returns the canonical best plate and the set of canonical candidate plates
+        plate = canonical_plate(group.get("best_plate_number") or "", self.confusable)
+        keys = set()
+        for candidate in (group.get("candidates") or ())[:self.candidates + 1]:
+            if candidate.get("plate"):
+                keys.add(canonical_plate(candidate["plate"], self.confusable))
+        keys.discard(plate)
+        return plate, keys
+
+    def _similar(self, key):
+        # Returns {canonical plate: distance} for indexed plates within max_distance of key
+        limit = self.max_distance
+        found = {}
+        if key in self._key_clusters:
+            found[key] = 0
+        if limit == 0:
+            return found
+        grams = _grams(key)
+        # Each edit changes at most _GRAM_SIZE of the query's n-grams, so a match shares all but
+        # limit * _GRAM_SIZE of them.  It therefore appears in at least one of the limit * _GRAM_SIZE + 1
+        # rarest posting lists (which gives the candidates), and in enough of all of them (which discards
+        # most candidates before the edit distance is computed)
+        needed = limit * _GRAM_SIZE + 1
+        if len(grams) >= needed:
+            postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+            threshold = len(grams) - limit * _GRAM_SIZE
+            candidates = set()
+            for posting in postings[:needed]:
+                candidates.update(posting)
+            candidates = [other for other in candidates
+                          if sum(1 for posting in postings if other in posting) >= threshold]
+        else:
+            candidates = set()
+            for length in range(len(key) - limit, len(key) + limit + 1):
+                candidates.update(self._by_length.get(length, ()))
+        for other in candidates:
+            if other not in found:
+                distance = edit_distance(key, other, limit)
+                if distance <= limit:
+                    found[other] = distance
+        return found
+
+    def _index_key(self, key, cluster):
+        cluster.keys.add(key)
+        clusters = self._key_clusters.get(key)
+        if clusters is None:
+            clusters = self._key_clusters[key] = set()
+            for gram in set(_grams(key)):
+                self._postings.setdefault(gram, set()).add(key)
+            self._by_length.setdefault(len(key), set()).add(key)
+        clusters.add(cluster.id)
+
+    def _unindex_cluster(self, cluster):
+        for key in cluster.keys:
+            clusters = self._key_clusters[key]
+            clusters.discard(cluster.id)
+            if clusters:
+                continue
+            del self._key_clusters[key]
+            for gram in set(_grams(key)):
+                posting = self._postings[gram]
+                posting.discard(key)
+                if not posting:
+                    del self._postings[gram]
+            keys = self._by_length[len(key)]
+            keys.discard(key)
+            if not keys:
+                del self._by_length[len(key)]
+
+    def _match(self, plate, keys, epoch_start, epoch_end):
+        # Returns the best live cluster for the group, or None
+        scores = {}
+        matches = list(self._similar(plate).items()) if plate else []
+        matches.extend((key, self.max_distance) for key in keys if key in self._key_clusters)
+        for key, distance in matches:
+            for cluster_id in self._key_clusters[key]:
+                cluster = self._clusters[cluster_id]
+                if cluster.last_seen < epoch_start - self.window_ms or cluster.first_seen > epoch_end + self.window_ms:
+                    continue
+                score = (distance, -cluster.last_seen)
+                if cluster_id not in scores or score < scores[cluster_id]:
+                    scores[cluster_id] = score
+        if not scores:
+            return None
+        return self._clusters[min(scores, key=scores.get)]
+
+    def _evict(self):
+        cutoff = self._newest - self.window_ms
+        while self._expiry and self._expiry[0][0] < cutoff:
+            last_seen, cluster_id = heapq.heappop(self._expiry)
+            cluster = self._clusters.get(cluster_id)
+            if cluster is None:
+                continue
+            if cluster.last_seen > last_seen:
+                heapq.heappush(self._expiry, (cluster.last_seen, cluster_id))
+                continue
+            del self._clusters[cluster_id]
+            self._unindex_cluster(cluster)
+
+    def submit(self, group, source=None):
+        """
+        Matches one completed group against the recent clusters.
+        :param group: A group dict, as returned by pop_completed_groups
+        :param source: Identifies where the group came from, e.g. a camera or process.  Defaults to its "camera" field
+        :return: (cluster, is_new).  is_new is False when the group was merged into an existing cluster
+        """
+        if source is None:
+            source = group.get("camera")
+        epoch_start, epoch_end = group_epoch_range(group)
+        plate, keys = self._group_keys(group)
+        confidence = group.get("best_confidence", 0.0)
+        with self._lock:
+            self._groups += 1
+            if self._newest is None or epoch_end > self._newest:
+                self._newest = epoch_end
+            self._evict()
+
+            cluster = self._match(plate, keys, epoch_start, epoch_end)
+            is_new = cluster is None
+            if is_new:
+                cluster = PlateCluster(next(self._ids), group.get("best_plate_number"), confidence,
+                                       group.get("best_uuid"), epoch_start, epoch_end, source)
+                self._clusters[cluster.id] = cluster
+                heapq.heappush(self._expiry, (epoch_end, cluster.id))
+            else:
+                self._duplicates += 1
+                cluster.count += 1
+                cluster.sources.add(source)
+                cluster.first_seen = min(cluster.first_seen, epoch_start)
+                cluster.last_seen = max(cluster.last_seen, epoch_end)
+                if confidence > cluster.confidence:
+                    cluster.plate = group.get("best_plate_number")
+                    cluster.confidence = confidence
+                    cluster.uuid = group.get("best_uuid")
+            if plate:
+                self._index_key(plate, cluster)
+            for key in keys:
+                self._index_key(key, cluster)
+        return cluster, is_new
+
+    def filter(self, groups, source=None):
+        """
+        Submits groups and keeps only those that started a new cluster.
+        :param groups: A list of group dicts, e.g. the result of pop_completed_groups
+        :param source: Where the groups came from.  Defaults to each group's "camera" field
+        :return: The groups that are not duplicates of a recent group
+        """
+        return [group for group in groups if self.submit(group, source)[1]]
+
+    def stats(self):
+        """
+        :return: A dict with the number of groups submitted, duplicates merged, live clusters and indexed plates
+        """
+        with self._lock:
+            return {"groups": self._groups, "duplicates": self._duplicates, "clusters": len(self._clusters),
+                    "plates": len(self._key_clusters), "ngrams": len(self._postings)}
+
+    def __len__(self):
+        return len(self._clusters)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental view of a stream's active plate groups.
+
+peek_active_groups returns every active group on every call.  A dashboard polling it
+re-parses the same groups again and again.  ActiveGroupTracker keeps the previous
+snapshot and reports only what changed, which is what AlprStream.diff_active_groups
+returns:
+
+    delta = stream.diff_active_groups()
+    for group in delta.added:
+        show(group.key, group.plate, group.confidence)
+    for group in delta.updated:
+        update(group.key, group.confidence, group.epoch_end)
+    for group in delta.closed:
+        remove(group.key)
+
+The library's JSON is split into one byte string per group without parsing it, and only
+the groups whose bytes differ from the previous snapshot are parsed.  A poll in which
+nothing changed costs a copy and a hash of the JSON rather than a full json.loads.  When
+most groups changed, or the JSON cannot be split that way, the whole array is parsed
+with a single json.loads instead.
+"""
+import json
+import re
+
+from alprstream_index import group_epoch_range
+
+
+def group_key(group):
+    """
+    The default identity of a group: its start time and the UUID of its first frame (the first entry of uuids).
+    best_uuid is not used, because it moves to a new frame whenever a read with a higher confidence arrives.
+    Without uuids, the start time and plate are used, which change if a better read changes the plate.
+    """
+    epoch_start = group_epoch_range(group)[0]
+    uuids = group.get("uuids")
+    if uuids:
+        return epoch_start, uuids[0]
+    return epoch_start, group.get("best_plate_number")
+
+
+class ActiveGroup(object):
+    """
+    Summary of one active group.  group is the full dict it was read from.
+    """
+    __slots__ = ("key", "plate", "confidence", "epoch_start", "epoch_end", "frame_start", "frame_end", "group")
+
+    def __init__(self, key, group):
+        self.key = key
+        self.plate = group.get("best_plate_number")
+        self.confidence = group.get("best_confidence")
+        self.epoch_start, self.epoch_end = group_epoch_range(group)
+        self.frame_start = group.get("frame_start")
+        self.frame_end = group.get("frame_end")
+        self.group = group
+
+    def __repr__(self):
+        return "ActiveGroup(%r, %r, %.1f)" % (self.key, self.plate, self.confidence or 0.0)
+
+
+class ActiveGroupDelta(object):
+    """
+    The changes between two snapshots of the active groups.
+    """
+    __slots__ = ("added", "updated", "closed", "active")
+
+    def __init__(self, added, updated, closed, active):
+        self.added = added
+        self.updated = updated
+        self.closed = closed
+        self.active = active
+
+    def __len__(self):
+        return len(self.added) + len(self.updated) + len(self.closed)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "ActiveGroupDelta(%d added, %d updated, %d closed, %d active)" % (
+            len(self.added), len(self.updated), len(self.closed), self.active)
+
+
+# A closing brace, a comma and an opening brace: a candidate boundary between two objects
+_OBJECT_SEPARATOR = re.compile(br"\}\s*,\s*\{")
+
+
+def _split_groups(raw, known=()):
+    # Splits a JSON array of objects into one byte string per object without parsing it.  The end of the
+    # first object is found structurally, as the first "},{" (with any whitespace) at which the braces
+    # balance.  What follows it up to the first key of the next object, e.g. ',{"data_type":', is then
+    # used to cut every object, as the library writes each group the same way, and pieces cut inside an
+    # object (a nested object written the same way) are joined back until their braces balance.  Pieces
+    # in known were whole objects in an earlier snapshot and are not counted again.  The opening "{..:"
+    # is left off every piece but the first.  An object written differently (other whitespace or first
+    # key) stays joined to the one before it, and braces inside string values miscount; both give pieces
+    # that do not parse, so callers must be ready for that.  Returns (opening, pieces)
+    body = raw.strip()
+    if body[:1] != b"[" or body[-1:] != b"]":
+        raise ValueError("Not a JSON array")
+    body = body[1:-1].strip()
+    if not body:
+        return b"", []
+    if body[:1] != b"{":
+        raise ValueError("Not an array of objects")
+    depth = 0
+    counted = 0
+    for match in _OBJECT_SEPARATOR.finditer(body):
+        end = match.start() + 1
+        depth += body.count(b"{", counted, end) - body.count(b"}", counted, end)
+        counted = end
+        if depth == 0:
+            break
+    else:
+        return b"", [body]
+    colon = body.find(b":", match.end())
+    if colon < 0:
+        raise ValueError("Not an array of objects")
+    opening = body[match.end() - 1:colon + 1]
+    separator = body[end:colon + 1]
+    pieces = body.split(separator)
+
+    def balance(index):
+        # Without its opening, a whole object after the first has one more "}" than "{"
+        piece = pieces[index]
+        return piece.count(b"{") - piece.count(b"}") + (1 if index else 0)
+
+    if all(piece in known or balance(index) == 0 for index, piece in enumerate(pieces)):
+        return opening, pieces
+    joined = [pieces[0]]
+    depth = balance(0)
+    for index in range(1, len(pieces)):
+        if depth == 0:
+            joined.append(pieces[index])
+        else:
+            joined[-1] += separator + pieces[index]
+        depth += balance(index)
+    return opening, joined
+
+
+class ActiveGroupTracker(object):
+    def __init__(self, key=group_key, full_parse_fraction=0.75):
+        """
+        :param key: Function returning the identity of a group dict.  Groups are matched between snapshots
+            with it, so it must not change while a group is active
+        :param full_parse_fraction: Parse the whole array with one json.loads once more than this fraction of
+            the groups changed, which is cheaper than parsing them one at a time
+        """
+        self.key = key
+        self.full_parse_fraction = full_parse_fraction
+        self._by_raw = {}       # bytes of a group -> key
+        self._groups = {}       # key -> ActiveGroup
+        self.full_parses = 0
+
+    def groups(self):
+        """
+        :return: The ActiveGroup of every group in the latest snapshot
+        """
+        return list(self._groups.values())
+
+    def reset(self):
+        """
+        Forgets the snapshot, so the next update reports every active group as added.
+        """
+        self._by_raw = {}
+        self._groups = {}
+
+    def _pieces(self, raw):
+        # (bytes, dict or None) per group; the dict is None where the bytes are unchanged
+        previous = self._by_raw
+        try:
+            opening, pieces = _split_groups(raw, previous)
+            changed = [piece not in previous for piece in pieces]
+            if sum(changed) <= self.full_parse_fraction * len(pieces):
+                return [(piece, json.loads((piece if index == 0 else opening + piece).decode("UTF-8"))
+                         if is_changed else None)
+                        for index, (piece, is_changed) in enumerate(zip(pieces, changed))]
+        except ValueError:
+            # Includes json's decode errors, raised for pieces that were cut in the wrong place
+            pieces = None
+        self.full_parses += 1
+        groups = json.loads(raw.decode("UTF-8"))
+        if pieces is None or len(pieces) != len(groups):
+            return [(json.dumps(group, sort_keys=True).encode("UTF-8"), group) for group in groups]
+        return [(piece, None if piece in previous else group) for piece, group in zip(pieces, groups)]
+
+    def update(self, raw):
+        """
+        Compares a new snapshot with the previous one.
+        :param raw: The JSON bytes returned by peek_active_groups, or None for no groups
+        :return: An ActiveGroupDelta
+        """
+        by_raw = {}
+        groups = {}
+        added = []
+        updated = []
+        previous_raw = self._by_raw
+        previous = self._groups
+        for piece, group in self._pieces(raw or b"[]"):
+            if group is None:
+                key = previous_raw[piece]
+                groups[key] = previous[key]
+            else:
+                key = self.key(group)
+                if key in groups:
+                    # Two groups with the same key; keep the first rather than report them as one changing
+                    continue
+                if key in previous and previous[key].group == group:
+                    # Same content in different bytes, e.g. after the JSON had to be parsed whole
+                    groups[key] = previous[key]
+                else:
+                    groups[key] = summary = ActiveGroup(key, group)
+                    if key in previous:
+                        updated.append(summary)
+                    else:
+                        added.append(summary)
+            by_raw[piece] = key
+        closed = [summary for key, summary in previous.items() if key not in groups]
+        self._by_raw = by_raw
+        self._groups = groups
+        return ActiveGroupDelta(added, updated, closed, len(groups))
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory index of completed plate groups, for answering "has this plate been seen on
+this camera recently" without scanning every group.
+
+Feed it whatever pop_completed_groups returns and query by exact plate, plate prefix or
+time window, optionally restricted to one camera:
+
+    index = PlateIndex(max_age_ms=7 * 24 * 3600 * 1000, max_bytes=512 * 1024 * 1024)
+    scheduler = BatchScheduler(alprs, on_groups=lambda name, stream, groups: index.add_groups(groups, name))
+    ...
+    if index.seen_recently("ABC1234", camera="gate-1", window_ms=10 * 60 * 1000):
+        ...
+
+Only the fields needed to answer queries are kept for each group (see GroupRecord), not
+the parsed JSON.  Groups are evicted oldest-inserted first, once they end before the
+max_age_ms cutoff or while the estimated memory use is above max_bytes.
+"""
+import bisect
+import collections
+import sys
+import threading
+import time
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern
+
+# Width of the time buckets, in ms, used for time-window queries
+DEFAULT_BUCKET_MS = 60 * 1000
+
+
+def group_epoch_range(group):
+    """
+    Reads the time span of a group dict.  Both the epoch_start/epoch_end keys returned by the
+    library and the epoch_ms_time_start/epoch_ms_time_end spelling are accepted.
+    :return: (epoch_start, epoch_end) in epoch ms
+    """
+    epoch_start = group.get("epoch_start", group.get("epoch_ms_time_start", 0))
+    return epoch_start, group.get("epoch_end", group.get("epoch_ms_time_end", epoch_start))
+
+
+class GroupRecord(object):
+    """
+    The indexed fields of one completed plate group.
+    """
+    __slots__ = ("plate", "camera", "epoch_start", "epoch_end", "confidence", "uuid")
+
+    def __init__(self, plate, camera, epoch_start, epoch_end, confidence, uuid):
+        self.plate = plate
+        self.camera = camera
+        self.epoch_start = epoch_start
+        self.epoch_end = epoch_end
+        self.confidence = confidence
+        self.uuid = uuid
+
+    @classmethod
+    def from_group(cls, group, camera=None):
+        """
+        :param group: A group dict as returned by pop_completed_groups
+        :param camera: The camera to file it under.  Defaults to the group's "camera" field
+        :return: A GroupRecord, or None if the group has no plate number
+        """
+        plate = group.get("best_plate_number")
+        if not plate:
+            return None
+        if camera is None:
+            camera = group.get("camera", "")
+        epoch_start, epoch_end = group_epoch_range(group)
+        return cls(_intern(str(plate)), _intern(str(camera)), epoch_start, epoch_end,
+                   group.get("best_confidence", 0.0), group.get("best_uuid"))
+
+    def overlaps(self, start_ms, end_ms):
+        return (start_ms is None or self.epoch_end >= start_ms) and (end_ms is None or self.epoch_start <= end_ms)
+
+    def as_dict(self):
+        return {"best_plate_number": self.plate, "camera": self.camera, "epoch_start": self.epoch_start,
+                "epoch_end": self.epoch_end, "best_confidence": self.confidence, "best_uuid": self.uuid}
+
+    def __repr__(self):
+        return "GroupRecord(%s on %s, %d-%d)" % (self.plate, self.camera, self.epoch_start, self.epoch_end)
+
+
+# Estimated bytes per record: the object, its uuid string and its entries in the three indexes
+_RECORD_BYTES = sys.getsizeof(GroupRecord("", "", 0, 0, 0.0, None)) + 3 * 8
+# Estimated bytes for a new plate or time bucket: its list and dict entry
+_NEW_KEY_BYTES = sys.getsizeof([None]) + 3 * 8 + 32
+
+
+class PlateIndex(object):
+    def __init__(self, max_age_ms=None, max_bytes=None, bucket_ms=DEFAULT_BUCKET_MS):
+        """
+        Creates an empty index.
+        :param max_age_ms: Evict groups that ended longer ago than this, relative to the newest
+            epoch_end added.  None keeps groups regardless of age
+        :param max_bytes: Evict the oldest groups while the estimated memory use exceeds this
+        :param bucket_ms: Width of the time buckets.  About the length of a typical query window works best
+        """
+        self.max_age_ms = max_age_ms
+        self.max_bytes = max_bytes
+        self.bucket_ms = bucket_ms
+        self._lock = threading.Lock()
+        self._records = collections.deque()     # insertion order, for eviction
+        self._by_plate = {}                     # plate -> list of records
+        self._plates = []                       # sorted distinct plates, for prefix queries
+        self._by_time = {}                      # camera -> {bucket -> list of records}
+        self._durations = collections.Counter()  # epoch_end - epoch_start -> number of records
+        self._max_duration = 0
+        self._newest_end = None
+        self._bytes = 0
+        self._evicted = 0
+
+    def add_groups(self, groups, camera=None):
+        """
+        Indexes completed groups and applies eviction.
+        :param groups: A list of group dicts, as returned by pop_completed_groups
+        :param camera: Camera name for all of them.  Defaults to each group's "camera" field
+        :return: The number of groups indexed
+        """
+        added = 0
+        with self._lock:
+            for group in groups:
+                record = GroupRecord.from_group(group, camera)
+                if record is not None:
+                    self._add(record)
+                    added += 1
+            self._evict()
+        return added
+
+    def add(self, record):
+        """
+        Indexes a single GroupRecord and applies eviction.
+        """
+        with self._lock:
+            self._add(record)
+            self._evict()
+
+    def _add(self, record):
+        records = self._by_plate.get(record.plate)
+        if records is None:
+            records = self._by_plate[record.plate] = []
+            bisect.insort(self._plates, record.plate)
+            self._bytes += _NEW_KEY_BYTES + sys.getsizeof(record.plate)
+        records.append(record)
+
+        buckets = self._by_time.get(record.camera)
+        if buckets is None:
+            buckets = self._by_time[record.camera] = {}
+        bucket = record.epoch_start // self.bucket_ms
+        entries = buckets.get(bucket)
+        if entries is None:
+            entries = buckets[bucket] = []
+            self._bytes += _NEW_KEY_BYTES
+        entries.append(record)
+
+        self._records.append(record)
+        self._bytes += _RECORD_BYTES + (sys.getsizeof(record.uuid) if record.uuid is not None else 0)
+        duration = record.epoch_end - record.epoch_start
+        self._durations[duration] += 1
+        self._max_duration = max(self._max_duration, duration)
+        if self._newest_end is None or record.epoch_end > self._newest_end:
+            self._newest_end = record.epoch_end
+
+    def _remove_oldest(self):
+        record = self._records.popleft()
+        self._bytes -= _RECORD_BYTES + (sys.getsizeof(record.uuid) if record.uuid is not None else 0)
+        self._evicted += 1
+
+        # window() scans back by the longest duration still indexed, so shrink it once the last such record goes
+        duration = record.epoch_end - record.epoch_start
+        self._durations[duration] -= 1
+        if not self._durations[duration]:
+            del self._durations[duration]
+            if duration >= self._max_duration:
+                self._max_duration = max(self._durations) if self._durations else 0
+
+        # Each per-plate and per-bucket list is in insertion order, so the oldest record is at its front
+        records = self._by_plate[record.plate]
+        if records[0] is record:
+            del records[0]
+        else:
+            records.remove(record)
+        if not records:
+            del self._by_plate[record.plate]
+            del self._plates[bisect.bisect_left(self._plates, record.plate)]
+            self._bytes -= _NEW_KEY_BYTES + sys.getsizeof(record.plate)
+
+        buckets = self._by_time[record.camera]
+        bucket = record.epoch_start // self.bucket_ms
+        entries = buckets[bucket]
+        if entries[0] is record:
+            del entries[0]
+        else:
+            entries.remove(record)
+        if not entries:
+            del buckets[bucket]
+            self._bytes -= _NEW_KEY_BYTES
+            if not buckets:
+                del self._by_time[record.camera]
+
+    def _evict(self, now_ms=None):
+        if self.max_age_ms is not None and self._records:
+            cutoff = (now_ms if now_ms is not None else self._newest_end) - self.max_age_ms
+            while self._records and self._records[0].epoch_end < cutoff:
+                self._remove_oldest()
+        if self.max_bytes is not None:
+            while self._records and self._bytes > self.max_bytes:
+                self._remove_oldest()
+
+    def evict(self, now_ms=None):
+        """
+        Applies eviction against the wall clock instead of the newest group, e.g. from a timer while cameras are idle.
+        :param now_ms: The current epoch ms.  Defaults to time.time()
+        """
+        with self._lock:
+            self._evict(int(time.time() * 1000) if now_ms is None else now_ms)
+
+    def lookup(self, plate, camera=None, start_ms=None, end_ms=None):
+        """
+        Finds the groups for an exact plate number.
+        :param plate: The plate number
+        :param camera: Only return groups from this camera
+        :param start_ms: Only return groups that ended at or after this epoch ms
+        :param end_ms: Only return groups that started at or before this epoch ms
+        :return: A list of GroupRecord in insertion order
+        """
+        with self._lock:
+            records = self._by_plate.get(plate, ())
+            return [record for record in records
+                    if (camera is None or record.camera == camera) and record.overlaps(start_ms, end_ms)]
+
+    def last_seen(self, plate, camera=None):
+        """
+        :return: The GroupRecord with the latest epoch_end for the plate, or None
+        """
+        records = self.lookup(plate, camera)
+        return max(records, key=lambda record: record.epoch_end) if records else None
+
+    def seen_recently(self, plate, camera=None, window_ms=10 * 60 * 1000, now_ms=None):
+        """
+        Checks whether a plate was seen within the last window_ms.
+        :param plate: The plate number
+        :param camera: Only consider this camera
+        :param window_ms: Length of the window
+        :param now_ms: End of the window.  Defaults to the current time
+        :return: True if a group for the plate overlaps the window
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        with self._lock:
+            for record in self._by_plate.get(plate, ()):
+                if (camera is None or record.camera == camera) and record.overlaps(now_ms - window_ms, now_ms):
+                    return True
+        return False
+
+    def prefix(self, prefix, camera=None, start_ms=None, end_ms=None, limit=None):
+        """
+        Finds groups whose plate number starts with prefix.
+        :param limit: Stop after this many groups
+        :return: A list of GroupRecord, ordered by plate number and then insertion order
+        """
+        found = []
+        with self._lock:
+            position = bisect.bisect_left(self._plates, prefix)
+            while position < len(self._plates) and self._plates[position].startswith(prefix):
+                for record in self._by_plate[self._plates[position]]:
+                    if (camera is None or record.camera == camera) and record.overlaps(start_ms, end_ms):
+                        found.append(record)
+                        if limit is not None and len(found) >= limit:
+                            return found
+                position += 1
+        return found
+
+    def window(self, start_ms, end_ms, camera=None):
+        """
+        Finds groups that overlap [start_ms, end_ms].
+        :param camera: Only return groups from this camera
+        :return: A list of GroupRecord ordered by epoch_start
+        """
+        found = []
+        with self._lock:
+            cameras = [camera] if camera is not None else list(self._by_time)
+            first = (start_ms - self._max_duration) // self.bucket_ms
+            last = end_ms // self.bucket_ms
+            for name in cameras:
+                buckets = self._by_time.get(name)
+                if not buckets:
+                    continue
+                if last - first + 1 > len(buckets):
+                    keys = [key for key in buckets if first <= key <= last]
+                else:
+                    keys = [key for key in range(first, last + 1) if key in buckets]
+                for key in keys:
+                    found.extend(record for record in buckets[key] if record.overlaps(start_ms, end_ms))
+        found.sort(key=lambda record: record.epoch_start)
+        return found
+
+    def cameras(self):
+        """
+        :return: The cameras that currently have groups in the index
+        """
+        with self._lock:
+            return sorted(self._by_time)
+
+    def stats(self):
+        """
+        :return: A dict with the number of groups, distinct plates and cameras, evicted groups and
+            estimated bytes
+        """
+        with self._lock:
+            return {"groups": len(self._records), "plates": len(self._plates), "cameras": len(self._by_time),
+                    "evicted": self._evicted, "estimated_bytes": self._bytes}
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Image-directory ingestion for AlprStream.
+
+Paths are streamed with os.scandir and decoded on a thread pool a configurable number of
+images ahead of the stream, so disk reads and JPEG decoding overlap with recognition.
+Frames are still pushed strictly in path order, each with its own timestamp:
+
+    stream = AlprStream(15, False)
+    ingestor = ImageIngestor(stream, start_epoch_ms=1500294710000)
+    ingestor.process(iter_image_paths("/tmp/imagebatchtest", sort=True), alpr, batch_size=10,
+                     on_frames=print_frame_results, on_groups=print_group_results)
+    print(ingestor.stats())
+
+Decoding uses OpenCV (cv2.imread) unless another decoder is supplied.  The decoder is
+called as decoder(path) and must return an HxW or HxWxC uint8 array, or None to skip.
+"""
+import collections
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def iter_image_paths(directory, extensions=IMAGE_EXTENSIONS, sort=False):
+    """
+    Lists the image files in a directory without building the whole listing up front.
+    :param directory: The directory to scan.  Subdirectories are not descended into
+    :param extensions: Lower-case file extensions to accept, or None for every file
+    :param sort: Yield paths in name order.  This needs the full listing before the first path is returned
+    :return: An iterator of full paths
+    """
+    def scan():
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            if extensions is not None and os.path.splitext(entry.name)[1].lower() not in extensions:
+                continue
+            yield entry.path
+
+    if sort:
+        return iter(sorted(scan()))
+    return scan()
+
+
+def _imread(path):
+    import cv2
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+
+class IngestStats(object):
+    """
+    Counters for an ImageIngestor run, as returned by ImageIngestor.stats().
+    """
+    __slots__ = ("decoded", "failed", "pushed", "batches", "elapsed", "images_per_second", "skipped")
+
+    def __init__(self, decoded, failed, pushed, batches, elapsed, skipped=0):
+        self.decoded = decoded
+        self.failed = failed
+        self.pushed = pushed
+        self.skipped = skipped
+        self.batches = batches
+        self.elapsed = elapsed
+        self.images_per_second = pushed / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return "IngestStats(%d pushed, %d skipped, %d failed, %d batches, %.1f images/s)" % \
+               (self.pushed, self.skipped, self.failed, self.batches, self.images_per_second)
+
+
+class ImageIngestor(object):
+    def __init__(self, stream, decoder=None, workers=4, prefetch=None, start_epoch_ms=None, frame_interval_ms=100,
+                 timestamp_func=None, full_queue_wait=0.002, prefilter=None):
+        """
+        Creates an ingestor feeding a single stream.
+        :param stream: The AlprStream receiving the frames
+        :param decoder: Callable(path) returning a uint8 image array or None.  Defaults to cv2.imread
+        :param workers: Number of decoding threads
+        :param prefetch: How many images may be decoded ahead of the stream.  Defaults to 2 * workers
+        :param start_epoch_ms: Epoch time of the first image.  Defaults to the current time
+        :param frame_interval_ms: Time added for each following image
+        :param timestamp_func: Optional callable(path, index) returning the epoch ms of an image,
+            overriding start_epoch_ms and frame_interval_ms
+        :param full_queue_wait: Seconds to sleep while the stream's queue is full
+        :param prefilter: Optional callable(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time)
+            returning False for images that should not be pushed, such as an alprstream_motion.MotionFilter
+        """
+        self.stream = stream
+        self.decoder = decoder or _imread
+        self.workers = workers
+        self.prefetch = prefetch or 2 * workers
+        self.start_epoch_ms = start_epoch_ms if start_epoch_ms is not None else int(time.time() * 1000)
+        self.frame_interval_ms = frame_interval_ms
+        self.timestamp_func = timestamp_func
+        self.full_queue_wait = full_queue_wait
+        self.prefilter = prefilter
+        self._decoded = 0
+        self._failed = 0
+        self._pushed = 0
+        self._skipped = 0
+        self._batches = 0
+        self._elapsed = 0.0
+
+    def _decode(self, path):
+        # Runs on a worker thread
+        try:
+            return self.decoder(path)
+        except Exception:
+            return None
+
+    def decoded_frames(self, paths):
+        """
+        Decodes images on the thread pool, at most prefetch images ahead of the consumer.
+        :param paths: An iterable of image paths
+        :return: An iterator of (index, path, image) in the order of paths.  Images that fail to decode
+            are counted and skipped
+        """
+        pending = collections.deque()
+        paths = enumerate(paths)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="alprstream-decode") as executor:
+            def submit_next():
+                for frame_index, path in paths:
+                    pending.append((frame_index, path, executor.submit(self._decode, path)))
+                    return
+
+            try:
+                for _ in range(self.prefetch):
+                    submit_next()
+                while pending:
+                    frame_index, path, future = pending.popleft()
+                    submit_next()
+                    image = future.result()
+                    if image is None:
+                        self._failed += 1
+                        continue
+                    self._decoded += 1
+                    yield frame_index, path, image
+            finally:
+                # The consumer stopped early: do not decode the prefetched images
+                for _, _, future in pending:
+                    future.cancel()
+
+    def _wait_for_room(self, stop_event=None):
+        # Returns False if stop_event was set or the stream closed while waiting
+        capacity = getattr(self.stream, "frame_queue_size", 0)
+        if not capacity:
+            return stop_event is None or not stop_event.is_set()
+        while self.stream.get_queue_size() >= capacity:
+            if stop_event is not None:
+                if stop_event.wait(self.full_queue_wait):
+                    return False
+            else:
+                time.sleep(self.full_queue_wait)
+        return self.stream.is_loaded and (stop_event is None or not stop_event.is_set())
+
+    def _push(self, frame_index, path, image):
+        height, width = image.shape[:2]
+        bytes_per_pixel = image.shape[2] if image.ndim == 3 else 1
+        if self.timestamp_func is not None:
+            epoch_ms = self.timestamp_func(path, frame_index)
+        else:
+            epoch_ms = self.start_epoch_ms + frame_index * self.frame_interval_ms
+        if self.prefilter is not None and not self.prefilter(image, bytes_per_pixel, width, height, epoch_ms):
+            self._skipped += 1
+            return False
+        self.stream.push_frame(image, bytes_per_pixel, width, height, epoch_ms)
+        self._pushed += 1
+        return True
+
+    def push_all(self, paths, stop_event=None):
+        """
+        Pushes every image in order, holding back while the stream's queue is at its frame_queue_size.
+        Use this when another thread (e.g. a BatchScheduler) is processing the stream.
+        :param paths: An iterable of image paths
+        :param stop_event: Optional threading.Event.  Setting it makes push_all return before the next image,
+            without pushing it; the stream closing has the same effect
+        :return: The number of images pushed
+        """
+        start = time.monotonic()
+        pushed = self._pushed
+        frames = self.decoded_frames(paths)
+        try:
+            for frame_index, path, image in frames:
+                if not self._wait_for_room(stop_event):
+                    break
+                self._push(frame_index, path, image)
+        finally:
+            frames.close()
+            self._elapsed += time.monotonic() - start
+        return self._pushed - pushed
+
+    def process(self, paths, alpr_instance, batch_size=10, on_frames=None, on_groups=None):
+        """
+        Pushes every image in order and processes batches on the calling thread.  A batch is processed
+        whenever batch_size frames are queued, and the final partial batch is processed at the end.
+        :param paths: An iterable of image paths
+        :param alpr_instance: The Alpr instance used for process_batch
+        :param batch_size: Number of queued frames that triggers a batch.  Capped at the stream's frame_queue_size
+        :param on_frames: Optional callback(frames) for each processed batch
+        :param on_groups: Optional callback(groups) for completed groups
+        :return: The number of images pushed
+        """
+        capacity = getattr(self.stream, "frame_queue_size", 0)
+        if capacity:
+            batch_size = min(batch_size, capacity)
+        start = time.monotonic()
+        pushed = self._pushed
+
+        def run_batch():
+            frames = self.stream.process_batch(alpr_instance)
+            self._batches += 1
+            if frames and on_frames is not None:
+                on_frames(frames)
+            groups = self.stream.pop_completed_groups()
+            if groups and on_groups is not None:
+                on_groups(groups)
+            return frames
+
+        try:
+            for frame_index, path, image in self.decoded_frames(paths):
+                if self._push(frame_index, path, image) and self.stream.get_queue_size() >= batch_size:
+                    run_batch()
+            while self.stream.get_queue_size() > 0:
+                if not run_batch():
+                    break
+        finally:
+            self._elapsed += time.monotonic() - start
+        return self._pushed - pushed
+
+    def stats(self):
+        """
+        :return: IngestStats for everything this ingestor has pushed so far
+        """
+        return IngestStats(self._decoded, self._failed, self._pushed, self._batches, self._elapsed, self._skipped)
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Optional hot-path metrics for AlprStream, with a Prometheus text exporter.
+
+Instrumentation is off by default.  It is switched on per stream, and each stream
+reports under its own label:
+
+    stream = AlprStream(15, False)
+    metrics = stream.enable_metrics("gate-1")
+    server = MetricsServer(port=9464).start()     # http://127.0.0.1:9464/metrics
+    ...
+    print(metrics.snapshot())
+
+The time spent inside the native library is recorded separately from the time spent in
+the binding around it (resolving the pixel buffer, copying results out, freeing native
+responses), so recognition time can be told apart from Python overhead.  When a stream
+has no metrics attached, each instrumented call costs one attribute check.
+"""
+import bisect
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+# Upper bounds, in frames, of the queue depth histogram buckets
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_perf_counter = getattr(time, "perf_counter", time.time)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed bucket bounds, in the Prometheus sense (value <= bound).
+    """
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def copy(self):
+        histogram = Histogram.__new__(Histogram)
+        histogram.bounds = self.bounds
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percentile):
+        """
+        Estimates a percentile by interpolating inside the bucket that contains it.
+        :param percentile: A percentile between 0 and 100
+        :return: The estimated value, or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100.0
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - seen) / float(bucket_count)
+            seen += bucket_count
+            if index < len(self.bounds):
+                lower = self.bounds[index]
+        return self.bounds[-1]
+
+    def summary(self):
+        """
+        :return: A dict with count, sum, mean, p50 and p99
+        """
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None,
+                "p50": self.percentile(50), "p99": self.percentile(99)}
+
+
+# Instrumented calls, in the order they are exported
+CALLS = ("push_frame", "process_frame", "process_batch", "pop_completed_groups")
+
+
+class StreamMetrics(object):
+    """
+    Counters and histograms for one AlprStream.  The record_* methods are called by AlprStream
+    itself and take perf_counter timestamps.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears every counter and histogram.
+        """
+        with self._lock:
+            self.native_seconds = dict((call, Histogram()) for call in CALLS)
+            self.binding_seconds = dict((call, Histogram()) for call in CALLS)
+            self.json_parse_seconds = Histogram()
+            self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+            self.last_queue_depth = 0
+            self.frames_pushed = 0
+            self.bytes_pushed = 0
+            self.frames_processed = 0
+            self.batches = 0
+            self.groups_popped = 0
+            self.json_bytes = 0
+            self.native_frees = {"frame": 0, "batch": 0, "string": 0}
+            self.started = _perf_counter()
+
+    def record_push(self, started, native_started, finished, frame_bytes, queue_depth):
+        with self._lock:
+            self.binding_seconds["push_frame"].observe(native_started - started)
+            self.native_seconds["push_frame"].observe(finished - native_started)
+            self.frames_pushed += 1
+            self.bytes_pushed += frame_bytes
+            self.queue_depth.observe(queue_depth)
+            self.last_queue_depth = queue_depth
+
+    def record_process(self, call, started, native_finished, finished, frames, freed):
+        # call is "process_frame" or "process_batch".  Binding time covers copying results out and the free
+        with self._lock:
+            self.native_seconds[call].observe(native_finished - started)
+            self.binding_seconds[call].observe(finished - native_finished)
+            self.frames_processed += frames
+            if call == "process_batch" and frames:
+                self.batches += 1
+            if freed:
+                self.native_frees["batch" if call == "process_batch" else "frame"] += 1
+
+    def record_pop(self, started, native_finished, copied, finished, json_bytes, groups):
+        # finished == copied when the JSON is returned undecoded
+        with self._lock:
+            self.native_seconds["pop_completed_groups"].observe(native_finished - started)
+            self.binding_seconds["pop_completed_groups"].observe(copied - native_finished)
+            if groups is not None:
+                self.json_parse_seconds.observe(finished - copied)
+                self.groups_popped += groups
+            self.json_bytes += json_bytes
+            self.native_frees["string"] += 1
+
+    def copy(self):
+        """
+        A copy of every counter and histogram taken under the lock, so that they agree with each other while
+        worker threads keep recording.
+        :return: A new StreamMetrics that nothing records into
+        """
+        with self._lock:
+            metrics = StreamMetrics.__new__(StreamMetrics)
+            metrics.__dict__.update(self.__dict__)
+            metrics._lock = threading.Lock()
+            metrics.native_seconds = dict((call, h.copy()) for call, h in self.native_seconds.items())
+            metrics.binding_seconds = dict((call, h.copy()) for call, h in self.binding_seconds.items())
+            metrics.json_parse_seconds = self.json_parse_seconds.copy()
+            metrics.queue_depth = self.queue_depth.copy()
+            metrics.native_frees = dict(self.native_frees)
+            return metrics
+
+    def snapshot(self):
+        """
+        The current values as plain Python objects.
+        :return: A dict of counters, per-call latency summaries (seconds) and rates since the last reset
+        """
+        with self._lock:
+            elapsed = _perf_counter() - self.started
+            return {
+                "stream": self.name,
+                "elapsed": elapsed,
+                "frames_pushed": self.frames_pushed,
+                "bytes_pushed": self.bytes_pushed,
+                "frames_processed": self.frames_processed,
+                "batches": self.batches,
+                "groups_popped": self.groups_popped,
+                "json_bytes": self.json_bytes,
+                "native_frees": dict(self.native_frees),
+                "push_fps": self.frames_pushed / elapsed if elapsed > 0 else 0.0,
+                "process_fps": self.frames_processed / elapsed if elapsed > 0 else 0.0,
+                "queue_depth": dict(self.queue_depth.summary(), last=self.last_queue_depth),
+                "native_seconds": dict((call, h.summary()) for call, h in self.native_seconds.items()),
+                "binding_seconds": dict((call, h.summary()) for call, h in self.binding_seconds.items()),
+                "json_parse_seconds": self.json_parse_seconds.summary(),
+            }
+
+    def __repr__(self):
+        return "StreamMetrics(%s: %d pushed, %d processed)" % (self.name, self.frames_pushed, self.frames_processed)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _labels(**labels):
+    return "{" + ",".join('%s="%s"' % (key, _escape_label(value)) for key, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _render_histogram(lines, name, histogram, labels):
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.bounds, histogram.counts):
+        cumulative += bucket_count
+        lines.append("%s_bucket%s %d" % (name, _labels(le=_format_value(float(bound)), **labels), cumulative))
+    lines.append("%s_bucket%s %d" % (name, _labels(le="+Inf", **labels), histogram.count))
+    lines.append("%s_sum%s %s" % (name, _labels(**labels), _format_value(histogram.sum)))
+    lines.append("%s_count%s %d" % (name, _labels(**labels), histogram.count))
+
+
+class MetricsRegistry(object):
+    """
+    The StreamMetrics of every instrumented stream, keyed by stream name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._next_id = 0
+
+    def stream(self, name=None):
+        """
+        Returns the metrics for a stream name, creating them on first use.
+        :param name: The stream label.  Defaults to a generated "stream-N"
+        :return: A StreamMetrics
+        """
+        with self._lock:
+            if name is None:
+                name = "stream-%d" % self._next_id
+                self._next_id += 1
+            metrics = self._streams.get(name)
+            if metrics is None:
+                metrics = self._streams[name] = StreamMetrics(name)
+            return metrics
+
+    def remove(self, name):
+        """
+        Stops exporting a stream's metrics.
+        """
+        with self._lock:
+            self._streams.pop(name, None)
+
+    def streams(self):
+        """
+        :return: The registered StreamMetrics, sorted by name
+        """
+        with self._lock:
+            return [self._streams[name] for name in sorted(self._streams)]
+
+    def snapshot(self):
+        """
+        :return: A dict mapping each stream name to StreamMetrics.snapshot()
+        """
+        return dict((metrics.name, metrics.snapshot()) for metrics in self.streams())
+
+    def render(self):
+        """
+        Formats every registered stream in the Prometheus text exposition format.
+        :return: The exposition text
+        """
+        # Rendered from copies, so a histogram's buckets, sum and count come from the same moment
+        streams = [metrics.copy() for metrics in self.streams()]
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        counters = (("alprstream_frames_pushed_total", "frames_pushed", "Frames passed to push_frame"),
+                    ("alprstream_bytes_pushed_total", "bytes_pushed", "Raw pixel bytes passed to push_frame"),
+                    ("alprstream_frames_processed_total", "frames_processed",
+                     "Frames returned by process_frame and process_batch"),
+                    ("alprstream_batches_total", "batches", "Non-empty batches returned by process_batch"),
+                    ("alprstream_groups_popped_total", "groups_popped", "Plate groups returned by pop_completed_groups"),
+                    ("alprstream_group_json_bytes_total", "json_bytes", "Bytes of group JSON copied out of the library"))
+        for name, attribute, help_text in counters:
+            family(name, "counter", help_text)
+            for metrics in streams:
+                lines.append("%s%s %d" % (name, _labels(stream=metrics.name), getattr(metrics, attribute)))
+
+        family("alprstream_native_frees_total", "counter", "Native responses released by the binding")
+        for metrics in streams:
+            for kind in sorted(metrics.native_frees):
+                lines.append("alprstream_native_frees_total%s %d" %
+                             (_labels(stream=metrics.name, kind=kind), metrics.native_frees[kind]))
+
+        family("alprstream_queue_frames", "gauge", "Video buffer size returned by the most recent push_frame")
+        for metrics in streams:
+            lines.append("alprstream_queue_frames%s %d" % (_labels(stream=metrics.name), metrics.last_queue_depth))
+
+        family("alprstream_queue_depth_frames", "histogram", "Video buffer size sampled at every push_frame")
+        for metrics in streams:
+            _render_histogram(lines, "alprstream_queue_depth_frames", metrics.queue_depth, {"stream": metrics.name})
+
+        family("alprstream_native_seconds", "histogram", "Time spent inside the native library call")
+        for metrics in streams:
+            for call in CALLS:
+                _render_histogram(lines, "alprstream_native_seconds", metrics.native_seconds[call],
+                                  {"stream": metrics.name, "call": call})
+
+        family("alprstream_binding_seconds", "histogram",
+               "Time spent in the Python binding around the native call, excluding JSON parsing")
+        for metrics in streams:
+            for call in CALLS:
+                _render_histogram(lines, "alprstream_binding_seconds", metrics.binding_seconds[call],
+                                  {"stream": metrics.name, "call": call})
+
+        family("alprstream_json_parse_seconds", "histogram", "Time spent decoding completed group JSON")
+        for metrics in streams:
+            _render_histogram(lines, "alprstream_json_parse_seconds", metrics.json_parse_seconds,
+                              {"stream": metrics.name})
+        return "\n".join(lines) + "\n"
+
+
+# Registry used by AlprStream.enable_metrics() and MetricsServer unless another one is given
+default_registry = MetricsRegistry()
+
+
+class MetricsServer(object):
+    """
+    Serves a registry in the Prometheus text format from a background thread.
+    """
+
+    def __init__(self, registry=None, port=9464, host="127.0.0.1", path="/metrics"):
+        """
+        :param registry: The MetricsRegistry to export.  Defaults to default_registry
+        :param port: TCP port to listen on.  0 picks a free port, see .port after start()
+        :param host: Address to bind.  Defaults to localhost only
+        :param path: URL path of the metrics page
+        """
+        self.registry = registry or default_registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """
+        Starts listening.
+        :return: self
+        """
+        if self._server is not None:
+            return self
+        registry, path = self.registry, self.path
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != path:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="alprstream-metrics")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
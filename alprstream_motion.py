@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Python-side motion pre-filter for raw frames, applied before push_frame.
+
+The native motion detection (use_motion_detection) only runs after a frame has been
+pushed, i.e. copied into the stream's queue.  MotionFilter decides on the Python side,
+from a downsampled grayscale difference against a rolling background, so static frames
+never cross the ctypes boundary:
+
+    stream = AlprStream(15, False)
+    gate = MotionFilteredStream(stream, threshold=20, min_changed_fraction=0.005)
+    gate.push_frame(img, 3, 1280, 720, epoch_ms)        # returns None when the frame is dropped
+    print(gate.motion_filter.stats())
+
+or, for image directories, ImageIngestor(stream, prefilter=MotionFilter()).
+
+Frames are still pushed at least every keyframe_interval_ms, and for hold_frames frames
+after motion stops, so plate groups are completed and the native side keeps a current
+picture of the scene.  Each camera needs its own MotionFilter; the thresholds are
+per-instance.  Requires NumPy.
+"""
+import threading
+import time
+
+import numpy
+
+# BGR luma weights.  Weighting the channels one at a time is several times faster than numpy.dot on a strided view
+_BLUE, _GREEN, _RED = numpy.float32(0.114), numpy.float32(0.587), numpy.float32(0.299)
+
+
+class MotionFilter(object):
+    def __init__(self, threshold=16, min_changed_fraction=0.002, downsample=8, background_alpha=0.05,
+                 keyframe_interval_ms=2000, hold_frames=5):
+        """
+        Creates a filter for one camera.
+        :param threshold: Gray level difference from the background at which a sampled pixel counts as changed
+        :param min_changed_fraction: Fraction of changed sampled pixels at which a frame has motion
+        :param downsample: Sample every Nth pixel of every Nth row
+        :param background_alpha: Weight of each new frame in the rolling background, between 0 and 1
+        :param keyframe_interval_ms: Let a frame through at least this often, even without motion.  None disables it
+        :param hold_frames: Let this many frames through after the last frame with motion
+        """
+        self.threshold = threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.downsample = downsample
+        self.background_alpha = background_alpha
+        self.keyframe_interval_ms = keyframe_interval_ms
+        self.hold_frames = hold_frames
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the background and zeroes the counters.
+        """
+        with self._lock:
+            self._background = None
+            self._shape = None
+            self._last_pushed_ms = None
+            self._hold = 0
+            self.frames = 0
+            self.pushed = 0
+            self.skipped = 0
+            self.keyframes = 0
+            self.last_changed_fraction = 0.0
+
+    def _gray(self, pixelData, bytesPerPixel, imgWidth, imgHeight):
+        image = numpy.frombuffer(pixelData, dtype=numpy.uint8, count=bytesPerPixel * imgWidth * imgHeight)
+        step = self.downsample
+        sampled = image.reshape(imgHeight, imgWidth, bytesPerPixel)[::step, ::step]
+        if bytesPerPixel >= 3:
+            return sampled[:, :, 0] * _BLUE + sampled[:, :, 1] * _GREEN + sampled[:, :, 2] * _RED
+        return sampled[:, :, 0].astype(numpy.float32)
+
+    def check(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Decides whether a frame should be pushed and updates the background.  Takes the same arguments
+        as AlprStream.push_frame.
+        :return: True if the frame has motion, is a keyframe, or falls within hold_frames of motion
+        """
+        gray = self._gray(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        now_ms = frame_epoch_time if frame_epoch_time >= 0 else int(time.time() * 1000)
+        with self._lock:
+            self.frames += 1
+            background = self._background
+            if background is None or self._shape != gray.shape:
+                self._background = gray
+                self._shape = gray.shape
+                changed = 1.0
+            else:
+                difference = numpy.abs(gray - background)
+                changed = int(numpy.count_nonzero(difference > self.threshold)) / float(difference.size)
+                background += self.background_alpha * (gray - background)
+            self.last_changed_fraction = changed
+
+            if changed >= self.min_changed_fraction:
+                self._hold = self.hold_frames
+                push = True
+            elif self._hold > 0:
+                self._hold -= 1
+                push = True
+            elif self.keyframe_interval_ms is not None and (
+                    self._last_pushed_ms is None or now_ms - self._last_pushed_ms >= self.keyframe_interval_ms):
+                self.keyframes += 1
+                push = True
+            else:
+                push = False
+
+            if push:
+                self.pushed += 1
+                self._last_pushed_ms = now_ms
+            else:
+                self.skipped += 1
+            return push
+
+    __call__ = check
+
+    def stats(self):
+        """
+        :return: A dict with the frames checked, pushed, skipped and pushed only as keyframes
+        """
+        with self._lock:
+            return {"frames": self.frames, "pushed": self.pushed, "skipped": self.skipped,
+                    "keyframes": self.keyframes, "last_changed_fraction": self.last_changed_fraction}
+
+
+class MotionFilteredStream(object):
+    def __init__(self, stream, motion_filter=None, **settings):
+        """
+        Wraps a stream so that frames without motion are dropped before push_frame.
+        :param stream: The AlprStream (or e.g. RoiStream) to push to
+        :param motion_filter: The MotionFilter to use.  If None, one is created from settings
+        :param settings: MotionFilter arguments, e.g. threshold=20
+        """
+        self.stream = stream
+        self.motion_filter = motion_filter if motion_filter is not None else MotionFilter(**settings)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Pushes the frame if the motion filter lets it through.  Takes the same arguments as AlprStream.push_frame.
+        :return: The video input buffer size after adding this image, or None if the frame was dropped
+        """
+        if not self.motion_filter.check(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time):
+            return None
+        return self.stream.push_frame(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time)
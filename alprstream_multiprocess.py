@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process runtime that shards cameras across worker processes.
+
+Every worker process owns one Alpr instance and one AlprStream per camera assigned to it,
+so result handling, JSON decoding and any per-group callback run outside the parent's
+GIL.  Frames pushed in the parent are copied once into a per-camera ring of slots in
+multiprocessing.shared_memory and handed to the native library from there without being
+pickled.  Completed groups come back as raw JSON bytes over a single queue:
+
+    def make_alpr():
+        return Alpr("us", "", LICENSE_KEY)
+
+    runtime = MultiProcessRuntime(make_alpr, workers=4)
+    for camera_id in cameras:
+        runtime.add_camera(camera_id)
+    runtime.start()
+    runtime.push_frame("gate-1", img, 3, img.shape[1], img.shape[0], epoch_ms)
+    for camera_id, group in runtime.completed_groups(timeout=0.1):
+        ...
+    runtime.stop()
+
+alpr_factory and on_groups are sent to the workers, so they must be picklable (module
+level functions) when the "spawn" start method is used.
+"""
+import ctypes
+import json
+import multiprocessing
+import os
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+
+from alprstream import AlprStream, _pixel_buffer
+
+# epoch time, bytes per pixel, width, height
+_SLOT_HEADER = struct.Struct("<qiii")
+_SLOT_HEADER_SIZE = 64
+
+# Seconds between checks that the consumer is still alive while put() waits for a free slot
+_RING_POLL = 0.1
+
+# Kinds of message a worker sends back on the results queue: (kind, camera_id or worker index, payload)
+_GROUPS = 0
+_ERROR = 1
+_EXITED = 2
+
+
+def _align(size, alignment=64):
+    return (size + alignment - 1) // alignment * alignment
+
+
+class FrameRing(object):
+    """
+    Single-producer, single-consumer ring of fixed-size frame slots in shared memory.
+    Two semaphores count free and filled slots; each side keeps its own position.
+    """
+
+    def __init__(self, slot_count, max_frame_bytes, name=None, create=True, free_slots=None, filled_slots=None,
+                 context=multiprocessing):
+        self.slot_count = slot_count
+        self.max_frame_bytes = max_frame_bytes
+        self.slot_stride = _SLOT_HEADER_SIZE + _align(max_frame_bytes)
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.slot_stride * slot_count)
+            self.free_slots = context.Semaphore(slot_count)
+            self.filled_slots = context.Semaphore(0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.free_slots = free_slots
+            self.filled_slots = filled_slots
+        self._position = 0
+
+    def __getstate__(self):
+        return {"slot_count": self.slot_count, "max_frame_bytes": self.max_frame_bytes, "name": self.shm.name,
+                "free_slots": self.free_slots, "filled_slots": self.filled_slots}
+
+    def __setstate__(self, state):
+        self.__init__(state["slot_count"], state["max_frame_bytes"], name=state["name"], create=False,
+                      free_slots=state["free_slots"], filled_slots=state["filled_slots"])
+
+    def put(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time, timeout=None,
+            consumer_alive=None):
+        """
+        Copies a frame into the next free slot.
+        :param timeout: Seconds to wait for a free slot.  None waits forever, 0 does not wait
+        :param consumer_alive: Optional callable checked every 0.1 s while waiting.  Once it returns False
+            put raises RuntimeError instead of waiting for a slot that will never be freed
+        :return: True if the frame was queued, False if the ring stayed full
+        """
+        pointer, keepalive = _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        size = bytesPerPixel * imgWidth * imgHeight
+        if size > self.max_frame_bytes:
+            raise ValueError("Frame of %d bytes exceeds the ring slot size of %d bytes" % (size, self.max_frame_bytes))
+        if not self._acquire_free(timeout, consumer_alive):
+            return False
+        offset = self._position * self.slot_stride
+        _SLOT_HEADER.pack_into(self.shm.buf, offset, frame_epoch_time, bytesPerPixel, imgWidth, imgHeight)
+        destination = (ctypes.c_char * size).from_buffer(self.shm.buf, offset + _SLOT_HEADER_SIZE)
+        ctypes.memmove(destination, pointer, size)
+        del destination, keepalive
+        self._position = (self._position + 1) % self.slot_count
+        self.filled_slots.release()
+        return True
+
+    def _acquire_free(self, timeout, consumer_alive):
+        if consumer_alive is None or timeout == 0:
+            return self.free_slots.acquire(timeout is None or timeout > 0, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = _RING_POLL if deadline is None else max(0.0, min(_RING_POLL, deadline - time.monotonic()))
+            if self.free_slots.acquire(True, wait):
+                return True
+            if not consumer_alive():
+                raise RuntimeError("The consumer of this frame ring has exited")
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def get(self):
+        """
+        Takes the oldest filled slot without waiting.  The returned view is only valid until release().
+        :return: (view, bytesPerPixel, width, height, frame_epoch_time), or None if the ring is empty
+        """
+        if not self.filled_slots.acquire(False):
+            return None
+        offset = self._position * self.slot_stride
+        frame_epoch_time, bytes_per_pixel, width, height = _SLOT_HEADER.unpack_from(self.shm.buf, offset)
+        start = offset + _SLOT_HEADER_SIZE
+        return self.shm.buf[start:start + bytes_per_pixel * width * height], bytes_per_pixel, width, height, \
+            frame_epoch_time
+
+    def release(self):
+        """
+        Returns the slot taken by the last get() to the producer.
+        """
+        self._position = (self._position + 1) % self.slot_count
+        self.free_slots.release()
+
+    def close(self, unlink=False):
+        """
+        Detaches from the shared memory.  The creating side passes unlink=True to free it.
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(worker_index, cameras, alpr_factory, frame_queue_size, use_motion_detection, library_path,
+                 on_groups, results, stop_event, idle_wait):
+    streams = []
+    try:
+        # Inside the try, so that a worker whose setup fails still reports that it exited
+        alpr = alpr_factory()
+        for camera_id, ring in cameras:
+            streams.append((camera_id, ring, AlprStream(frame_queue_size, use_motion_detection,
+                                                        library_path=library_path)))
+        while True:
+            stopping = stop_event.is_set()
+            busy = False
+            for camera_id, ring, stream in streams:
+                # Move frames from shared memory into the native queue while it has room
+                while stream.get_queue_size() < frame_queue_size:
+                    frame = ring.get()
+                    if frame is None:
+                        break
+                    view, bytes_per_pixel, width, height, frame_epoch_time = frame
+                    try:
+                        stream.push_frame(view, bytes_per_pixel, width, height, frame_epoch_time)
+                    finally:
+                        view.release()
+                        ring.release()
+                    busy = True
+
+                if stream.get_queue_size() > 0:
+                    stream.process_batch(alpr)
+                    busy = True
+                raw_groups = stream.pop_completed_groups_raw()
+                if raw_groups and raw_groups != b"[]":
+                    if on_groups is not None:
+                        try:
+                            on_groups(camera_id, json.loads(raw_groups.decode("UTF-8")))
+                        except Exception as e:
+                            # Reported instead of ending the worker, which would leave the camera's ring full
+                            results.put((_ERROR, camera_id, "%s: %s" % (type(e).__name__, e)))
+                    results.put((_GROUPS, camera_id, raw_groups))
+            if not busy:
+                if stopping:
+                    break
+                time.sleep(idle_wait)
+    finally:
+        for camera_id, ring, stream in streams:
+            stream.close()
+        for camera_id, ring in cameras:
+            ring.close()
+        results.put((_EXITED, worker_index, None))
+
+
+class MultiProcessRuntime(object):
+    def __init__(self, alpr_factory, workers=None, frame_queue_size=15, use_motion_detection=False,
+                 slot_count=8, max_frame_bytes=1920 * 1080 * 3, library_path=None, on_groups=None,
+                 idle_wait=0.001, context=None):
+        """
+        Creates the runtime.  Cameras are added with add_camera() before start().
+        :param alpr_factory: Callable returning a new Alpr instance, called once in each worker
+        :param workers: Number of worker processes.  Defaults to the number of CPUs
+        :param frame_queue_size: The frame_queue_size of each camera's AlprStream
+        :param use_motion_detection: Whether the AlprStreams use motion detection
+        :param slot_count: Frames each camera can have in flight between the parent and its worker
+        :param max_frame_bytes: Size of the largest frame that will be pushed
+        :param library_path: Optional path to libalprstream for the workers
+        :param on_groups: Optional callback(camera_id, groups) run inside the worker for each batch of
+            completed groups, before they are forwarded to the parent.  Exceptions it raises are counted in
+            errors and last_error, and the groups are still forwarded
+        :param idle_wait: Seconds a worker sleeps when none of its cameras has work
+        :param context: Optional multiprocessing context, e.g. multiprocessing.get_context("spawn")
+        """
+        self.alpr_factory = alpr_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.frame_queue_size = frame_queue_size
+        self.use_motion_detection = use_motion_detection
+        self.slot_count = slot_count
+        self.max_frame_bytes = max_frame_bytes
+        self.library_path = library_path
+        self.on_groups = on_groups
+        self.idle_wait = idle_wait
+        self._context = context or multiprocessing.get_context()
+
+        self._rings = {}
+        self._assignments = [[] for _ in range(self.workers)]
+        self._processes = []
+        self._camera_processes = {}
+        self._results = None
+        self._stop_event = None
+        self._running_workers = 0
+        self.errors = 0
+        self.last_error = None
+
+    def add_camera(self, camera_id):
+        """
+        Registers a camera and assigns it to the worker with the fewest cameras.
+        :param camera_id: Any picklable, hashable identifier
+        """
+        if self._processes:
+            raise RuntimeError("Cameras must be added before the runtime is started")
+        if camera_id in self._rings:
+            raise ValueError("Camera %r was already added" % (camera_id,))
+        ring = FrameRing(self.slot_count, self.max_frame_bytes, context=self._context)
+        self._rings[camera_id] = ring
+        min(self._assignments, key=len).append((camera_id, ring))
+
+    def start(self):
+        """
+        Starts the worker processes.
+        """
+        if self._processes:
+            raise RuntimeError("MultiProcessRuntime is already running")
+        self._results = self._context.Queue()
+        self._stop_event = self._context.Event()
+        for index, cameras in enumerate(self._assignments):
+            if not cameras:
+                continue
+            process = self._context.Process(
+                target=_worker_main, name="alprstream-worker-%d" % index,
+                args=(index, cameras, self.alpr_factory, self.frame_queue_size, self.use_motion_detection,
+                      self.library_path, self.on_groups, self._results, self._stop_event, self.idle_wait))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+            for camera_id, ring in cameras:
+                self._camera_processes[camera_id] = process
+        self._running_workers = len(self._processes)
+
+    def push_frame(self, camera_id, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1,
+                   timeout=None):
+        """
+        Queues a raw frame for a camera.  The pixels are copied once into shared memory.
+        :param camera_id: A camera registered with add_camera()
+        :param timeout: Seconds to wait while the camera's ring is full.  None waits, 0 drops immediately
+        :return: True if the frame was queued, False if it was dropped because the ring was full
+        :raises RuntimeError: If the camera's worker process exited while waiting for room
+        """
+        process = self._camera_processes.get(camera_id)
+        return self._rings[camera_id].put(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time, timeout,
+                                          process.is_alive if process is not None else None)
+
+    def completed_groups(self, timeout=0):
+        """
+        Yields the groups that workers have sent back so far.  Errors reported by the workers' on_groups
+        callbacks are counted in errors and last_error as they are read.
+        :param timeout: Seconds to wait for the first result.  0 only returns what is already available
+        :return: An iterator of (camera_id, group) pairs
+        """
+        block = timeout is None or timeout > 0
+        while self._results is not None:
+            try:
+                kind, camera_id, payload = self._results.get(block, timeout)
+            except queue.Empty:
+                return
+            block = False
+            if kind == _EXITED:
+                self._running_workers -= 1
+                continue
+            if kind == _ERROR:
+                self.errors += 1
+                self.last_error = "%r: %s" % (camera_id, payload)
+                continue
+            for group in json.loads(payload.decode("UTF-8")):
+                yield camera_id, group
+
+    def stop(self, timeout=None):
+        """
+        Lets the workers process every frame already pushed, then shuts them down.
+        :param timeout: Seconds to wait for each worker to exit
+        :return: Any (camera_id, group) pairs that arrived during shutdown
+        """
+        remaining = []
+        if self._processes:
+            self._stop_event.set()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            # A worker that died without reporting (e.g. killed) is not waited for
+            while self._running_workers > 0 and any(process.is_alive() for process in self._processes):
+                wait = 0.1 if deadline is None else max(0.0, min(0.1, deadline - time.monotonic()))
+                remaining.extend(self.completed_groups(timeout=wait))
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+            remaining.extend(self.completed_groups(timeout=0))
+            for process in self._processes:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
+            self._camera_processes = {}
+        for ring in self._rings.values():
+            ring.close(unlink=True)
+        self._rings = {}
+        return remaining
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
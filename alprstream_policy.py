@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion policies deciding which frames AlprStream.push_frame lets into the native queue.
+
+When recognition cannot keep up, the native queue fills and the library silently drops the
+oldest frames.  A policy attached with AlprStream.set_ingest_policy makes that choice
+explicit and counted:
+
+    stream.set_ingest_policy(PolicyChain(TargetFps(10), QueueFullPolicy(DROP_NEWEST)))
+    ...
+    print(stream.ingest_policy.stats())     # {"admitted": 812, "dropped": {"rate": 1590, "queue_full": 12}, ...}
+
+EveryNthFrame and TargetFps decimate, QueueFullPolicy chooses between dropping the
+newest and the oldest frame when the queue is full, and AdaptiveDecimation raises its
+skip rate while the estimated queue latency is above a target.
+
+Policies do not apply to connect_video_file and connect_video_stream_url.  Those frames are
+queued by the library's own thread and never pass through push_frame, and the binding has
+no way to choose which queued frame the library drops, so under overload the library's own
+behaviour applies (a file waits for room, a stream URL drops its oldest frames).  Feed the
+source through VideoSource instead to apply a policy, or read the "native" drop counter,
+which counts the frame numbers missing from processed batches (frames the library dropped
+or skipped for motion) that a policy did not already count.
+"""
+import collections
+import math
+import threading
+import time
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+_monotonic = getattr(time, "monotonic", time.time)
+
+
+def _frame_ms(frame_epoch_time):
+    return frame_epoch_time if frame_epoch_time >= 0 else int(time.time() * 1000)
+
+
+class IngestPolicy(object):
+    """
+    Admits every frame.  Subclasses override _decide; every policy counts admitted and dropped frames.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.dropped = collections.Counter()
+        self._last_frame_number = None
+        self._unseen_overruns = 0
+
+    def _decide(self, stream, frame_epoch_time):
+        # Returns the reason for dropping the frame, or None to admit it.  Called with the lock held
+        return None
+
+    def admit(self, stream, frame_epoch_time=-1):
+        """
+        Decides whether a frame is pushed, and counts the decision.
+        :param stream: The AlprStream the frame is for
+        :param frame_epoch_time: The frame's epoch ms, or -1 for now
+        :return: True to push the frame
+        """
+        return self._admit(stream, frame_epoch_time) is None
+
+    def _admit(self, stream, frame_epoch_time):
+        # Like admit, but returns the reason the frame was dropped, or None
+        with self._lock:
+            reason = self._decide(stream, frame_epoch_time)
+            if reason is None:
+                self.admitted += 1
+            else:
+                self.dropped[reason] += 1
+            return reason
+
+    def _overrun(self, count=1):
+        # Counts frames the library evicts because this policy pushed into a full queue.  Called with the
+        # lock held.  Their frame numbers will be missing from processed batches, and must not be counted again
+        self.dropped["overrun"] += count
+        self._unseen_overruns += count
+
+    def observe_batch(self, stream, frames, elapsed):
+        """
+        Called by AlprStream after process_frame and process_batch with what was processed.
+        :param frames: The AlprStreamRecognizedFrame results
+        :param elapsed: Seconds the call took
+        """
+        if not frames:
+            return
+        with self._lock:
+            for frame in frames:
+                if self._last_frame_number is not None and frame.frame_number > self._last_frame_number + 1:
+                    missing = frame.frame_number - self._last_frame_number - 1
+                    overruns = min(missing, self._unseen_overruns)
+                    self._unseen_overruns -= overruns
+                    if missing > overruns:
+                        self.dropped["native"] += missing - overruns
+                self._last_frame_number = frame.frame_number
+            self._observe(stream, frames, elapsed)
+
+    def _observe(self, stream, frames, elapsed):
+        pass
+
+    def stats(self):
+        """
+        :return: A dict with the frames admitted and the frames dropped by reason
+        """
+        with self._lock:
+            return {"admitted": self.admitted, "dropped": dict(self.dropped),
+                    "dropped_total": sum(self.dropped.values())}
+
+
+class EveryNthFrame(IngestPolicy):
+    def __init__(self, n):
+        """
+        Admits one frame out of every n.
+        """
+        IngestPolicy.__init__(self)
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        self.n = n
+        self._seen = 0
+
+    def _decide(self, stream, frame_epoch_time):
+        self._seen += 1
+        return None if (self._seen - 1) % self.n == 0 else "decimated"
+
+
+class TargetFps(IngestPolicy):
+    def __init__(self, fps):
+        """
+        Admits frames at most fps times per second of frame time (wall-clock time for frames pushed with -1).
+        """
+        IngestPolicy.__init__(self)
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        self.fps = fps
+        self._interval_ms = 1000.0 / fps
+        self._next_ms = None
+
+    def _decide(self, stream, frame_epoch_time):
+        now_ms = _frame_ms(frame_epoch_time)
+        if self._next_ms is not None and now_ms < self._next_ms:
+            return "rate"
+        # Scheduled from the previous slot rather than from now, so the average rate holds with jittery input
+        if self._next_ms is None or now_ms - self._next_ms > self._interval_ms:
+            self._next_ms = now_ms + self._interval_ms
+        else:
+            self._next_ms += self._interval_ms
+        return None
+
+
+class QueueFullPolicy(IngestPolicy):
+    def __init__(self, mode=DROP_OLDEST):
+        """
+        Decides what is lost when a frame arrives while the queue holds frame_queue_size frames.
+        :param mode: DROP_NEWEST skips the arriving frame.  DROP_OLDEST pushes it, and the library drops
+            the oldest queued frame, which is counted as "overrun"
+        """
+        IngestPolicy.__init__(self)
+        if mode not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("mode must be DROP_NEWEST or DROP_OLDEST")
+        self.mode = mode
+
+    def _decide(self, stream, frame_epoch_time):
+        if stream.get_queue_size() < stream.frame_queue_size:
+            return None
+        if self.mode == DROP_NEWEST:
+            return "queue_full"
+        self._overrun()
+        return None
+
+
+class AdaptiveDecimation(IngestPolicy):
+    def __init__(self, target_latency=0.5, max_skip=10, smoothing=0.2):
+        """
+        Admits one frame in every `skip`, raising skip while the queue latency is above target_latency and
+        lowering it again once the latency is well below.  Queue latency is estimated as the queued frames
+        times the recent processing time per frame.
+        :param target_latency: Seconds of queued work to aim for
+        :param max_skip: Largest skip
+        :param smoothing: Weight of each new batch in the moving average of processing time per frame
+        """
+        IngestPolicy.__init__(self)
+        self.target_latency = target_latency
+        self.max_skip = max_skip
+        self.smoothing = smoothing
+        self.skip = 1
+        self._seconds_per_frame = None
+        self._seen = 0
+
+    def latency(self, stream):
+        """
+        :return: The estimated seconds until a frame pushed now is processed, or None before the first batch
+        """
+        if self._seconds_per_frame is None:
+            return None
+        return stream.get_queue_size() * self._seconds_per_frame
+
+    def _observe(self, stream, frames, elapsed):
+        per_frame = elapsed / len(frames)
+        if self._seconds_per_frame is None:
+            self._seconds_per_frame = per_frame
+        else:
+            self._seconds_per_frame += self.smoothing * (per_frame - self._seconds_per_frame)
+        latency = self.latency(stream)
+        if latency > self.target_latency:
+            self.skip = min(self.max_skip, max(self.skip + 1, int(math.ceil(self.skip * latency /
+                                                                            self.target_latency))))
+        elif latency < self.target_latency / 2 and self.skip > 1:
+            self.skip -= 1
+
+    def _decide(self, stream, frame_epoch_time):
+        self._seen += 1
+        return None if (self._seen - 1) % self.skip == 0 else "adaptive"
+
+    def stats(self):
+        stats = IngestPolicy.stats(self)
+        stats["skip"] = self.skip
+        return stats
+
+
+class PolicyChain(IngestPolicy):
+    def __init__(self, *policies):
+        """
+        Admits a frame only if every policy does, asking them in order.  Each policy keeps its own counters;
+        the chain's counters hold the reason of the first policy that dropped each frame, plus the frames
+        evicted by a policy that pushed into a full queue ("overrun").
+        """
+        IngestPolicy.__init__(self)
+        self.policies = policies
+
+    def _decide(self, stream, frame_epoch_time):
+        overruns = [policy.dropped["overrun"] for policy in self.policies]
+        for policy in self.policies:
+            reason = policy._admit(stream, frame_epoch_time)
+            if reason is not None:
+                return reason
+        evicted = max(policy.dropped["overrun"] - before for policy, before in zip(self.policies, overruns))
+        if evicted:
+            self._overrun(evicted)
+        return None
+
+    def observe_batch(self, stream, frames, elapsed):
+        for policy in self.policies:
+            policy.observe_batch(stream, frames, elapsed)
+        IngestPolicy.observe_batch(self, stream, frames, elapsed)
+
+    def stats(self):
+        stats = IngestPolicy.stats(self)
+        stats["policies"] = [policy.stats() for policy in self.policies]
+        return stats
+
+
+class VideoSource(object):
+    def __init__(self, stream, source, video_start_time=None, realtime=None, poll=0.002):
+        """
+        Reads a video file or stream URL with OpenCV on a background thread and pushes its frames through
+        stream.push_frame, so the stream's ingest policy applies to them.
+        :param stream: The AlprStream to push to
+        :param source: A video file path or a URL that cv2.VideoCapture can open
+        :param video_start_time: Epoch ms of the first frame of a file.  None stamps frames with the current time
+        :param realtime: Pace reading at the source's frame rate.  Defaults to True for URLs and False for files.
+            When not pacing, the reader waits while the queue is full, like connect_video_file
+        :param poll: Seconds between queue checks while waiting for room
+        """
+        self.stream = stream
+        self.source = source
+        self.video_start_time = video_start_time
+        self.realtime = realtime if realtime is not None else "://" in str(source)
+        self.poll = poll
+        self.frames_read = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="alprstream-video-source")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        import cv2
+        capture = cv2.VideoCapture(self.source)
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            started = _monotonic()
+            while not self._stop.is_set():
+                ok, image = capture.read()
+                if not ok:
+                    break
+                if self.realtime:
+                    delay = started + self.frames_read / fps - _monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                else:
+                    while (self.stream.get_queue_size() >= self.stream.frame_queue_size and
+                           not self._stop.is_set()):
+                        self._stop.wait(self.poll)
+                epoch_ms = -1
+                if self.video_start_time is not None:
+                    epoch_ms = self.video_start_time + int(round(self.frames_read * 1000.0 / fps))
+                height, width = image.shape[:2]
+                self.stream.push_frame(image, image.shape[2] if image.ndim == 3 else 1, width, height, epoch_ms)
+                self.frames_read += 1
+        finally:
+            capture.release()
+
+    def active(self):
+        """
+        :return: True while frames are still being read
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
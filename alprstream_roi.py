@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Region-of-interest cropping in front of AlprStream.push_frame.
+
+Cameras that can only see plates in part of the image waste most of their recognition
+time on the rest of it.  RoiStream wraps a stream and pushes only the pixels inside one or
+more rectangles, then maps the plate coordinates of the results back to full-frame space:
+
+    stream = AlprStream(15, False)
+    roi = RoiStream(stream, [(0, 400, 1280, 320)])         # x, y, width, height
+    roi.push_frame(img, 3, 1280, 720, epoch_ms)
+    for frame in roi.process_batch(alpr):
+        ...                                               # coordinates are in the 1280x720 frame
+    groups = roi.pop_completed_groups()
+
+A single rectangle spanning the full frame width is pushed without copying, as a pointer
+into the caller's buffer.  Otherwise the rectangles are copied, one after the other with a
+blank gap between them, into a reused mosaic buffer, so each frame still yields exactly one
+recognized frame.  Either way the pixels pushed, and roughly the recognition time, scale
+with the area of the rectangles.  Requires NumPy.
+
+RoiStream has the push_frame, process_frame, process_batch and pop_completed_groups
+methods of AlprStream and forwards everything else to the stream, so it can be handed to
+e.g. ImageIngestor in place of the stream.
+"""
+import collections
+import ctypes
+import json
+import time
+
+import numpy
+
+from alprstream import _pixel_buffer
+
+# Frame sizes remembered per stream for the img_width and img_height of results, keyed by frame epoch time
+_MAX_FRAME_SIZES = 4096
+
+
+class RegionOfInterest(collections.namedtuple("RegionOfInterest", "x y width height")):
+    """
+    A rectangle in full-frame pixel coordinates.
+    """
+    __slots__ = ()
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+
+class RoiLayout(object):
+    """
+    Where each region is placed in the pushed image, and the mapping back to the full frame.
+    """
+    def __init__(self, regions, gap=16):
+        """
+        :param regions: A list of RegionOfInterest or (x, y, width, height) tuples
+        :param gap: Blank rows between regions in the mosaic, so that no plate is found across two regions
+        """
+        if not regions:
+            raise ValueError("At least one region of interest is required")
+        self.regions = [RegionOfInterest(*region) for region in regions]
+        for region in self.regions:
+            if region.x < 0 or region.y < 0 or region.width <= 0 or region.height <= 0:
+                raise ValueError("Invalid region of interest %s" % (region,))
+        self.width = max(region.width for region in self.regions)
+        self.tops = []
+        top = 0
+        for region in self.regions:
+            self.tops.append(top)
+            top += region.height + gap
+        self.height = top - gap
+
+    def check_frame(self, imgWidth, imgHeight):
+        for region in self.regions:
+            if region.x + region.width > imgWidth or region.y + region.height > imgHeight:
+                raise ValueError("Region of interest %s does not fit in a %dx%d frame" % (region, imgWidth, imgHeight))
+
+    @property
+    def zero_copy(self):
+        # True when the pushed image is a contiguous band of rows of any frame as wide as the region
+        return len(self.regions) == 1 and self.regions[0].x == 0
+
+    def to_frame(self, x, y):
+        """
+        Maps a point of the pushed image to the full frame.
+        :return: (x, y) in full-frame pixels
+        """
+        index = len(self.tops) - 1
+        while index > 0 and y < self.tops[index]:
+            index -= 1
+        region = self.regions[index]
+        return x + region.x, y - self.tops[index] + region.y
+
+    def _remap_coordinates(self, coordinates):
+        # All corners are mapped through the region holding the plate's centre
+        if not coordinates:
+            return
+        center_y = sum(point["y"] for point in coordinates) / float(len(coordinates))
+        index = len(self.tops) - 1
+        while index > 0 and center_y < self.tops[index]:
+            index -= 1
+        region = self.regions[index]
+        dy = region.y - self.tops[index]
+        for point in coordinates:
+            point["x"] += region.x
+            point["y"] += dy
+
+    def remap_results(self, results, imgWidth=None, imgHeight=None):
+        """
+        Maps the plate coordinates of a frame's results dict to the full frame, in place.
+        :param results: The parsed results of a recognized frame
+        :param imgWidth: Full frame width to record as img_width
+        :param imgHeight: Full frame height to record as img_height
+        :return: results
+        """
+        for plate in results.get("results") or ():
+            self._remap_coordinates(plate.get("coordinates"))
+        if imgWidth is not None:
+            results["img_width"] = imgWidth
+        if imgHeight is not None:
+            results["img_height"] = imgHeight
+        return results
+
+    def remap_group(self, group):
+        """
+        Maps the plate coordinates of a group dict to the full frame, in place.
+        :return: group
+        """
+        best_plate = group.get("best_plate")
+        if best_plate:
+            self._remap_coordinates(best_plate.get("coordinates"))
+        return group
+
+
+class RoiStream(object):
+    def __init__(self, stream, regions, gap=16):
+        """
+        Wraps a stream so that only the regions of interest are pushed.
+        :param stream: The AlprStream to push to
+        :param regions: A list of RegionOfInterest or (x, y, width, height) tuples, in full-frame pixels
+        :param gap: Blank rows between regions when several are pushed as one image
+        """
+        self.stream = stream
+        self.layout = RoiLayout(regions, gap)
+        self._mosaic = None
+        self._frame_size = None
+        self._frame_sizes = collections.OrderedDict()
+        self._source_sizes = set()
+        self._pixels_in = 0
+        self._pixels_pushed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Pushes the regions of interest of a raw frame.  Takes the same arguments as AlprStream.push_frame.
+        :return: The video input buffer size after adding this image
+        """
+        layout = self.layout
+        if self._frame_size != (imgWidth, imgHeight):
+            layout.check_frame(imgWidth, imgHeight)
+            self._frame_size = (imgWidth, imgHeight)
+            self._source_sizes.add(self._frame_size)
+        if frame_epoch_time < 0:
+            # Stamped here rather than by the library, so results can be matched to their frame size
+            frame_epoch_time = int(time.time() * 1000)
+        frame_sizes = self._frame_sizes
+        frame_sizes[frame_epoch_time] = self._frame_size
+        if len(frame_sizes) > _MAX_FRAME_SIZES:
+            frame_sizes.popitem(last=False)
+        pointer, keepalive = _pixel_buffer(pixelData, bytesPerPixel, imgWidth, imgHeight)
+        if isinstance(pointer, bytes):
+            pointer = ctypes.cast(ctypes.c_char_p(pointer), ctypes.c_void_p).value
+        address = pointer
+        stride = imgWidth * bytesPerPixel
+        self._pixels_in += imgWidth * imgHeight
+
+        if layout.zero_copy and layout.width == imgWidth:
+            region = layout.regions[0]
+            band = (ctypes.c_char * (stride * region.height)).from_address(address + region.y * stride)
+            self._pixels_pushed += imgWidth * region.height
+            size = self.stream.push_frame(band, bytesPerPixel, imgWidth, region.height, frame_epoch_time)
+            del keepalive
+            return size
+
+        mosaic_stride = layout.width * bytesPerPixel
+        mosaic_size = mosaic_stride * layout.height
+        if self._mosaic is None or len(self._mosaic) != mosaic_size:
+            self._mosaic = bytearray(mosaic_size)
+        mosaic = self._mosaic
+        source = numpy.frombuffer((ctypes.c_uint8 * (stride * imgHeight)).from_address(address), dtype=numpy.uint8)
+        source = source.reshape(imgHeight, stride)
+        target = numpy.frombuffer(mosaic, dtype=numpy.uint8).reshape(layout.height, mosaic_stride)
+        for region, top in zip(layout.regions, layout.tops):
+            left = region.x * bytesPerPixel
+            row_bytes = region.width * bytesPerPixel
+            target[top:top + region.height, :row_bytes] = source[region.y:region.y + region.height,
+                                                                 left:left + row_bytes]
+        del source, keepalive
+        self._pixels_pushed += layout.width * layout.height
+        # The library copies the frame during push_frame, so the mosaic is reused for the next one
+        return self.stream.push_frame(mosaic, bytesPerPixel, layout.width, layout.height, frame_epoch_time)
+
+    def remap_frame(self, frame):
+        """
+        Maps a recognized frame's plate coordinates to the full frame, updating results and results_str.
+        Frames without plates are left as they are.
+        :return: frame
+        """
+        if not frame.results_str or b'"coordinates"' not in frame.results_str:
+            return frame
+        size = self._frame_sizes.get(frame.frame_epoch_time_ms)
+        if size is None and len(self._source_sizes) == 1:
+            # Evicted or not the time of a pushed frame, but every frame so far had this size
+            size = self._frame_size
+        width, height = size or (None, None)
+        results = self.layout.remap_results(frame.results, width, height)
+        frame.results_str = json.dumps(results).encode("utf-8")
+        return frame
+
+    def process_frame(self, alpr_instance):
+        """
+        Same as AlprStream.process_frame, with coordinates in full-frame space.
+        """
+        frame = self.stream.process_frame(alpr_instance)
+        return self.remap_frame(frame) if frame is not None else None
+
+    def process_batch(self, alpr_instance):
+        """
+        Same as AlprStream.process_batch, with coordinates in full-frame space.
+        """
+        return [self.remap_frame(frame) for frame in self.stream.process_batch(alpr_instance)]
+
+    def pop_completed_groups(self):
+        """
+        Same as AlprStream.pop_completed_groups, with coordinates in full-frame space.
+        """
+        return [self.layout.remap_group(group) for group in self.stream.pop_completed_groups()]
+
+    def pop_completed_groups_raw(self):
+        """
+        Same as AlprStream.pop_completed_groups_raw, with coordinates in full-frame space.  The JSON is decoded
+        and encoded again only when it holds coordinates.
+        """
+        raw = self.stream.pop_completed_groups_raw()
+        if not raw or b'"coordinates"' not in raw:
+            return raw
+        groups = json.loads(raw.decode("utf-8"))
+        return json.dumps([self.layout.remap_group(group) for group in groups]).encode("utf-8")
+
+    def wait_for_completed_groups(self, timeout=None):
+        """
+        Same as AlprStream.wait_for_completed_groups, with coordinates in full-frame space.
+        """
+        return [self.layout.remap_group(group) for group in self.stream.wait_for_completed_groups(timeout)]
+
+    def stats(self):
+        """
+        :return: A dict with the pixels received and pushed, and their ratio
+        """
+        return {"pixels_in": self._pixels_in, "pixels_pushed": self._pixels_pushed,
+                "pushed_fraction": self._pixels_pushed / float(self._pixels_in) if self._pixels_in else 0.0}
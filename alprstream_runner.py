@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line runner for video files, camera streams and image directories, started with
+python -m alprstream:
+
+    python -m alprstream run --config deployment.json --groups /var/log/alpr/groups.jsonl
+    python -m alprstream run --file /videos/gate.mp4 --stream rtsp://10.0.0.11/stream1 --images /tmp/batch
+    python -m alprstream bench --config deployment.json --duration 60 --json
+
+Every source gets its own AlprStream, and the streams share a pool of Alpr instances
+through alprstream_scheduler.BatchScheduler, so frames are read, decoded and recognized
+concurrently:
+- video files are read by the library's own file reader;
+- image directories are decoded by an alprstream_ingest.ImageIngestor thread pool;
+- camera streams are connected and reconnected by alprstream_supervisor.StreamSupervisor.
+
+"run" writes completed plate groups as JSON lines.  "bench" discards the results.  Both
+end with a summary per source: frames processed, frames per second, plate groups, batch
+latency, and (for camera streams) how old frames were when they were recognized.  They
+stop once every file and directory is done, or after --duration when cameras are
+configured.
+
+The config file is JSON.  Each source names one of "file", "stream" or "images":
+
+    {"alpr": {"country": "us", "config_file": "", "runtime_dir": "", "license_key": ""},
+     "workers": 2,
+     "defaults": {"frame_queue_size": 30, "use_motion_detection": true},
+     "supervisor": {"max_concurrent_connects": 4},
+     "sources": [{"name": "gate-1", "stream": "rtsp://10.0.0.11/stream1", "priority": 2},
+                 {"name": "archive", "file": "/videos/gate.mp4", "start_time": 1500294710000},
+                 {"name": "uploads", "images": "/data/uploads", "interval_ms": 100, "decode_workers": 4}]}
+"""
+import argparse
+import importlib
+import json
+import sys
+import threading
+import time
+
+from alprstream import AlprStream
+from alprstream_ingest import ImageIngestor, iter_image_paths
+from alprstream_metrics import Histogram, MetricsRegistry
+from alprstream_scheduler import BatchScheduler
+
+SOURCE_KINDS = ("file", "stream", "images")
+
+# Upper bounds, in seconds, of the frame age histogram buckets
+AGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class SourceConfig(object):
+    """
+    One video file, camera stream or image directory.
+    """
+    __slots__ = ("name", "kind", "location", "frame_queue_size", "use_motion_detection", "priority", "start_time",
+                 "interval_ms", "decode_workers", "gstreamer_pipeline_format")
+
+    def __init__(self, name, kind, location, frame_queue_size=30, use_motion_detection=True, priority=1.0,
+                 start_time=None, interval_ms=100, decode_workers=4, gstreamer_pipeline_format=""):
+        if kind not in SOURCE_KINDS:
+            raise ValueError("Unknown source kind %r" % (kind,))
+        self.name = name
+        self.kind = kind
+        self.location = location
+        self.frame_queue_size = frame_queue_size
+        self.use_motion_detection = use_motion_detection
+        self.priority = priority
+        self.start_time = start_time
+        self.interval_ms = interval_ms
+        self.decode_workers = decode_workers
+        self.gstreamer_pipeline_format = gstreamer_pipeline_format
+
+    def __repr__(self):
+        return "SourceConfig(%r, %s %r)" % (self.name, self.kind, self.location)
+
+
+def source_from_dict(entry, defaults=None, index=0):
+    """
+    Creates a SourceConfig from a config file entry.
+    :param entry: A dict with exactly one of "file", "stream" or "images", and optional settings
+    :param defaults: Settings applied unless the entry has its own
+    :param index: Position of the entry, used for the default name
+    """
+    settings = dict(defaults or {})
+    settings.update(entry)
+    kinds = [kind for kind in SOURCE_KINDS if kind in settings]
+    if len(kinds) != 1:
+        raise ValueError("Source %d must have exactly one of %s" % (index, ", ".join(SOURCE_KINDS)))
+    kind = kinds[0]
+    location = settings.pop(kind)
+    name = settings.pop("name", "%s-%d" % (kind, index))
+    return SourceConfig(name, kind, location, **settings)
+
+
+def load_config(path):
+    """
+    Reads a runner config file.
+    :return: (list of SourceConfig, dict of the other top-level settings)
+    """
+    with open(path) as config_file:
+        config = json.load(config_file)
+    defaults = config.pop("defaults", None)
+    sources = [source_from_dict(entry, defaults, index) for index, entry in enumerate(config.pop("sources", ()))]
+    return sources, config
+
+
+def default_alpr_factory(country="us", config_file="", runtime_dir="", license_key=""):
+    """
+    :return: A function creating openalpr.Alpr instances with these settings
+    """
+    def make_alpr():
+        from openalpr import Alpr
+        alpr = Alpr(country, config_file, runtime_dir, license_key)
+        if not alpr.is_loaded():
+            raise RuntimeError("Error loading the OpenALPR library")
+        return alpr
+    return make_alpr
+
+
+def load_factory(reference):
+    """
+    :param reference: "module:function", e.g. "mysite.alpr:make_alpr"
+    :return: The function
+    """
+    module_name, _, attribute = reference.partition(":")
+    if not attribute:
+        raise ValueError("Expected module:function, got %r" % (reference,))
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class _ImageSource(object):
+    # Wraps the stream of an image directory so BatchScheduler treats it as active while images are pushed
+
+    def __init__(self, stream, ingestor, paths):
+        self.stream = stream
+        self.ingestor = ingestor
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=ingestor.push_all, args=(paths, self._stop_event),
+                                        name="alprstream-images")
+        self._thread.daemon = True
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        # Must return before the stream is closed: the thread pushes into it
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def video_file_active(self):
+        return self._thread.is_alive()
+
+
+class SourceSummary(object):
+    """
+    What one source produced, as reported at the end of a run.  elapsed runs from the start to the last frame
+    processed for files and directories, and to the end of the run for camera streams.
+    """
+    __slots__ = ("name", "kind", "frames", "groups", "elapsed", "batch_p50", "batch_p99", "age_p50", "age_p99")
+
+    def __init__(self, name, kind, frames, groups, elapsed, batch_p50, batch_p99, age_p50, age_p99):
+        self.name = name
+        self.kind = kind
+        self.frames = frames
+        self.groups = groups
+        self.elapsed = elapsed
+        self.batch_p50 = batch_p50
+        self.batch_p99 = batch_p99
+        self.age_p50 = age_p50
+        self.age_p99 = age_p99
+
+    @property
+    def frames_per_second(self):
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        values = dict((name, getattr(self, name)) for name in self.__slots__)
+        values["frames_per_second"] = self.frames_per_second
+        return values
+
+
+class Runner(object):
+    def __init__(self, sources, alpr_factory, workers=1, library_path=None, supervisor=None, on_groups=None,
+                 on_frames=None):
+        """
+        :param sources: A list of SourceConfig
+        :param alpr_factory: Callable returning a new Alpr instance, called once per worker
+        :param workers: Number of Alpr instances, each with its own processing thread
+        :param library_path: Optional path to libalprstream
+        :param supervisor: Optional dict of StreamSupervisor keyword arguments for the camera streams
+        :param on_groups: Optional callback(source_name, groups) for completed plate groups, called from the workers
+        :param on_frames: Optional callback(source_name, frames) for processed frames, called from the workers
+        """
+        if not sources:
+            raise ValueError("No sources to run")
+        names = [source.name for source in sources]
+        if len(set(names)) != len(names):
+            raise ValueError("Source names must be unique")
+        self.sources = sources
+        self.alpr_factory = alpr_factory
+        self.workers = workers
+        self.library_path = library_path
+        self.supervisor_settings = supervisor or {}
+        self.on_groups = on_groups
+        self.on_frames = on_frames
+        self.registry = MetricsRegistry()
+        self.supervisor = None
+        self._streams = {}
+        self._ages = dict((source.name, Histogram(AGE_BUCKETS)) for source in sources if source.kind == "stream")
+        self._ages_lock = threading.Lock()
+        self._last_frame = {}
+        self._scheduler = None
+        self._started = None
+
+    @property
+    def live(self):
+        """
+        True if a camera stream is configured, so the run does not end on its own.
+        """
+        return any(source.kind == "stream" for source in self.sources)
+
+    def _handle_frames(self, name, stream, frames):
+        self._last_frame[name] = time.monotonic()
+        ages = self._ages.get(name)
+        if ages is not None:
+            now_ms = time.time() * 1000
+            with self._ages_lock:
+                for frame in frames:
+                    ages.observe(max(0.0, (now_ms - frame.frame_epoch_time_ms) / 1000.0))
+        if self.on_frames is not None:
+            self.on_frames(name, frames)
+
+    def _handle_groups(self, name, stream, groups):
+        if self.on_groups is not None:
+            self.on_groups(name, groups)
+
+    def start(self):
+        """
+        Creates the streams, starts reading every source and starts the workers.
+        """
+        self._started = time.monotonic()
+        scheduler = BatchScheduler([self.alpr_factory() for _ in range(self.workers)],
+                                   on_frames=self._handle_frames, on_groups=self._handle_groups)
+        cameras = [source for source in self.sources if source.kind == "stream"]
+        if cameras:
+            from alprstream_supervisor import CameraConfig, StreamSupervisor
+            configs = [CameraConfig(source.name, source.location, source.gstreamer_pipeline_format,
+                                    source.frame_queue_size, source.use_motion_detection) for source in cameras]
+            settings = dict(self.supervisor_settings)
+            settings.setdefault("library_path", self.library_path)
+            self.supervisor = StreamSupervisor(configs, **settings)
+            for supervised in self.supervisor.cameras():
+                self._streams[supervised.name] = supervised
+        for source in self.sources:
+            if source.kind == "stream":
+                stream = self._streams[source.name]
+            else:
+                stream = AlprStream(source.frame_queue_size, source.use_motion_detection,
+                                    library_path=self.library_path)
+                start_time = source.start_time if source.start_time is not None else int(time.time() * 1000)
+                if source.kind == "file":
+                    stream.connect_video_file(source.location, start_time)
+                else:
+                    ingestor = ImageIngestor(stream, workers=source.decode_workers, start_epoch_ms=start_time,
+                                             frame_interval_ms=source.interval_ms)
+                    stream = _ImageSource(stream, ingestor, iter_image_paths(source.location, sort=True))
+                    stream.start()
+                self._streams[source.name] = stream
+            stream.enable_metrics(source.name, self.registry)
+            scheduler.add_stream(stream, source.priority, source.name)
+        if self.supervisor is not None:
+            self.supervisor.start()
+        self._scheduler = scheduler
+        scheduler.start(until_idle=not self.live)
+        return self
+
+    def wait(self, duration=None):
+        """
+        Blocks until every file and directory is done, or until duration seconds after start.
+        :return: True if the sources finished, False if the duration ran out first
+        """
+        deadline = None if duration is None else self._started + duration
+        while self._scheduler.is_running():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._scheduler.join(0.1 if deadline is None else max(0.0, min(0.1, deadline - time.monotonic())))
+        return True
+
+    def stop(self):
+        """
+        Stops the workers and sources, hands the groups that completed meanwhile to on_groups and closes the streams.
+        :return: A list of SourceSummary
+        """
+        elapsed = time.monotonic() - self._started
+        self._scheduler.stop()
+        if self.supervisor is not None:
+            self.supervisor.stop(close=False)
+        for source in self.sources:
+            if source.kind == "images":
+                self._streams[source.name].stop()
+        summaries = []
+        scheduled = dict((stats.name, stats) for stats in self._scheduler.stats())
+        for source in self.sources:
+            stream = self._streams[source.name]
+            if source.kind == "file":
+                stream.disconnect_video_file()
+            groups = stream.pop_completed_groups()
+            if groups:
+                self._handle_groups(source.name, stream, groups)
+            snapshot = stream.metrics.snapshot()
+            batch = snapshot["native_seconds"]["process_batch"]
+            ages = self._ages.get(source.name)
+            # A file or directory that finished early is rated over the time it took
+            source_elapsed = elapsed if source.kind == "stream" else \
+                self._last_frame.get(source.name, self._started + elapsed) - self._started
+            summaries.append(SourceSummary(source.name, source.kind, snapshot["frames_processed"],
+                                           scheduled[source.name].groups + len(groups), source_elapsed,
+                                           batch["p50"], batch["p99"],
+                                           ages.percentile(50) if ages is not None else None,
+                                           ages.percentile(99) if ages is not None else None))
+            stream.close()
+        return summaries
+
+    def run(self, duration=None):
+        """
+        start(), wait(duration) and stop().  Ctrl-C stops the run early.
+        :return: A list of SourceSummary
+        """
+        self.start()
+        try:
+            self.wait(duration)
+        except KeyboardInterrupt:
+            pass
+        return self.stop()
+
+
+def _milliseconds(seconds):
+    return "%.1f" % (seconds * 1000) if seconds is not None else "-"
+
+
+def format_summary(summaries):
+    """
+    :return: The summaries as a text table with a total line
+    """
+    lines = ["%-16s %-7s %9s %10s %8s %14s %14s %12s %12s" % (
+        "source", "kind", "frames", "frames/s", "groups", "batch p50 ms", "batch p99 ms", "age p50 ms",
+        "age p99 ms")]
+    for summary in summaries:
+        lines.append("%-16s %-7s %9d %10.1f %8d %14s %14s %12s %12s" % (
+            summary.name, summary.kind, summary.frames, summary.frames_per_second, summary.groups,
+            _milliseconds(summary.batch_p50), _milliseconds(summary.batch_p99), _milliseconds(summary.age_p50),
+            _milliseconds(summary.age_p99)))
+    elapsed = max(summary.elapsed for summary in summaries) if summaries else 0.0
+    frames = sum(summary.frames for summary in summaries)
+    lines.append("%-16s %-7s %9d %10.1f %8d" % ("total", "", frames, frames / elapsed if elapsed > 0 else 0.0,
+                                                sum(summary.groups for summary in summaries)))
+    return "\n".join(lines)
+
+
+class _JsonLinesWriter(object):
+    # Writes one JSON document per line, from any thread
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == "-" else open(path, "a")
+        self._lock = threading.Lock()
+
+    def __call__(self, name, items):
+        lines = "".join(json.dumps(dict(item, source=name)) + "\n" for item in items)
+        with self._lock:
+            self.file.write(lines)
+            self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="python -m alprstream",
+                                     description="Runs license plate recognition on video files, camera streams "
+                                                 "and image directories.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="Recognize plates and write the completed plate groups")
+    bench = commands.add_parser("bench", help="Measure throughput and latency without writing results")
+    for command in (run, bench):
+        command.add_argument("--config", help="JSON config file, see alprstream_runner")
+        command.add_argument("--file", action="append", default=[], help="A video file (repeatable)")
+        command.add_argument("--stream", action="append", default=[], help="A camera stream URL (repeatable)")
+        command.add_argument("--images", action="append", default=[], help="A directory of images (repeatable)")
+        command.add_argument("--workers", type=int, help="Alpr instances, each with a processing thread")
+        command.add_argument("--frame-queue-size", type=int, help="frame_queue_size of the command line sources")
+        command.add_argument("--no-motion-detection", action="store_true",
+                             help="Disable motion detection for the command line sources")
+        command.add_argument("--duration", type=float, help="Stop after this many seconds")
+        command.add_argument("--library", help="Path to libalprstream")
+        command.add_argument("--country", help="OpenALPR country, e.g. us")
+        command.add_argument("--license-key", help="OpenALPR license key")
+        command.add_argument("--alpr-factory", help="module:function creating the Alpr instances instead")
+        command.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    run.add_argument("--groups", default="-", help="File the plate groups are appended to as JSON lines "
+                                                   "(default: standard output)")
+    run.add_argument("--frames", help="File the results of frames with plates are appended to as JSON lines")
+    return parser
+
+
+def _sources_and_settings(args):
+    sources, settings = load_config(args.config) if args.config else ([], {})
+    defaults = {}
+    if args.frame_queue_size is not None:
+        defaults["frame_queue_size"] = args.frame_queue_size
+    if args.no_motion_detection:
+        defaults["use_motion_detection"] = False
+    for kind, locations in (("file", args.file), ("stream", args.stream), ("images", args.images)):
+        for location in locations:
+            sources.append(source_from_dict({kind: location}, defaults, len(sources)))
+    return sources, settings
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    if args.command is None:
+        _parser().print_help()
+        return 2
+    sources, settings = _sources_and_settings(args)
+    if not sources:
+        sys.stderr.write("No sources: use --config, --file, --stream or --images\n")
+        return 2
+
+    alpr_settings = dict(settings.get("alpr") or {})
+    if args.country:
+        alpr_settings["country"] = args.country
+    if args.license_key:
+        alpr_settings["license_key"] = args.license_key
+    factory_reference = args.alpr_factory or settings.get("alpr_factory")
+    alpr_factory = load_factory(factory_reference) if factory_reference else default_alpr_factory(**alpr_settings)
+
+    groups_writer = frames_writer = None
+    if args.command == "run":
+        groups_writer = _JsonLinesWriter(args.groups)
+        if args.frames:
+            frames_writer = _JsonLinesWriter(args.frames)
+
+    def write_frames(name, frames):
+        frames_writer(name, [frame.results for frame in frames
+                             if frame.results_str and b'"coordinates"' in frame.results_str])
+
+    runner = Runner(sources, alpr_factory, workers=args.workers or settings.get("workers", 1),
+                    library_path=args.library or settings.get("library_path"), supervisor=settings.get("supervisor"),
+                    on_groups=groups_writer, on_frames=write_frames if frames_writer is not None else None)
+    duration = args.duration if args.duration is not None else settings.get("duration")
+    if duration is None and runner.live and args.command == "bench":
+        duration = 30.0
+    try:
+        summaries = runner.run(duration)
+    finally:
+        for writer in (groups_writer, frames_writer):
+            if writer is not None:
+                writer.close()
+
+    # The groups may be going to standard output, so the summary goes to standard error for "run"
+    output = sys.stdout if args.command == "bench" else sys.stderr
+    if args.json:
+        output.write(json.dumps([summary.as_dict() for summary in summaries], indent=2) + "\n")
+    else:
+        output.write(format_summary(summaries) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+# A minimal example.  To run many files, streams and image directories with pipelined
+# ingestion and a throughput summary, use "python -m alprstream run" (see alprstream_runner.py)
 import os
 import re
 import sys
@@ -9,17 +11,15 @@ from alprstream import AlprStream
 
 
 def print_frame_results(rframes):
-    for frame_index in range(rframes - 1):
-        rf = rframes[frame_index]
-        for i in range(len(rf.results.plates) - 1):
-            print("Frame ", rf.frame_number, " result: ", rf.results.plates[i].bestPlate.characters)
+    for rf in rframes:
+        for result in (rf.results or {}).get("results", ()):
+            print("Frame ", rf.frame_number, " result: ", result["plate"])
 
 
 def print_group_results(groups):
-    for group_index in range(len(groups) - 1):
-        group = groups[group_index]
-
-        print("Group (", group.epoch_ms_time_start, " - ", group.epoch_ms_time_end, ") ", group.best_plate_number)
+    # Groups are the dicts decoded from the library's JSON
+    for group in groups:
+        print("Group (", group["epoch_start"], " - ", group["epoch_end"], ") ", group["best_plate_number"])
 
 
 def list_files_in_dir(dirpath):
@@ -73,22 +73,22 @@ if __name__ == '__main__':
         img = cv.imread(input_images[i], 1)
         rows, cols, channels = img.shape
 
-        # Push the raw BGR pixel data
+        # Push the raw BGR pixel data, the array is passed to the library without copying
         # Use the arbitrary starting epoch time + 100ms for each image
-        alpr_stream.push_frame(img.data, img.size, rows, cols, STARTING_EPOCH_TIME_MS + (i * 100))
+        alpr_stream.push_frame(img, channels, cols, rows, STARTING_EPOCH_TIME_MS + (i * 100))
 
         BATCH_SIZE = 10
-        if alpr_stream.get_queue_size() >= BATCH_SIZE or i == len(input_images):
+        if alpr_stream.get_queue_size() >= BATCH_SIZE or i == len(input_images) - 1:
             # Process a batch once the stream is full or it's the last image
 
-            frame_results = alpr_stream.process_batch()
+            frame_results = alpr_stream.process_batch(alpr)
             print_frame_results(frame_results)
 
             # After each batch processing, can check to see if any groups are ready
             # "Groups" form based on their timestamp and plate numbers on each stream
             # The stream object has configurable options for how long to wait before
             # completing a plate group.  You may peek at the active list without popping.
-            print("After batching there are: ", alpr_stream.peek_active_groups().size(), " active groups")
+            print("After batching there are: ", alpr_stream.diff_active_groups().active, " active groups")
 
             group_results = alpr_stream.pop_completed_groups()
             print_group_results(group_results)
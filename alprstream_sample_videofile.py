@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+# A minimal example.  To run many files, streams and image directories with pipelined
+# ingestion and a throughput summary, use "python -m alprstream run" (see alprstream_runner.py)
 import os
 import re
 import sys
@@ -9,18 +11,15 @@ from alprstream import AlprStream
 
 
 def print_frame_results(rframes):
-    print rframes
-    for frame_index in range(rframes):
-        rf = rframes[frame_index]
-        for i in range(len(rf.results.plates)):
-            print("Frame ", rf.frame_number, " result: ", rf.results.plates[i].bestPlate.characters)
+    for rf in rframes:
+        for result in (rf.results or {}).get("results", ()):
+            print("Frame ", rf.frame_number, " result: ", result["plate"])
 
 
 def print_group_results(groups):
-    for group_index in range(len(groups) - 1):
-        group = groups[group_index]
-
-        print("Group (", group.epoch_ms_time_start, " - ", group.epoch_ms_time_end, ") ", group.best_plate_number)
+    # Groups are the dicts decoded from the library's JSON
+    for group in groups:
+        print("Group (", group["epoch_start"], " - ", group["epoch_end"], ") ", group["best_plate_number"])
 
 
 if __name__ == '__main__':
@@ -66,24 +65,20 @@ if __name__ == '__main__':
         BATCH_SIZE = 10
 
         # Process a batch as fast as we can, batches won't necessarily be full
-
-        single_frame = alpr_stream.process_frame(alpr)
-
         frame_results = alpr_stream.process_batch(alpr)
         
-        #print_frame_results(frame_results)
-        #alpr_stream.free_batch_response(frame_results)
+        print_frame_results(frame_results)
 
         # After each batch processing, can check to see if any groups are ready
         # "Groups" form based on their timestamp and plate numbers on each stream
         # The stream object has configurable options for how long to wait before
         # completing a plate group.  You may peek at the active list without popping.
-        print("After batching there are: ", alpr_stream.peek_active_groups(), " active groups")
+        print("After batching there are: ", alpr_stream.diff_active_groups().active, " active groups")
 
         group_results = alpr_stream.pop_completed_groups()
         print_group_results(group_results)
 
-        # Sleep a little bit so we don't spin the CPU looping
-        time.sleep(1.0)
+        # Wait for the next batch rather than spin the CPU looping
+        alpr_stream.wait_for_frames(BATCH_SIZE, timeout=1.0)
 
     print("Done")
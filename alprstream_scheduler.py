@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Batch scheduler that shares a pool of Alpr recognizers across many AlprStream instances.
+
+Instead of pairing every camera with its own Alpr and loop, one worker thread is started
+per Alpr instance.  Each worker repeatedly picks the stream that most needs service and
+calls process_batch on it:
+
+    scheduler = BatchScheduler([Alpr("us", "", key) for _ in range(4)], on_groups=handle_groups)
+    for camera_id, stream in streams.items():
+        scheduler.add_stream(stream, name=camera_id, priority=2.0 if camera_id in gates else 1.0)
+    scheduler.run()
+
+A stream is never processed by two workers at once.  Streams are ranked by how full
+their queue is and how long they have been waiting with frames queued, scaled by their
+priority.  A stream that has waited longer than max_wait is served before anything else.
+"""
+import threading
+import time
+
+
+class StreamStats(object):
+    """
+    Throughput and starvation figures for one stream, as returned by BatchScheduler.stats().
+    """
+    __slots__ = ("name", "priority", "frames", "batches", "groups", "busy_time", "max_wait", "starved",
+                 "frames_per_second", "errors", "last_error")
+
+    def __init__(self, name, priority, frames, batches, groups, busy_time, max_wait, starved, elapsed, errors=0,
+                 last_error=None):
+        self.name = name
+        self.priority = priority
+        self.frames = frames
+        self.batches = batches
+        self.groups = groups
+        self.busy_time = busy_time
+        self.max_wait = max_wait
+        self.starved = starved
+        self.frames_per_second = frames / elapsed if elapsed > 0 else 0.0
+        self.errors = errors
+        self.last_error = last_error
+
+    def __repr__(self):
+        return "StreamStats(%s: %d frames, %.1f fps, max wait %.3fs, starved %d times, %d errors)" % \
+               (self.name, self.frames, self.frames_per_second, self.max_wait, self.starved, self.errors)
+
+
+class _ScheduledStream(object):
+    __slots__ = ("stream", "name", "priority", "busy", "removed", "waiting_since", "frames", "batches", "groups",
+                 "busy_time", "max_wait", "starved", "errors", "last_error")
+
+    def __init__(self, stream, name, priority):
+        self.stream = stream
+        self.name = name
+        self.priority = priority
+        self.busy = False
+        self.removed = False
+        self.waiting_since = None
+        self.frames = 0
+        self.batches = 0
+        self.groups = 0
+        self.busy_time = 0.0
+        self.max_wait = 0.0
+        self.starved = 0
+        self.errors = 0
+        self.last_error = None
+
+
+class BatchScheduler(object):
+    def __init__(self, alpr_instances, on_frames=None, on_groups=None, max_wait=1.0, idle_wait=0.005,
+                 on_error=None):
+        """
+        Creates a scheduler.  No threads are started until run() or start() is called.
+        :param alpr_instances: The Alpr instances to share.  One worker thread is used per instance
+        :param on_frames: Optional callback(name, stream, frames) receiving each processed batch
+        :param on_groups: Optional callback(name, stream, groups) receiving completed plate groups
+        :param max_wait: Seconds a stream may wait with queued frames before it counts as starved
+            and is served ahead of every other stream
+        :param idle_wait: Seconds a worker sleeps when no stream has queued frames
+        :param on_error: Optional callback(name, stream, exception) for an exception raised by process_batch,
+            pop_completed_groups or the callbacks above.  The worker goes on with the next batch either way, and the
+            error is counted in the stream's StreamStats
+        """
+        if not alpr_instances:
+            raise ValueError("At least one Alpr instance is required")
+        self.alpr_instances = list(alpr_instances)
+        self.on_frames = on_frames
+        self.on_groups = on_groups
+        self.max_wait = max_wait
+        self.idle_wait = idle_wait
+        self.on_error = on_error
+
+        self._streams = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._started_at = None
+        self._until_idle = False
+        self._idle_workers = 0
+
+    def add_stream(self, stream, priority=1.0, name=None):
+        """
+        Adds a stream to the set being scheduled.  May be called while the scheduler runs.
+        :param stream: An AlprStream
+        :param priority: Relative weight of this stream.  A stream with priority 2 is served as if its
+            queue were twice as full and it had been waiting twice as long
+        :param name: Label used in callbacks and statistics.  Defaults to the stream's position
+        """
+        if priority <= 0:
+            raise ValueError("priority must be positive")
+        with self._lock:
+            if name is None:
+                name = str(len(self._streams))
+            self._streams.append(_ScheduledStream(stream, name, float(priority)))
+
+    def remove_stream(self, stream):
+        """
+        Stops scheduling a stream.  A batch already in progress on it is allowed to finish.
+        :param stream: An AlprStream previously passed to add_stream
+        """
+        with self._lock:
+            for entry in self._streams:
+                if entry.stream is stream:
+                    entry.removed = True
+            self._streams = [entry for entry in self._streams if entry.stream is not stream]
+
+    def _queue_sizes(self):
+        # The queue sizes are read without holding the lock: one native call per stream under it would make
+        # every worker wait for all of them
+        with self._lock:
+            candidates = [entry for entry in self._streams if not entry.busy]
+        return [(entry, entry.stream.get_queue_size()) for entry in candidates]
+
+    def _pick(self, now, sizes):
+        # Caller holds the lock.  sizes comes from _queue_sizes; entries claimed or removed since are skipped.
+        # Returns the entry to process next, or None if nothing has work
+        best = None
+        best_score = None
+        for entry, queued in sizes:
+            if entry.busy or entry.removed:
+                continue
+            if queued == 0:
+                entry.waiting_since = None
+                continue
+            if entry.waiting_since is None:
+                entry.waiting_since = now
+            waited = now - entry.waiting_since
+            capacity = getattr(entry.stream, "frame_queue_size", 0) or queued
+            score = entry.priority * (float(queued) / capacity + waited / self.max_wait)
+            if waited >= self.max_wait:
+                # Starved streams outrank everything else
+                score += 1e9
+            if best_score is None or score > best_score:
+                best, best_score = entry, score
+        if best is not None:
+            best.busy = True
+            waited = now - best.waiting_since
+            best.max_wait = max(best.max_wait, waited)
+            if waited >= self.max_wait:
+                best.starved += 1
+            best.waiting_since = None
+        return best
+
+    def _has_pending_work(self):
+        # Like _queue_sizes, the native calls are made without holding the lock
+        with self._lock:
+            if any(entry.busy for entry in self._streams):
+                return True
+            entries = list(self._streams)
+        return any(entry.stream.get_queue_size() > 0 or entry.stream.video_file_active() for entry in entries)
+
+    def _worker(self, alpr_instance):
+        idle = False
+        while not self._stop.is_set():
+            sizes = self._queue_sizes()
+            all_idle = False
+            with self._lock:
+                entry = self._pick(time.monotonic(), sizes)
+                if entry is None:
+                    if not idle:
+                        idle = True
+                        self._idle_workers += 1
+                    all_idle = self._idle_workers == len(self._threads)
+                elif idle:
+                    idle = False
+                    self._idle_workers -= 1
+            if entry is None:
+                if self._until_idle and all_idle and not self._has_pending_work():
+                    with self._lock:
+                        # Confirmed under the lock: no other worker took a batch while the queues were read
+                        if self._idle_workers == len(self._threads):
+                            self._stop.set()
+                            break
+                self._stop.wait(self.idle_wait)
+                continue
+
+            start = time.monotonic()
+            frames = groups = ()
+            error = None
+            try:
+                frames = entry.stream.process_batch(alpr_instance)
+                groups = entry.stream.pop_completed_groups()
+            except Exception as e:
+                error = e
+            finally:
+                with self._lock:
+                    entry.busy = False
+                    entry.busy_time += time.monotonic() - start
+                    entry.frames += len(frames)
+                    entry.batches += 1
+                    entry.groups += len(groups)
+            if error is not None:
+                self._failed(entry, error)
+            # Each callback runs even if the other raised, so the groups of a batch are not lost with its frames
+            for callback, items in ((self.on_frames, frames), (self.on_groups, groups)):
+                if items and callback is not None:
+                    try:
+                        callback(entry.name, entry.stream, items)
+                    except Exception as e:
+                        self._failed(entry, e)
+
+    def _failed(self, entry, error):
+        # A failing batch or callback must not end the worker: run(until_idle=True) waits for every worker to idle
+        with self._lock:
+            entry.errors += 1
+            entry.last_error = "%s: %s" % (type(error).__name__, error)
+        if self.on_error is not None:
+            try:
+                self.on_error(entry.name, entry.stream, error)
+            except Exception:
+                pass
+
+    def start(self, until_idle=False):
+        """
+        Starts one worker thread per Alpr instance and returns immediately.
+        :param until_idle: Stop on their own once every queue is empty and no video file is active
+        """
+        if self._threads:
+            raise RuntimeError("BatchScheduler is already running")
+        self._stop.clear()
+        self._until_idle = until_idle
+        self._idle_workers = 0
+        self._started_at = time.monotonic()
+        self._threads = [threading.Thread(target=self._worker, args=(alpr_instance,), name="alprstream-worker-%d" % i)
+                         for i, alpr_instance in enumerate(self.alpr_instances)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def join(self, timeout=None):
+        """
+        Waits for the worker threads to exit.
+        :param timeout: Optional limit in seconds
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+        if not any(thread.is_alive() for thread in self._threads):
+            self._threads = []
+
+    def is_running(self):
+        """
+        :return: True while a worker thread is alive
+        """
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        """
+        Asks the workers to exit after their current batch and waits for them.
+        """
+        self._stop.set()
+        self.join()
+
+    def run(self, until_idle=True):
+        """
+        Processes all streams on the calling thread's behalf and blocks until done.
+        :param until_idle: Return once every queue is empty and no video file is active.  Otherwise
+            run until stop() is called from another thread
+        """
+        self.start(until_idle)
+        try:
+            while self.is_running():
+                self.join(0.1)
+        finally:
+            self.stop()
+
+    def stats(self):
+        """
+        Per-stream throughput and starvation since the scheduler was started.
+        :return: A list of StreamStats, one per scheduled stream
+        """
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        with self._lock:
+            now = time.monotonic()
+            return [StreamStats(entry.name, entry.priority, entry.frames, entry.batches, entry.groups,
+                                entry.busy_time,
+                                max(entry.max_wait, now - entry.waiting_since if entry.waiting_since else 0.0),
+                                entry.starved, elapsed, entry.errors, entry.last_error)
+                    for entry in self._streams]
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel processing of long video files, split into time segments.
+
+connect_video_file decodes a file on one background thread, so archive footage is
+processed at most as fast as one core allows.  SegmentedVideoProcessor splits the file
+into segments of segment_seconds, decodes and recognizes each on its own AlprStream in a
+pool of worker processes, and returns one result set ordered by time:
+
+    def make_alpr():
+        return Alpr("us", "", LICENSE_KEY)
+
+    processor = SegmentedVideoProcessor(make_alpr, workers=8, segment_seconds=300)
+    result = processor.process("/archive/gate-1/2017-07-17.mp4", video_start_time=1500249600000)
+    for group in result.groups:
+        ...
+
+Frames are decoded with OpenCV in the workers and pushed with the epoch time of their
+position in the file, so timestamps match those connect_video_file would give.  Frame
+numbers (frame_start, frame_end and frame_number) are positions in the file.  Groups that
+are still active when a segment ends are closed there, and a group that ends within
+stitch_gap_ms of a segment boundary is merged with a group with a similar plate (see
+alprstream_dedup.edit_distance) starting within stitch_gap_ms after it.
+
+alpr_factory is sent to the workers, so it must be picklable (a module level function)
+when the "spawn" start method is used.
+"""
+import json
+import multiprocessing
+import os
+import time
+
+from alprstream import AlprStream
+from alprstream_dedup import canonical_plate, edit_distance
+from alprstream_index import group_epoch_range
+
+# The Alpr factory of the current worker process, set by _init_worker, and the Alpr it created on first use
+_worker_alpr_factory = None
+_worker_alpr = None
+
+
+class VideoSegment(object):
+    """
+    A range of frames of a video file, [start_frame, end_frame).
+    """
+    __slots__ = ("index", "path", "start_frame", "end_frame", "fps", "epoch_start_ms")
+
+    def __init__(self, index, path, start_frame, end_frame, fps, epoch_start_ms):
+        self.index = index
+        self.path = path
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.fps = fps
+        self.epoch_start_ms = epoch_start_ms
+
+    def frame_epoch_ms(self, frame_index):
+        """
+        :return: The epoch ms of a frame of the file
+        """
+        return self.epoch_start_ms + int(round((frame_index - self.start_frame) * 1000.0 / self.fps))
+
+    @property
+    def epoch_end_ms(self):
+        return self.frame_epoch_ms(self.end_frame)
+
+    def __repr__(self):
+        return "VideoSegment(%d, frames %d-%d)" % (self.index, self.start_frame, self.end_frame)
+
+
+class SegmentResult(object):
+    """
+    What one worker returns for a segment.
+    """
+    __slots__ = ("segment", "frames", "groups", "frame_results", "elapsed")
+
+    def __init__(self, segment, frames, groups, frame_results, elapsed):
+        self.segment = segment
+        self.frames = frames
+        self.groups = groups
+        self.frame_results = frame_results
+        self.elapsed = elapsed
+
+
+class SegmentedVideoResult(object):
+    """
+    The combined result of a file.
+    """
+    __slots__ = ("groups", "frame_results", "segments", "frames", "stitched", "elapsed")
+
+    def __init__(self, groups, frame_results, segments, frames, stitched, elapsed):
+        self.groups = groups
+        self.frame_results = frame_results
+        self.segments = segments
+        self.frames = frames
+        self.stitched = stitched
+        self.elapsed = elapsed
+
+    @property
+    def frames_per_second(self):
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return "SegmentedVideoResult(%d groups, %d frames in %d segments, %d stitched, %.1f frames/s)" % \
+               (len(self.groups), self.frames, len(self.segments), self.stitched, self.frames_per_second)
+
+
+def split_video(video_file_path, segment_seconds=300, video_start_time=0):
+    """
+    Splits a video file into segments of equal duration.
+    :param video_file_path: The video file
+    :param segment_seconds: Duration of each segment.  The last one may be shorter
+    :param video_start_time: Epoch ms of the first frame of the file
+    :return: A list of VideoSegment
+    """
+    import cv2
+    capture = cv2.VideoCapture(video_file_path)
+    try:
+        if not capture.isOpened():
+            raise IOError("Cannot open video file %s" % video_file_path)
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+    if frame_count <= 0:
+        raise IOError("Video file %s reports no frames" % video_file_path)
+    segment_frames = max(1, int(round(segment_seconds * fps)))
+    segments = []
+    for index, start_frame in enumerate(range(0, frame_count, segment_frames)):
+        epoch_start_ms = video_start_time + int(round(start_frame * 1000.0 / fps))
+        end_frame = min(frame_count, start_frame + segment_frames)
+        segments.append(VideoSegment(index, video_file_path, start_frame, end_frame, fps, epoch_start_ms))
+    return segments
+
+
+def _init_worker(alpr_factory):
+    # The Alpr is created by the first segment rather than here: an exception raised in a Pool initializer
+    # kills the worker, the pool respawns it, and the caller waits forever
+    global _worker_alpr_factory
+    _worker_alpr_factory = alpr_factory
+
+
+def _get_worker_alpr():
+    global _worker_alpr
+    if _worker_alpr is None:
+        _worker_alpr = _worker_alpr_factory()
+    return _worker_alpr
+
+
+def _seek(capture, frame_index, preroll_frames):
+    # Positions capture so that the next read() returns frame_index.  Seeking with CAP_PROP_POS_FRAMES lands on a
+    # keyframe for many codecs, possibly after the requested frame, so seek preroll_frames early, read the
+    # position back and decode forward from there.  Each time the seek lands late the preroll is doubled.
+    # Returns False if the file ended first
+    import cv2
+    while True:
+        target = max(0, frame_index - preroll_frames)
+        capture.set(cv2.CAP_PROP_POS_FRAMES, target)
+        # The start of the file is a keyframe, so a seek there is exact even where the position cannot be read
+        position = int(capture.get(cv2.CAP_PROP_POS_FRAMES)) if target else 0
+        if 0 <= position <= frame_index:
+            break
+        preroll_frames = max(1, preroll_frames * 2)
+    while position < frame_index:
+        if not capture.grab():
+            return False
+        position += 1
+    return True
+
+
+def _offset_frames(group, offset):
+    for key in ("frame_start", "frame_end"):
+        if key in group:
+            group[key] += offset
+    return group
+
+
+def _process_segment(segment, frame_queue_size, batch_size, library_path, include_frames, preroll_frames):
+    # Runs in a worker process
+    import cv2
+    started = time.monotonic()
+    alpr = _get_worker_alpr()
+    stream = AlprStream(frame_queue_size, False, library_path=library_path)
+    capture = cv2.VideoCapture(segment.path)
+    groups = []
+    frame_results = []
+
+    def run_batch():
+        for frame in stream.process_batch(alpr):
+            if include_frames and frame.results_str and b'"coordinates"' in frame.results_str:
+                results = frame.results
+                results["frame_number"] = segment.start_frame + frame.frame_number
+                frame_results.append(results)
+        raw_groups = stream.pop_completed_groups_raw()
+        if raw_groups and raw_groups != b"[]":
+            groups.extend(json.loads(raw_groups.decode("UTF-8")))
+
+    frames = 0
+    try:
+        end_frame = segment.end_frame
+        if segment.start_frame and not _seek(capture, segment.start_frame, preroll_frames):
+            end_frame = segment.start_frame
+        for frame_index in range(segment.start_frame, end_frame):
+            ok, image = capture.read()
+            if not ok:
+                break
+            height, width = image.shape[:2]
+            stream.push_frame(image, image.shape[2] if image.ndim == 3 else 1, width, height,
+                              segment.frame_epoch_ms(frame_index))
+            frames += 1
+            if stream.get_queue_size() >= batch_size:
+                run_batch()
+        while stream.get_queue_size() > 0:
+            run_batch()
+        run_batch()
+        # Groups still open at the end of the segment are closed here and stitched by the parent
+        active = stream.peek_active_groups()
+        if active:
+            groups.extend(json.loads(active.decode("UTF-8")))
+    finally:
+        capture.release()
+        stream.close()
+    for group in groups:
+        _offset_frames(group, segment.start_frame)
+    return SegmentResult(segment, frames, groups, frame_results, time.monotonic() - started)
+
+
+def _set_epoch_range(group, epoch_start, epoch_end):
+    for start_key, end_key in (("epoch_start", "epoch_end"), ("epoch_ms_time_start", "epoch_ms_time_end")):
+        if start_key in group or end_key in group:
+            group[start_key] = epoch_start
+            group[end_key] = epoch_end
+
+
+def merge_groups(first, second):
+    """
+    Combines two groups of the same vehicle.  The plate and the other best_* fields come from the
+    group with the higher best_confidence.
+    :return: A new group dict covering both time ranges
+    """
+    best = first if first.get("best_confidence", 0.0) >= second.get("best_confidence", 0.0) else second
+    merged = dict(best)
+    first_start, first_end = group_epoch_range(first)
+    second_start, second_end = group_epoch_range(second)
+    _set_epoch_range(merged, min(first_start, second_start), max(first_end, second_end))
+    if "frame_start" in first and "frame_start" in second:
+        merged["frame_start"] = min(first["frame_start"], second["frame_start"])
+        merged["frame_end"] = max(first["frame_end"], second["frame_end"])
+    return merged
+
+
+class SegmentedVideoProcessor(object):
+    def __init__(self, alpr_factory, workers=None, segment_seconds=300, frame_queue_size=15, batch_size=10,
+                 library_path=None, stitch_gap_ms=2000, max_distance=1, include_frames=False, context=None,
+                 seek_preroll_seconds=2.0):
+        """
+        :param alpr_factory: Callable returning a new Alpr instance, called once in each worker
+        :param workers: Number of worker processes.  Defaults to the number of CPUs
+        :param segment_seconds: Duration of each segment.  Several segments per worker balance the load best
+        :param frame_queue_size: The frame_queue_size of each segment's AlprStream
+        :param batch_size: Number of queued frames that triggers process_batch
+        :param library_path: Optional path to libalprstream for the workers
+        :param stitch_gap_ms: Largest gap across a segment boundary between two groups that are merged
+        :param max_distance: Largest edit distance between the plates of merged groups, after canonicalisation
+        :param include_frames: Also return the results of every frame with plates, as parsed dicts
+        :param context: Optional multiprocessing context, e.g. multiprocessing.get_context("spawn")
+        :param seek_preroll_seconds: How far before its first frame a segment seeks and then decodes forward.
+            Seeks land on keyframes for many codecs, so about the file's keyframe interval avoids re-seeking
+        """
+        self.alpr_factory = alpr_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.segment_seconds = segment_seconds
+        self.frame_queue_size = frame_queue_size
+        self.batch_size = min(batch_size, frame_queue_size)
+        self.library_path = library_path
+        self.stitch_gap_ms = stitch_gap_ms
+        self.max_distance = max_distance
+        self.include_frames = include_frames
+        self.seek_preroll_seconds = seek_preroll_seconds
+        self._context = context or multiprocessing.get_context()
+
+    def _similar(self, first, second):
+        plate = canonical_plate(first.get("best_plate_number") or "")
+        other = canonical_plate(second.get("best_plate_number") or "")
+        return bool(plate) and edit_distance(plate, other, self.max_distance) <= self.max_distance
+
+    def stitch(self, results):
+        """
+        Merges groups split by segment boundaries.
+        :param results: SegmentResult for consecutive segments, in order
+        :return: (groups ordered by start time, number of merges)
+        """
+        stitched = 0
+        previous = []
+        output = []
+        for result in sorted(results, key=lambda item: item.segment.index):
+            boundary = result.segment.epoch_start_ms
+            current = sorted(result.groups, key=group_epoch_range)
+            tails = [group for group in previous if group_epoch_range(group)[1] >= boundary - self.stitch_gap_ms]
+            for index, group in enumerate(current):
+                start = group_epoch_range(group)[0]
+                if start > boundary + self.stitch_gap_ms:
+                    break
+                candidates = [tail for tail in tails if start - group_epoch_range(tail)[1] <= self.stitch_gap_ms and
+                              self._similar(tail, group)]
+                if not candidates:
+                    continue
+                tail = max(candidates, key=lambda item: group_epoch_range(item)[1])
+                tails.remove(tail)
+                previous.remove(tail)
+                current[index] = merge_groups(tail, group)
+                stitched += 1
+            output.extend(previous)
+            previous = current
+        output.extend(previous)
+        output.sort(key=group_epoch_range)
+        return output, stitched
+
+    def process(self, video_file_path, video_start_time=0):
+        """
+        Processes a whole file on the worker pool.
+        :param video_file_path: The video file
+        :param video_start_time: Epoch ms of the first frame of the file
+        :return: A SegmentedVideoResult
+        """
+        started = time.monotonic()
+        segments = split_video(video_file_path, self.segment_seconds, video_start_time)
+        pool = self._context.Pool(min(self.workers, len(segments)), initializer=_init_worker,
+                                  initargs=(self.alpr_factory,))
+        try:
+            pending = [pool.apply_async(_process_segment, (segment, self.frame_queue_size, self.batch_size,
+                                                           self.library_path, self.include_frames,
+                                                           int(round(self.seek_preroll_seconds * segment.fps))))
+                       for segment in segments]
+            results = [item.get() for item in pending]
+        except BaseException:
+            # Segments still queued would only fail the same way
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        groups, stitched = self.stitch(results)
+        frame_results = []
+        if self.include_frames:
+            for result in results:
+                frame_results.extend(result.frame_results)
+            frame_results.sort(key=lambda item: item.get("epoch_time", 0))
+        return SegmentedVideoResult(groups, frame_results, segments, sum(result.frames for result in results),
+                                    stitched, time.monotonic() - started)
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Durable, batched persistence of completed groups and frame results.
+
+The recognition loop hands records to a ResultSink, which only appends them to an
+in-memory queue.  A background thread writes them out in batches, one transaction (or
+one appended, fsynced block) per batch, whenever max_batch records are waiting or the
+oldest one has waited max_delay seconds:
+
+    sink = ResultSink(SQLiteWriter("/var/lib/alpr/results.db"), blob_store=DirectoryBlobStore("/var/lib/alpr/jpeg"))
+    scheduler = BatchScheduler(alprs,
+                               on_frames=lambda name, stream, frames: sink.write_frames(frames, name),
+                               on_groups=lambda name, stream, groups: sink.write_groups(groups, name))
+    ...
+    sink.close()
+
+Writers: SQLiteWriter (WAL mode) and SegmentLogWriter (append-only segment files).
+JPEG images of frame results are stored inline by default.  With a blob_store they are
+written there instead and only the returned reference is recorded.
+"""
+import collections
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from alprstream_index import group_epoch_range
+
+GROUP = 0
+FRAME = 1
+
+# Upper bound, in seconds, of the backoff between retries of a failed batch
+_MAX_RETRY_DELAY = 2.0
+
+
+def _is_transient(error):
+    # Errors expected to clear on their own, such as SQLite's database is locked / busy from another connection
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return "locked" in message or "busy" in message
+    return isinstance(error, (InterruptedError, BlockingIOError))
+
+
+class SinkRecord(object):
+    """
+    One group or frame result waiting to be written.
+    """
+    __slots__ = ("kind", "camera", "epoch_ms", "key", "payload", "jpeg", "jpeg_ref")
+
+    def __init__(self, kind, camera, epoch_ms, key, payload, jpeg=None):
+        self.kind = kind
+        self.camera = camera
+        self.epoch_ms = epoch_ms
+        self.key = key
+        self.payload = payload
+        self.jpeg = jpeg
+        self.jpeg_ref = None
+
+
+class DirectoryBlobStore(object):
+    """
+    Writes every blob to its own file in a directory.
+    """
+
+    def __init__(self, directory, extension=".jpg"):
+        self.directory = directory
+        self.extension = extension
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def put(self, data, key):
+        """
+        :param data: The blob bytes
+        :param key: A unique name for the blob
+        :return: The reference recorded in place of the blob
+        """
+        name = key + self.extension
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(data)
+        return name
+
+    def get(self, reference):
+        with open(os.path.join(self.directory, reference), "rb") as f:
+            return f.read()
+
+    def sync(self):
+        pass
+
+
+class SQLiteWriter(object):
+    """
+    Writes batches into a SQLite database in WAL mode, one transaction per batch.
+    """
+
+    def __init__(self, path, synchronous="NORMAL"):
+        """
+        :param path: The database file
+        :param synchronous: SQLite synchronous setting.  NORMAL is durable across application crashes in WAL mode;
+            FULL also survives power loss
+        """
+        self.path = path
+        self.synchronous = synchronous
+        self._connection = None
+
+    def open(self):
+        # Opened by the caller of ResultSink() so errors surface there, then only used by the sink thread
+        self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=%s" % self.synchronous)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS groups (uuid TEXT, camera TEXT, plate TEXT, "
+                                 "epoch_start INTEGER, epoch_end INTEGER, json TEXT)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS frames (camera TEXT, frame_number INTEGER, "
+                                 "epoch_ms INTEGER, results TEXT, jpeg BLOB, jpeg_ref TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS groups_plate ON groups (plate, epoch_start)")
+
+    def write(self, records):
+        groups = []
+        frames = []
+        for record in records:
+            if record.kind == GROUP:
+                group = record.payload
+                epoch_start, epoch_end = group_epoch_range(group)
+                groups.append((group.get("best_uuid"), record.camera, group.get("best_plate_number"),
+                               epoch_start, epoch_end, json.dumps(group)))
+            else:
+                results = record.payload.decode("utf-8") if record.payload else None
+                frames.append((record.camera, record.key, record.epoch_ms, results, record.jpeg, record.jpeg_ref))
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN")
+        try:
+            if groups:
+                cursor.executemany("INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)", groups)
+            if frames:
+                cursor.executemany("INSERT INTO frames VALUES (?, ?, ?, ?, ?, ?)", frames)
+            cursor.execute("COMMIT")
+        except BaseException:
+            # Includes a failed COMMIT (e.g. database is locked), which leaves the transaction open.  Without the
+            # rollback the retry's BEGIN would fail with "cannot start a transaction within a transaction"
+            if self._connection.in_transaction:
+                self._connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# kind, epoch ms, header JSON length, JPEG length
+_LOG_RECORD = struct.Struct("<BqII")
+
+
+class SegmentLogWriter(object):
+    """
+    Appends batches to numbered segment files, each batch with a single write and fsync.
+    Every record is a fixed header followed by a JSON document and the optional inline JPEG;
+    read them back with read_segment_log().
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync=True):
+        """
+        :param directory: Directory holding the segment files
+        :param segment_bytes: A new segment is started once the current one reaches this size
+        :param fsync: fsync after every batch.  Without it a batch is only handed to the OS
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._file = None
+        self._segment = 0
+
+    def open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        segments = [name for name in os.listdir(self.directory) if name.endswith(".log")]
+        self._segment = max([int(name[:-4]) for name in segments] or [0])
+        self._open_segment(self._segment or 1)
+
+    def _open_segment(self, number):
+        if self._file is not None:
+            self._file.close()
+        self._segment = number
+        self._file = open(os.path.join(self.directory, "%08d.log" % number), "ab")
+
+    def write(self, records):
+        chunks = []
+        for record in records:
+            if record.kind == GROUP:
+                document = {"camera": record.camera, "group": record.payload}
+            else:
+                document = {"camera": record.camera, "frame_number": record.key, "jpeg_ref": record.jpeg_ref,
+                            "results": record.payload.decode("utf-8") if record.payload else None}
+            header = json.dumps(document, separators=(",", ":")).encode("utf-8")
+            jpeg = record.jpeg or b""
+            chunks.append(_LOG_RECORD.pack(record.kind, record.epoch_ms, len(header), len(jpeg)))
+            chunks.append(header)
+            if jpeg:
+                chunks.append(jpeg)
+        self._file.write(b"".join(chunks))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        if self._file.tell() >= self.segment_bytes:
+            self._open_segment(self._segment + 1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_segment_log(directory):
+    """
+    Reads back everything written by a SegmentLogWriter, oldest segment first.
+    A truncated record at the end of a segment (from a crash mid-write) is skipped.
+    :return: An iterator of (kind, epoch_ms, document, jpeg) with kind GROUP or FRAME
+    """
+    for name in sorted(name for name in os.listdir(directory) if name.endswith(".log")):
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _LOG_RECORD.size <= len(data):
+            kind, epoch_ms, header_length, jpeg_length = _LOG_RECORD.unpack_from(data, offset)
+            offset += _LOG_RECORD.size
+            if offset + header_length + jpeg_length > len(data):
+                break
+            document = json.loads(data[offset:offset + header_length].decode("utf-8"))
+            offset += header_length
+            jpeg = data[offset:offset + jpeg_length] if jpeg_length else None
+            offset += jpeg_length
+            yield kind, epoch_ms, document, jpeg
+
+
+class ResultSink(object):
+    def __init__(self, writer, max_batch=1000, max_delay=0.5, max_pending=100000, blob_store=None,
+                 store_jpeg=True, max_retries=5, retry_delay=0.05):
+        """
+        Starts the background writer thread.
+        :param writer: A SQLiteWriter, SegmentLogWriter or any object with open(), write(records) and close()
+        :param max_batch: Records written per batch at most.  A full batch is written immediately
+        :param max_delay: Seconds a record may wait before a partial batch is written
+        :param max_pending: Records that may be queued before write_groups/write_frames start to block
+        :param blob_store: Optional store with put(data, key) and sync() receiving the JPEG images instead of the
+            writer, such as DirectoryBlobStore or alprstream_blobstore.MmapBlobStore
+        :param store_jpeg: Whether frame JPEG images are persisted at all
+        :param max_retries: Times a batch is retried after a transient error (e.g. a locked database) before the
+            error is raised to the caller
+        :param retry_delay: Seconds before the first retry.  Doubled on each further retry
+        """
+        self.writer = writer
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.blob_store = blob_store
+        self.store_jpeg = store_jpeg
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._written = 0
+        self._batches = 0
+        self._write_time = 0.0
+        self._in_flight = 0
+        self._flushing = 0
+        self._retries = 0
+        self._failures = 0
+
+        self.writer.open()
+        self._thread = threading.Thread(target=self._run, name="alprstream-sink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _enqueue(self, records):
+        if not records:
+            return
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("ResultSink is closed")
+                # The writer thread waits for a pending error to be raised, so do not wait for room behind it
+                if self._error is not None or len(self._pending) < self.max_pending:
+                    break
+                self._condition.wait()
+            self._pending.extend(records)
+            if self._error is not None:
+                # The records are queued first, so they are written with the rest once the error has been raised
+                raise self._take_error()
+            if len(self._pending) >= self.max_batch or len(self._pending) == len(records):
+                self._condition.notify_all()
+
+    def write_groups(self, groups, camera=None):
+        """
+        Queues completed groups, as returned by pop_completed_groups.
+        :param camera: Camera name recorded with them.  Defaults to each group's "camera" field
+        """
+        self._enqueue([SinkRecord(GROUP, camera if camera is not None else group.get("camera"),
+                                  group_epoch_range(group)[0], group.get("best_uuid"), group, None)
+                       for group in groups])
+
+    def write_frames(self, frames, camera=None):
+        """
+        Queues frame results, as returned by process_batch.  The raw results JSON is stored without being parsed.
+        :param camera: Camera name recorded with them
+        """
+        records = []
+        for frame in frames:
+            record = SinkRecord(FRAME, camera, frame.frame_epoch_time_ms, frame.frame_number, frame.results_str,
+                                frame.jpeg_bytes if self.store_jpeg else None)
+            if self.store_jpeg and getattr(frame, "jpeg_handle", None) is not None:
+                # Already stored by the stream's jpeg store, see AlprStream.set_jpeg_store
+                record.jpeg_ref = str(frame.jpeg_handle)
+            records.append(record)
+        self._enqueue(records)
+
+    def _take_batch(self):
+        # Waits for a full batch, the max_delay deadline of the oldest record, or close()
+        with self._condition:
+            deadline = None
+            while True:
+                if len(self._pending) >= self.max_batch or (self._pending and (self._closed or self._flushing)):
+                    break
+                if self._closed:
+                    return None
+                if self._pending:
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.max_delay
+                    if now >= deadline:
+                        break
+                    self._condition.wait(deadline - now)
+                else:
+                    deadline = None
+                    self._condition.wait()
+            count = min(len(self._pending), self.max_batch)
+            batch = [self._pending.popleft() for _ in range(count)]
+            self._in_flight = count
+            self._condition.notify_all()
+            return batch
+
+    def _take_error(self):
+        # Caller holds the condition.  Clears the error, which lets the writer thread retry the queued records
+        error = self._error
+        self._error = None
+        self._condition.notify_all()
+        return error
+
+    def _write_batch(self, batch):
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                if self.blob_store is not None:
+                    for record in batch:
+                        if record.jpeg:
+                            key = "%s-%d-%d" % (record.camera, record.epoch_ms, record.key)
+                            record.jpeg_ref = str(self.blob_store.put(record.jpeg, key))
+                            record.jpeg = None
+                    self.blob_store.sync()
+                self.writer.write(batch)
+                return
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    raise
+            attempt += 1
+            with self._condition:
+                self._retries += 1
+            time.sleep(delay)
+            delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    break
+                start = time.monotonic()
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    with self._condition:
+                        # The batch goes back to the front of the queue.  Writing resumes once the error has been
+                        # raised to a caller, or the records were taken with drain()
+                        self._pending.extendleft(reversed(batch))
+                        self._in_flight = 0
+                        self._failures += 1
+                        self._error = e
+                        self._condition.notify_all()
+                        while self._error is not None and not self._closed:
+                            self._condition.wait()
+                        if self._error is not None:
+                            break
+                    continue
+                with self._condition:
+                    self._written += len(batch)
+                    self._batches += 1
+                    self._write_time += time.monotonic() - start
+                    self._in_flight = 0
+                    self._condition.notify_all()
+        finally:
+            self.writer.close()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything queued so far has been written.
+        :param timeout: Maximum seconds to wait
+        :return: True if the queue was drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            target = self._written + len(self._pending) + self._in_flight
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._written < target and self._error is None and self._thread.is_alive():
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flushing -= 1
+            if self._error is not None:
+                # The unwritten records stay queued: call flush again to retry them, or drain() to take them
+                raise self._take_error()
+            return self._written >= target
+
+    def drain(self):
+        """
+        Removes the records that were not written, e.g. to save them elsewhere after the writer failed, and
+        clears the error.  Also usable after close().
+        :return: A list of SinkRecord, oldest first
+        """
+        with self._condition:
+            records = list(self._pending)
+            self._pending.clear()
+            self._error = None
+            self._condition.notify_all()
+            return records
+
+    def close(self):
+        """
+        Writes everything still queued, then stops the writer thread and closes the writer.
+        If a batch could not be written, raises its error; drain() then returns the records left unwritten.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._condition:
+            if self._error is not None:
+                raise self._take_error()
+
+    def stats(self):
+        """
+        :return: A dict with records written, batches, queued records, retries after transient errors, batches that
+            failed and rows per second of write time
+        """
+        with self._condition:
+            return {"written": self._written, "batches": self._batches, "pending": len(self._pending),
+                    "retries": self._retries, "failed_batches": self._failures,
+                    "rows_per_second": self._written / self._write_time if self._write_time > 0 else 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Canonical-size normalization of raw frames in front of AlprStream.push_frame.
+
+The recognition library caches its working memory per image size, so a process fed by
+cameras of many different resolutions keeps reallocating and runs with cold caches.
+CanonicalSizes is a small set of sizes shared by all streams of a process, and
+CanonicalSizeStream puts every frame into one of them before pushing it:
+
+    sizes = CanonicalSizes([(1920, 1080), (1280, 720), (640, 480)])
+    for camera, stream in streams.items():
+        wrapped[camera] = CanonicalSizeStream(stream, sizes)
+    ...
+    wrapped["gate-1"].push_frame(img, 3, 1296, 972, epoch_ms)   # pushed as 1920x1080
+    print(sizes.stats())
+
+A frame is padded into the smallest canonical size that holds it, placed at the top left
+with the rest black.  A frame larger than every canonical size is downscaled, keeping its
+aspect ratio, into the largest one (this needs OpenCV).  Both go into a buffer preallocated
+per canonical size and reused for every frame.  The plate coordinates of the results and
+groups are mapped back to the frame's own pixels.  Requires NumPy.
+"""
+import collections
+import json
+import threading
+import time
+
+import numpy
+
+# Transforms remembered per stream for mapping results back, keyed by frame epoch time
+_MAX_TRANSFORMS = 4096
+
+
+class SizeTransform(object):
+    """
+    How one source size is placed in a canonical size.
+    """
+    __slots__ = ("source_width", "source_height", "width", "height", "scale", "scaled_width", "scaled_height")
+
+    def __init__(self, source_width, source_height, width, height, scale):
+        self.source_width = source_width
+        self.source_height = source_height
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.scaled_width = min(width, int(round(source_width * scale)))
+        self.scaled_height = min(height, int(round(source_height * scale)))
+
+    def _remap_coordinates(self, coordinates):
+        if not coordinates:
+            return
+        scale = self.scale
+        for point in coordinates:
+            point["x"] = min(self.source_width - 1, int(round(point["x"] / scale)))
+            point["y"] = min(self.source_height - 1, int(round(point["y"] / scale)))
+
+    def remap_results(self, results):
+        """
+        Maps the plate coordinates of a frame's results dict to the source frame, in place.
+        :return: results
+        """
+        for plate in results.get("results") or ():
+            self._remap_coordinates(plate.get("coordinates"))
+        results["img_width"] = self.source_width
+        results["img_height"] = self.source_height
+        return results
+
+    def remap_group(self, group):
+        """
+        Maps the plate coordinates of a group dict to the source frame, in place.
+        :return: group
+        """
+        best_plate = group.get("best_plate")
+        if best_plate:
+            self._remap_coordinates(best_plate.get("coordinates"))
+        return group
+
+    def __repr__(self):
+        return "SizeTransform(%dx%d -> %dx%d, scale %.3f)" % (self.source_width, self.source_height, self.width,
+                                                               self.height, self.scale)
+
+
+class CanonicalSizes(object):
+    def __init__(self, sizes):
+        """
+        :param sizes: The canonical (width, height) sizes.  Share one instance between all streams of a process
+        """
+        if not sizes:
+            raise ValueError("At least one canonical size is required")
+        # Smallest area first, so the first size that fits is the tightest
+        self.sizes = sorted(set((int(width), int(height)) for width, height in sizes),
+                            key=lambda size: (size[0] * size[1], size))
+        self._lock = threading.Lock()
+        self._transforms = {}
+        self._source_sizes = collections.Counter()
+        self._native_sizes = collections.Counter()
+
+    def transform(self, imgWidth, imgHeight):
+        """
+        :return: The SizeTransform for frames of this size
+        """
+        key = (imgWidth, imgHeight)
+        transform = self._transforms.get(key)
+        if transform is None:
+            for width, height in self.sizes:
+                if imgWidth <= width and imgHeight <= height:
+                    transform = SizeTransform(imgWidth, imgHeight, width, height, 1.0)
+                    break
+            else:
+                width, height = max(self.sizes, key=lambda size: size[0] * size[1])
+                scale = min(width / float(imgWidth), height / float(imgHeight))
+                transform = SizeTransform(imgWidth, imgHeight, width, height, scale)
+            with self._lock:
+                self._transforms.setdefault(key, transform)
+        return transform
+
+    def record(self, source, native):
+        """
+        Counts one frame for stats().  Called by CanonicalSizeStream for every frame it pushes.
+        :param source: The frame's (width, height)
+        :param native: The (width, height) it was pushed at
+        """
+        with self._lock:
+            self._source_sizes[source] += 1
+            self._native_sizes[native] += 1
+
+    def stats(self):
+        """
+        :return: A dict with the number of distinct source sizes and of distinct sizes pushed to the library,
+            and the frame count for each
+        """
+        with self._lock:
+            return {"source_sizes": len(self._source_sizes), "native_sizes": len(self._native_sizes),
+                    "frames_by_source_size": dict(self._source_sizes),
+                    "frames_by_native_size": dict(self._native_sizes)}
+
+
+class CanonicalSizeStream(object):
+    def __init__(self, stream, sizes, interpolation=None):
+        """
+        Wraps a stream so that every frame is pushed at one of the canonical sizes.
+        :param stream: The AlprStream to push to
+        :param sizes: A CanonicalSizes, or a list of (width, height) to create one for this stream alone
+        :param interpolation: OpenCV interpolation flag used for downscaling.  Defaults to cv2.INTER_LINEAR,
+            which is several times faster than cv2.INTER_AREA at non-integer scales
+        """
+        self.stream = stream
+        self.interpolation = interpolation
+        self.sizes = sizes if isinstance(sizes, CanonicalSizes) else CanonicalSizes(sizes)
+        self._buffers = {}      # (width, height, bytes per pixel) -> [bytearray, last (width, height) written]
+        self._transforms = collections.OrderedDict()
+        self._last_transform = None
+        self._source_sizes = set()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _buffer(self, transform, bytesPerPixel):
+        key = (transform.width, transform.height, bytesPerPixel)
+        entry = self._buffers.get(key)
+        if entry is None:
+            entry = self._buffers[key] = [bytearray(transform.width * transform.height * bytesPerPixel), None]
+        buffer = entry[0]
+        extent = (transform.scaled_width, transform.scaled_height)
+        if entry[1] is not None and entry[1] != extent:
+            # A differently sized frame was written before; clear its pixels from the padding
+            numpy.frombuffer(buffer, dtype=numpy.uint8).fill(0)
+        entry[1] = extent
+        return buffer
+
+    def push_frame(self, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time=-1):
+        """
+        Pushes a raw frame at its canonical size.  Takes the same arguments as AlprStream.push_frame.
+        :return: The video input buffer size after adding this image
+        """
+        if frame_epoch_time < 0:
+            # Stamped here rather than by the library, so results can be matched to their transform
+            frame_epoch_time = int(time.time() * 1000)
+        transform = self.sizes.transform(imgWidth, imgHeight)
+        self._remember(frame_epoch_time, transform)
+        self.sizes.record((imgWidth, imgHeight), (transform.width, transform.height))
+        if transform.width == imgWidth and transform.height == imgHeight:
+            return self.stream.push_frame(pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time)
+
+        buffer = self._buffer(transform, bytesPerPixel)
+        source = numpy.frombuffer(pixelData, dtype=numpy.uint8, count=imgWidth * imgHeight * bytesPerPixel)
+        source = source.reshape(imgHeight, imgWidth, bytesPerPixel)
+        target = numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(transform.height, transform.width, bytesPerPixel)
+        if transform.scale == 1.0:
+            target[:imgHeight, :imgWidth] = source
+        else:
+            import cv2
+            scaled = target[:transform.scaled_height, :transform.scaled_width]
+            if bytesPerPixel == 1:
+                source, scaled = source[:, :, 0], scaled[:, :, 0]
+            cv2.resize(source, (transform.scaled_width, transform.scaled_height), dst=scaled,
+                       interpolation=cv2.INTER_LINEAR if self.interpolation is None else self.interpolation)
+        # The library copies the frame during push_frame, so the buffer is reused for the next one
+        return self.stream.push_frame(buffer, bytesPerPixel, transform.width, transform.height, frame_epoch_time)
+
+    def _remember(self, frame_epoch_time, transform):
+        self._last_transform = transform
+        self._source_sizes.add((transform.source_width, transform.source_height))
+        transforms = self._transforms
+        transforms[frame_epoch_time] = transform
+        if len(transforms) > _MAX_TRANSFORMS:
+            transforms.popitem(last=False)
+
+    def _transform_for(self, epoch_ms):
+        # A time with no recorded transform (evicted, or not the time of a pushed frame) can only be mapped safely
+        # while every frame pushed so far had the same size.  Otherwise None: the coordinates are left as they are
+        transform = self._transforms.get(epoch_ms)
+        if transform is None and len(self._source_sizes) == 1:
+            transform = self._last_transform
+        return transform
+
+    def _remap_groups(self, groups):
+        for group in groups:
+            best_plate = group.get("best_plate") or {}
+            transform = self._transform_for(best_plate.get("epoch_time", group.get("epoch_start")))
+            if transform is not None:
+                transform.remap_group(group)
+        return groups
+
+    def remap_frame(self, frame):
+        """
+        Maps a recognized frame's plate coordinates to its source frame, updating results and results_str.
+        Frames pushed at their own size are left as they are.
+        :return: frame
+        """
+        transform = self._transform_for(frame.frame_epoch_time_ms)
+        if transform is None or (transform.width == transform.source_width and
+                                 transform.height == transform.source_height):
+            return frame
+        if frame.results_str:
+            frame.results_str = json.dumps(transform.remap_results(frame.results)).encode("utf-8")
+        return frame
+
+    def process_frame(self, alpr_instance):
+        """
+        Same as AlprStream.process_frame, with coordinates in the source frame's pixels.
+        """
+        frame = self.stream.process_frame(alpr_instance)
+        return self.remap_frame(frame) if frame is not None else None
+
+    def process_batch(self, alpr_instance):
+        """
+        Same as AlprStream.process_batch, with coordinates in the source frame's pixels.
+        """
+        return [self.remap_frame(frame) for frame in self.stream.process_batch(alpr_instance)]
+
+    def pop_completed_groups(self):
+        """
+        Same as AlprStream.pop_completed_groups, with coordinates in the source frame's pixels.
+        """
+        return self._remap_groups(self.stream.pop_completed_groups())
+
+    def pop_completed_groups_raw(self):
+        """
+        Same as AlprStream.pop_completed_groups_raw, with coordinates in the source frame's pixels.  The JSON is
+        only decoded and encoded again when a frame was pushed at a size other than its own.
+        """
+        raw = self.stream.pop_completed_groups_raw()
+        if not raw or raw == b"[]" or all(size in self.sizes.sizes for size in self._source_sizes):
+            return raw
+        return json.dumps(self._remap_groups(json.loads(raw.decode("utf-8")))).encode("utf-8")
+
+    def wait_for_completed_groups(self, timeout=None):
+        """
+        Same as AlprStream.wait_for_completed_groups, with coordinates in the source frame's pixels.
+        """
+        return self._remap_groups(self.stream.wait_for_completed_groups(timeout))
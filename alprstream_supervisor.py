@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Supervision of a fleet of camera streams connected with connect_video_stream_url.
+
+connect_video_stream_url starts the library's reader thread and returns; a camera that
+never answers, or an RTSP session that silently stops delivering frames, is not reported.
+StreamSupervisor owns one AlprStream per camera, connects them a few at a time, watches
+each for progress and reconnects the ones that stall:
+
+    supervisor = StreamSupervisor.from_config("cameras.json")
+    supervisor.start()
+    while running:
+        for camera in supervisor.cameras():
+            for frame in camera.process_batch(alpr):
+                ...
+    supervisor.stop()
+
+The config file is JSON.  "cameras" is required; "supervisor" holds keyword arguments of
+StreamSupervisor and "defaults" values applied to every camera:
+
+    {"supervisor": {"max_concurrent_connects": 4, "stall_timeout": 10},
+     "defaults": {"frame_queue_size": 30, "use_motion_detection": true},
+     "cameras": [{"name": "gate-1", "url": "rtsp://10.0.0.11/stream1"},
+                 {"name": "gate-2", "url": "rtsp://10.0.0.12/stream1", "frame_queue_size": 10}]}
+
+A stream is making progress while its queue depth grows or the epoch time of the frames
+processed through SupervisedStream moves forward.  A connect attempt holds one of
+max_concurrent_connects slots until its first frame arrives or connect_timeout passes.  A
+stream without progress for stall_timeout, whose queue is not full, is reconnected after
+an exponential backoff with random jitter, so cameras behind the same failed switch do
+not all reconnect at the same moment.
+"""
+import json
+import random
+import threading
+import time
+
+STOPPED = "stopped"
+WAITING = "waiting"
+CONNECTING = "connecting"
+STREAMING = "streaming"
+BACKOFF = "backoff"
+
+
+class CameraConfig(object):
+    """
+    One camera of a supervisor config.
+    """
+    __slots__ = ("name", "url", "gstreamer_pipeline_format", "frame_queue_size", "use_motion_detection")
+
+    def __init__(self, name, url, gstreamer_pipeline_format="", frame_queue_size=30, use_motion_detection=True):
+        self.name = name
+        self.url = url
+        self.gstreamer_pipeline_format = gstreamer_pipeline_format
+        self.frame_queue_size = frame_queue_size
+        self.use_motion_detection = use_motion_detection
+
+    def __repr__(self):
+        return "CameraConfig(%r, %r)" % (self.name, self.url)
+
+
+def load_config(path):
+    """
+    Reads a supervisor config file.
+    :param path: A JSON file as described in the module documentation
+    :return: (list of CameraConfig, dict of StreamSupervisor keyword arguments)
+    """
+    with open(path) as config_file:
+        config = json.load(config_file)
+    defaults = config.get("defaults") or {}
+    cameras = []
+    names = set()
+    for index, entry in enumerate(config.get("cameras") or ()):
+        if "url" not in entry:
+            raise ValueError("Camera %d of %s has no url" % (index, path))
+        settings = dict(defaults)
+        settings.update(entry)
+        settings.setdefault("name", "camera-%d" % index)
+        if settings["name"] in names:
+            raise ValueError("Duplicate camera name %r in %s" % (settings["name"], path))
+        names.add(settings["name"])
+        cameras.append(CameraConfig(**settings))
+    if not cameras:
+        raise ValueError("No cameras configured in %s" % path)
+    return cameras, dict(config.get("supervisor") or {})
+
+
+class Backoff(object):
+    def __init__(self, initial=1.0, maximum=60.0, multiplier=2.0, jitter=0.5, rng=None):
+        """
+        Exponential backoff with random jitter.
+        :param initial: Delay before the first retry, in seconds
+        :param maximum: Largest delay
+        :param multiplier: Growth of the delay after each failure
+        :param jitter: Fraction of each delay that is random; 0.5 gives delays between half and all of the
+            exponential delay
+        :param rng: Optional random.Random
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.failures = 0
+        self._random = rng or random.Random()
+
+    def next_delay(self):
+        """
+        Counts a failure.
+        :return: Seconds to wait before the next attempt
+        """
+        delay = min(self.maximum, self.initial * self.multiplier ** self.failures)
+        self.failures += 1
+        return delay * (1.0 - self.jitter * self._random.random())
+
+    def reset(self):
+        self.failures = 0
+
+
+class SupervisedStream(object):
+    def __init__(self, config, stream, backoff):
+        """
+        A camera's AlprStream and its connection state.  Other attributes are delegated to the AlprStream.
+        Frames processed with process_frame and process_batch here also count as progress.
+        """
+        self.config = config
+        self.stream = stream
+        self.backoff = backoff
+        self.state = STOPPED
+        self.connects = 0
+        self.failed_connects = 0
+        self.stalls = 0
+        self.last_error = None
+        self.next_attempt = None
+        self.state_since = None
+        self.last_progress = None
+        self.last_queue_size = 0
+        self.last_frame_epoch = None
+        self._seen_frame_epoch = None
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @property
+    def name(self):
+        return self.config.name
+
+    def _note_frames(self, frames):
+        newest = max(frame.frame_epoch_time_ms for frame in frames)
+        if self._seen_frame_epoch is None or newest > self._seen_frame_epoch:
+            self._seen_frame_epoch = newest
+
+    def process_frame(self, alpr_instance):
+        """
+        Same as AlprStream.process_frame.
+        """
+        frame = self.stream.process_frame(alpr_instance)
+        if frame is not None:
+            self._note_frames((frame,))
+        return frame
+
+    def process_batch(self, alpr_instance):
+        """
+        Same as AlprStream.process_batch.
+        """
+        frames = self.stream.process_batch(alpr_instance)
+        if frames:
+            self._note_frames(frames)
+        return frames
+
+    def status(self):
+        """
+        :return: A dict describing the connection
+        """
+        return {"name": self.name, "state": self.state, "connects": self.connects,
+                "failed_connects": self.failed_connects, "stalls": self.stalls,
+                "queue_size": self.last_queue_size, "last_frame_epoch": self.last_frame_epoch,
+                "last_error": self.last_error}
+
+    def __repr__(self):
+        return "SupervisedStream(%r, %s)" % (self.name, self.state)
+
+
+class StreamSupervisor(object):
+    def __init__(self, cameras, max_concurrent_connects=4, stagger=0.5, connect_timeout=15.0, stall_timeout=10.0,
+                 backoff_initial=1.0, backoff_maximum=60.0, backoff_jitter=0.5, stable_after=60.0,
+                 check_interval=0.25, library_path=None, stream_factory=None, on_state_change=None, seed=None,
+                 clock=None):
+        """
+        :param cameras: A list of CameraConfig
+        :param max_concurrent_connects: Most connect attempts in progress at once
+        :param stagger: Seconds between the first connects of consecutive cameras
+        :param connect_timeout: Seconds a connect attempt may take to deliver its first frame
+        :param stall_timeout: Seconds without progress after which a connected stream is reconnected
+        :param backoff_initial: Delay before the first reconnect of a camera
+        :param backoff_maximum: Largest delay between reconnects
+        :param backoff_jitter: Random fraction of each delay, see Backoff
+        :param stable_after: Seconds a stream must stream before its backoff is reset, so a camera that stalls
+            right after every connect keeps backing off
+        :param check_interval: Seconds between checks of the monitor thread started by start()
+        :param library_path: Optional path to libalprstream
+        :param stream_factory: Optional callable(CameraConfig) returning the AlprStream for a camera
+        :param on_state_change: Optional callable(SupervisedStream, old_state, new_state), called from the
+            monitor thread
+        :param seed: Seed of the jitter, for reproducible schedules
+        :param clock: Optional function returning monotonic seconds
+        """
+        if max_concurrent_connects < 1:
+            raise ValueError("max_concurrent_connects must be at least 1")
+        self.max_concurrent_connects = max_concurrent_connects
+        self.stagger = stagger
+        self.connect_timeout = connect_timeout
+        self.stall_timeout = stall_timeout
+        self.stable_after = stable_after
+        self.check_interval = check_interval
+        self.on_state_change = on_state_change
+        self._clock = clock or time.monotonic
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        rng = random.Random(seed)
+        if stream_factory is None:
+            from alprstream import AlprStream
+
+            def stream_factory(config):
+                return AlprStream(config.frame_queue_size, config.use_motion_detection, library_path=library_path)
+        self._streams = []
+        for config in cameras:
+            backoff = Backoff(backoff_initial, backoff_maximum, jitter=backoff_jitter,
+                              rng=random.Random(rng.random()))
+            self._streams.append(SupervisedStream(config, stream_factory(config), backoff))
+
+    @classmethod
+    def from_config(cls, path, **overrides):
+        """
+        Creates a supervisor from a config file.
+        :param path: A JSON file as described in the module documentation
+        :param overrides: StreamSupervisor keyword arguments taking precedence over the file's
+        """
+        cameras, settings = load_config(path)
+        settings.update(overrides)
+        return cls(cameras, **settings)
+
+    def cameras(self):
+        """
+        :return: The SupervisedStream of every camera, in config order
+        """
+        return list(self._streams)
+
+    def camera(self, name):
+        """
+        :return: The SupervisedStream of the named camera
+        """
+        for supervised in self._streams:
+            if supervised.name == name:
+                return supervised
+        raise KeyError(name)
+
+    def _set_state(self, supervised, state, now):
+        old_state = supervised.state
+        supervised.state = state
+        supervised.state_since = now
+        if self.on_state_change is not None and old_state != state:
+            self.on_state_change(supervised, old_state, state)
+
+    def schedule(self, now=None):
+        """
+        Schedules the first connect of every stopped camera, stagger seconds apart.  Called by start().
+        """
+        with self._lock:
+            now = self._clock() if now is None else now
+            stopped = [supervised for supervised in self._streams if supervised.state == STOPPED]
+            for index, supervised in enumerate(stopped):
+                supervised.next_attempt = now + index * self.stagger
+                self._set_state(supervised, WAITING, now)
+
+    def _connect(self, supervised, now):
+        supervised.connects += 1
+        supervised.last_progress = now
+        supervised.last_queue_size = supervised.stream.get_queue_size()
+        supervised.last_frame_epoch = supervised._seen_frame_epoch
+        self._set_state(supervised, CONNECTING, now)
+        try:
+            supervised.stream.connect_video_stream_url(supervised.config.url,
+                                                       supervised.config.gstreamer_pipeline_format)
+        except Exception as e:
+            supervised.last_error = "connect failed: %s" % e
+            self._retry(supervised, now, disconnect=False)
+
+    def _retry(self, supervised, now, disconnect=True):
+        if disconnect:
+            supervised.stream.disconnect_video_stream()
+        supervised.next_attempt = now + supervised.backoff.next_delay()
+        self._set_state(supervised, BACKOFF, now)
+
+    def _progressed(self, supervised):
+        # The queue only grows when the reader pushes frames; draining it says nothing about the camera
+        queue_size = supervised.stream.get_queue_size()
+        progressed = queue_size > supervised.last_queue_size
+        supervised.last_queue_size = queue_size
+        frame_epoch = supervised._seen_frame_epoch
+        if frame_epoch is not None and (supervised.last_frame_epoch is None or
+                                        frame_epoch > supervised.last_frame_epoch):
+            supervised.last_frame_epoch = frame_epoch
+            progressed = True
+        return progressed
+
+    def check(self, now=None):
+        """
+        Advances every camera's state: starts due connects, detects stalls and failed connects.  Called
+        periodically by the monitor thread; call it directly to drive the supervisor without one.
+        """
+        with self._lock:
+            now = self._clock() if now is None else now
+            for supervised in self._streams:
+                if supervised.state in (CONNECTING, STREAMING):
+                    if self._progressed(supervised):
+                        supervised.last_progress = now
+                        if supervised.state == CONNECTING:
+                            self._set_state(supervised, STREAMING, now)
+                    elif supervised.state == CONNECTING:
+                        if now - supervised.state_since >= self.connect_timeout:
+                            supervised.failed_connects += 1
+                            supervised.last_error = "no frames within %.1f s of connecting" % self.connect_timeout
+                            self._retry(supervised, now)
+                    elif (now - supervised.last_progress >= self.stall_timeout and
+                          supervised.last_queue_size < supervised.config.frame_queue_size):
+                        # A full queue means processing is behind, which a reconnect would not fix
+                        supervised.stalls += 1
+                        supervised.last_error = "stalled for %.1f s" % (now - supervised.last_progress)
+                        self._retry(supervised, now)
+                    if (supervised.state == STREAMING and supervised.backoff.failures and
+                            now - supervised.state_since >= self.stable_after):
+                        supervised.backoff.reset()
+
+            connecting = sum(1 for supervised in self._streams if supervised.state == CONNECTING)
+            due = sorted((supervised for supervised in self._streams
+                          if supervised.state in (WAITING, BACKOFF) and supervised.next_attempt <= now),
+                         key=lambda supervised: supervised.next_attempt)
+            for supervised in due[:max(0, self.max_concurrent_connects - connecting)]:
+                self._connect(supervised, now)
+
+    def start(self):
+        """
+        Schedules the cameras and starts the monitor thread.
+        """
+        self.schedule()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="alprstream-supervisor")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def stop(self, close=True):
+        """
+        Stops the monitor thread and disconnects every camera.
+        :param close: Also close the AlprStreams
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            now = self._clock()
+            for supervised in self._streams:
+                if supervised.state in (CONNECTING, STREAMING, BACKOFF):
+                    supervised.stream.disconnect_video_stream()
+                self._set_state(supervised, STOPPED, now)
+                if close:
+                    supervised.stream.close()
+
+    def status(self):
+        """
+        :return: A list with the status dict of every camera
+        """
+        with self._lock:
+            return [supervised.status() for supervised in self._streams]
+
+    def stats(self):
+        """
+        :return: A dict with the number of cameras in each state and the total connects, failures and stalls
+        """
+        with self._lock:
+            states = {}
+            for supervised in self._streams:
+                states[supervised.state] = states.get(supervised.state, 0) + 1
+            return {"states": states, "connects": sum(item.connects for item in self._streams),
+                    "failed_connects": sum(item.failed_connects for item in self._streams),
+                    "stalls": sum(item.stalls for item in self._streams)}
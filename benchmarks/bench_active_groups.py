@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Active group polling benchmark: peek_active_groups + json.loads against diff_active_groups.
+
+The stand-in library holds --groups active groups (one plate group per plate of a frame).
+A dashboard loop polls the active groups --polls times; between polls, --changed of the
+groups are updated by processing frames that see only those plates.  Reports the time
+per poll, the share of it spent building the JSON in the library (peek only) and
+the native allocations left over (peek_active_groups used to leak its string).
+The groups stay open throughout while their best read (and so best_uuid) keeps
+changing, so diff_active_groups must report them as updated and never as closed.
+
+    python benchmarks/bench_active_groups.py --groups 200 --changed 0 5 50 200
+"""
+import argparse
+import json
+import sys
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def setup(groups):
+    # Every frame sees the same `groups` plates, so the groups stay open for the whole run
+    stublib.reset_options(PLATE_EVERY=1, PLATES_PER_FRAME=groups, GROUP_FRAMES=10 ** 9, JPEG_SIZE=0, BATCH_SIZE=1)
+    stream = AlprStream(10, False)
+    stream.push_frame(bytes(64 * 48 * 3), 3, 64, 48, -1)
+    stream.process_batch(NullAlpr())
+    return stream
+
+
+def change(stream, changed):
+    # Frames seeing the first `changed` plates extend those groups
+    if changed:
+        stublib.set_option("PLATES_PER_FRAME", changed)
+        stream.push_frame(bytes(64 * 48 * 3), 3, 64, 48, -1)
+        stream.process_batch(NullAlpr())
+
+
+def poll_native(stream):
+    return len(stream.peek_active_groups())
+
+
+def poll_full(stream):
+    return len(json.loads(stream.peek_active_groups().decode("UTF-8")))
+
+
+def poll_diff(stream):
+    return len(stream.diff_active_groups())
+
+
+def check_identity(groups, changed, polls):
+    stream = setup(groups)
+    stream.diff_active_groups()
+    updated = closed = 0
+    for _ in range(polls):
+        change(stream, changed)
+        delta = stream.diff_active_groups()
+        updated += len(delta.updated)
+        closed += len(delta.closed)
+    stream.close()
+    return updated, closed
+
+
+def run(groups, changed, polls, poll):
+    stream = setup(groups)
+    poll(stream)
+    elapsed = 0.0
+    for _ in range(polls):
+        change(stream, changed)
+        started = time.perf_counter()
+        poll(stream)
+        elapsed += time.perf_counter() - started
+    stream.close()
+    return elapsed / polls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--changed", type=int, nargs="+", default=[0, 5, 50, 200])
+    parser.add_argument("--polls", type=int, default=300)
+    args = parser.parse_args()
+
+    before = stublib.outstanding_allocations()
+    print("%-8s %8s %14s %16s %10s" % ("groups", "changed", "peek only us", "full parse us", "diff us"))
+    for changed in args.changed:
+        native = run(args.groups, min(changed, args.groups), args.polls, poll_native)
+        full = run(args.groups, min(changed, args.groups), args.polls, poll_full)
+        diff = run(args.groups, min(changed, args.groups), args.polls, poll_diff)
+        print("%-8d %8d %14.1f %16.1f %10.1f" % (args.groups, changed, native, full, diff))
+        sys.stdout.flush()
+    updated, closed = check_identity(args.groups, min(max(args.changed), args.groups), args.polls)
+    print("groups reported updated: %d, closed while still open: %d" % (updated, closed))
+    after = stublib.outstanding_allocations()
+    print("native allocations leaked: %d (%d bytes)" % (after[0] - before[0], after[1] - before[1]))
+
+
+if __name__ == '__main__':
+    main()
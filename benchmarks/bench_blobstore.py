@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+JPEG blob store benchmark: Python heap growth and throughput while a stream keeps the
+images of recognized frames, as bytes on each frame versus handles into an MmapBlobStore.
+
+Runs process_batch against the stand-in library with a JPEG on every frame and keeps
+every frame, as an application buffering images for upload would.
+
+    python benchmarks/bench_blobstore.py --frames 20000 --jpeg-size 65536 --directory /tmp/blob_bench
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_blobstore import MmapBlobStore
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        return 0
+
+
+def run(args, store):
+    stream = AlprStream(args.queue_size, False)
+    stream.set_encode_jpeg(2)
+    stream.set_jpeg_store(store)
+    alpr = NullAlpr()
+    frame = bytes(64 * 48 * 3)
+    kept = []
+    rss_before = _rss_bytes()
+    tracemalloc.start()
+    start = time.perf_counter()
+    while len(kept) < args.frames:
+        for index in range(args.queue_size):
+            stream.push_frame(frame, 3, 64, 48, len(kept) + index)
+        kept.extend(stream.process_batch(alpr))
+        stream.pop_completed_groups_raw()
+    elapsed = time.perf_counter() - start
+    heap, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = _rss_bytes() - rss_before
+    images = sum(1 for result in kept if result.jpeg_bytes is not None or result.jpeg_handle is not None)
+    if store is not None:
+        # Reading back one image proves the handle is usable
+        assert len(store.get(kept[-1].jpeg_handle)) == args.jpeg_size
+    stream.close()
+    return len(kept) / elapsed, heap, heap_peak, rss, images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--jpeg-size", type=int, default=65536)
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--segment-mb", type=int, default=256)
+    parser.add_argument("--directory", default="/tmp/alprstream_blob_bench")
+    args = parser.parse_args()
+
+    stublib.reset_options(PLATE_EVERY=1, JPEG_SIZE=args.jpeg_size, BATCH_SIZE=args.queue_size)
+    if os.path.exists(args.directory):
+        shutil.rmtree(args.directory)
+
+    print("%-10s %12s %14s %14s %14s" % ("storage", "frames/s", "heap MB", "heap peak MB", "RSS delta MB"))
+    for name in ("bytes", "mmap"):
+        store = MmapBlobStore(args.directory, args.segment_mb * 1024 * 1024) if name == "mmap" else None
+        rate, heap, peak, rss, images = run(args, store)
+        print("%-10s %12.0f %14.1f %14.1f %14.1f" % (name, rate, heap / 1e6, peak / 1e6, rss / 1e6))
+        if store is not None:
+            print("           %d images, %s" % (images, store.stats()))
+            store.close()
+        sys.stdout.flush()
+    shutil.rmtree(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Capture benchmark: the cost of recording pushed frames, and replaying a capture at real
+time, accelerated and maximum speed.
+
+Frames of --width x --height are recorded through CaptureRecorder into --directory, then
+replayed into a stream whose recognition the stand-in library simulates at about
+--capacity-fps, reporting the median time from a frame's scheduled push to its
+processing.  Replays at maximum speed are run twice to check that they are
+deterministic (the same frames and results each time).
+
+    python benchmarks/bench_capture.py --frames 600 --width 1280 --height 720
+"""
+import argparse
+import hashlib
+import shutil
+import sys
+import threading
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_capture import CaptureRecorder, CaptureReplayer
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def record(args):
+    import numpy
+    shutil.rmtree(args.directory, ignore_errors=True)
+    random = numpy.random.RandomState(1)
+    images = [random.randint(0, 255, (args.height, args.width, 3)).astype(numpy.uint8) for _ in range(8)]
+    stublib.reset_options(COPY_FRAMES=1, JPEG_SIZE=0)
+    stream = AlprStream(args.frames + 1, False)
+    started = time.perf_counter()
+    for index in range(args.frames):
+        stream.push_frame(images[index % len(images)], 3, args.width, args.height, 1500000000000 + index * 40)
+    plain = (time.perf_counter() - started) / args.frames * 1e6
+    stream.close()
+
+    stream = AlprStream(args.frames + 1, False)
+    recorder = CaptureRecorder(stream, args.directory)
+    started = time.perf_counter()
+    for index in range(args.frames):
+        recorder.push_frame(images[index % len(images)], 3, args.width, args.height, 1500000000000 + index * 40)
+    recorded = (time.perf_counter() - started) / args.frames * 1e6
+    recorder.close()
+    stream.close()
+    return plain, recorded
+
+
+def replay(args, speed):
+    stublib.reset_options(PLATE_EVERY=7, JPEG_SIZE=0, BATCH_SIZE=5, FRAME_DELAY_US=int(1e6 / args.capacity_fps))
+    replayer = CaptureReplayer(args.directory)
+    stream = AlprStream(30, False)
+    digest = hashlib.sha1()
+    ages = []
+    stats = []
+    started_ms = time.time() * 1000
+    thread = threading.Thread(target=lambda: stats.append(replayer.replay(stream, speed=speed, rebase_epoch=True)))
+    thread.start()
+    alpr = NullAlpr()
+    processed = 0
+    while thread.is_alive() or stream.get_queue_size():
+        frames = stream.process_batch(alpr)
+        now_ms = time.time() * 1000
+        for frame in frames:
+            if speed:
+                # How long after its scheduled push the frame was processed
+                ages.append(now_ms - started_ms - (frame.frame_epoch_time_ms - started_ms) / speed)
+            digest.update(frame.results_str.split(b'"epoch_time"')[0])
+        processed += len(frames)
+        if not frames:
+            time.sleep(0.001)
+    thread.join()
+    stream.close()
+    replayer.close()
+    ages.sort()
+    return stats[0], processed, "%.0f" % ages[len(ages) // 2] if ages else "-", digest.hexdigest()[:12]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--directory", default="/tmp/alprstream_capture")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--capacity-fps", type=float, default=200)
+    args = parser.parse_args()
+
+    plain, recorded = record(args)
+    print("push_frame %.1f us/frame, recorded push_frame %.1f us/frame" % (plain, recorded))
+    print("%-8s %10s %10s %12s %12s %18s  %s" % ("speed", "pushed", "processed", "seconds", "frames/s",
+                                                "median latency ms", "results"))
+    for speed in (1.0, 4.0, None, None):
+        stats, processed, median_age, digest = replay(args, speed)
+        print("%-8s %10d %10d %12.2f %12.1f %18s  %s" % ("max" if speed is None else "%gx" % speed, stats.frames,
+                                                           processed, stats.elapsed, stats.frames_per_second,
+                                                           median_age, digest))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+PlateDeduplicator benchmark: submit latency and accuracy as the set of recent plates grows.
+
+Fills the de-duplicator with distinct synthetic plates, then submits re-reads of known
+plates from other cameras, each with one OCR misread (a confusable swap, a substitution,
+an insertion or a deletion), together with fresh plates that must not be merged.
+
+    python benchmarks/bench_dedup.py --plates 10000 100000 300000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream_dedup import CONFUSABLE_CHARACTERS, PlateDeduplicator
+
+CHARACTERS = "ABCDEFGHJKLMNPRTUVWXY0123456789"
+SWAPS = dict(list(CONFUSABLE_CHARACTERS.items()) + [(value, key) for key, value in CONFUSABLE_CHARACTERS.items()])
+
+
+def random_plate(rng):
+    return "".join(rng.choice(CHARACTERS) for _ in range(7))
+
+
+def misread(plate, rng):
+    kind = rng.randrange(4)
+    position = rng.randrange(len(plate))
+    if kind == 0:
+        swappable = [i for i, character in enumerate(plate) if character in SWAPS]
+        if swappable:
+            i = rng.choice(swappable)
+            return plate[:i] + SWAPS[plate[i]] + plate[i + 1:]
+    if kind == 1:
+        return plate[:position] + rng.choice(CHARACTERS) + plate[position + 1:]
+    if kind == 2:
+        return plate[:position] + rng.choice(CHARACTERS) + plate[position:]
+    return plate[:position] + plate[position + 1:]
+
+
+def group(plate, camera, epoch):
+    return {"best_plate_number": plate, "camera": camera, "epoch_start": epoch, "epoch_end": epoch + 2000,
+            "best_confidence": 90.0, "candidates": [{"plate": plate, "confidence": 90.0}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--plates", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=1)
+    args = parser.parse_args()
+
+    for count in args.plates:
+        rng = random.Random(count)
+        dedup = PlateDeduplicator(window_ms=10 ** 9, max_distance=args.max_distance)
+        plates = list(set(random_plate(rng) for _ in range(count)))
+        start = time.perf_counter()
+        for index, plate in enumerate(plates):
+            dedup.submit(group(plate, "camera-a", 1000 + index))
+        fill = time.perf_counter() - start
+        initial = len(dedup)
+
+        reads = [(misread(rng.choice(plates), rng), True) for _ in range(args.queries // 2)]
+        reads += [(random_plate(rng), False) for _ in range(args.queries // 2)]
+        rng.shuffle(reads)
+        merged = false_merges = 0
+        start = time.perf_counter()
+        for plate, duplicate in reads:
+            _, is_new = dedup.submit(group(plate, "camera-b", 1000 + count))
+            if not is_new:
+                if duplicate:
+                    merged += 1
+                else:
+                    false_merges += 1
+        elapsed = time.perf_counter() - start
+        print("%7d plates: fill %6.1f us/group, submit %6.1f us/group, misreads merged %5.1f%%, "
+              "fresh plates merged %4.1f%% (%d clusters)" %
+              (initial, fill / len(plates) * 1e6, elapsed / len(reads) * 1e6, 100.0 * merged / (len(reads) // 2),
+               100.0 * false_merges / (len(reads) - len(reads) // 2), len(dedup)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+PlateIndex benchmark: query latency against a linear scan of the popped groups.
+
+Indexes synthetic groups from many cameras (in the layout pop_completed_groups returns)
+and times exact "seen on camera X in the last 10 minutes", prefix and time-window
+queries, then reports memory use and insert rate.
+
+    python benchmarks/bench_index.py --groups 1000000 --cameras 300
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream_index import PlateIndex
+
+LETTERS = "ABCDEFGHJKLMNPRSTUVWXYZ"
+
+
+def make_groups(count, cameras, plates, start_ms, rng):
+    pool = ["%s%s%s%04d" % (rng.choice(LETTERS), rng.choice(LETTERS), rng.choice(LETTERS), rng.randrange(10000))
+            for _ in range(plates)]
+    groups = []
+    epoch = start_ms
+    for index in range(count):
+        epoch += rng.randrange(0, 50)
+        groups.append({"best_plate_number": rng.choice(pool), "camera": "camera-%d" % rng.randrange(cameras),
+                       "epoch_start": epoch, "epoch_end": epoch + rng.randrange(200, 5000),
+                       "best_confidence": 90.0, "best_uuid": "%d-%08x" % (epoch, index)})
+    return pool, groups
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    for query in queries:
+        function(*query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--groups", type=int, default=200000)
+    parser.add_argument("--cameras", type=int, default=300)
+    parser.add_argument("--plates", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-queries", type=int, default=20, help="Queries timed for the linear scan")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    pool, groups = make_groups(args.groups, args.cameras, args.plates, 1500000000000, rng)
+    now = groups[-1]["epoch_end"]
+    window = 10 * 60 * 1000
+
+    tracemalloc.start()
+    index = PlateIndex()
+    start = time.perf_counter()
+    for offset in range(0, len(groups), 100):
+        index.add_groups(groups[offset:offset + 100])
+    insert = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Indexed %d groups: %.0f groups/s, %.1f MB traced, %.1f MB estimated" %
+          (len(index), len(groups) / insert, used / 1e6, index.stats()["estimated_bytes"] / 1e6))
+
+    exact = [(rng.choice(pool), "camera-%d" % rng.randrange(args.cameras), window, now) for _ in range(args.queries)]
+    prefixes = [(rng.choice(pool)[:4],) for _ in range(args.queries)]
+    windows = [(now - rng.randrange(10 ** 7) - 60000, None, "camera-%d" % rng.randrange(args.cameras))
+               for _ in range(args.queries)]
+    windows = [(start_ms, start_ms + 60000, camera) for start_ms, _, camera in windows]
+
+    def scan_exact(plate, camera, window_ms, now_ms):
+        return any(g["best_plate_number"] == plate and g["camera"] == camera and g["epoch_end"] >= now_ms - window_ms
+                   and g["epoch_start"] <= now_ms for g in groups)
+
+    print("%-28s %12s %14s" % ("query", "index (us)", "scan (us)"))
+    print("%-28s %12.2f %14.0f" % ("seen on camera, last 10 min", timed(index.seen_recently, exact),
+                                   timed(scan_exact, exact[:args.scan_queries])))
+    print("%-28s %12.2f %14.0f" % ("plate prefix (4 chars)", timed(index.prefix, prefixes),
+                                   timed(lambda p: [g for g in groups if g["best_plate_number"].startswith(p)],
+                                         prefixes[:args.scan_queries])))
+    print("%-28s %12.2f %14.0f" % ("1 min window on camera", timed(index.window, windows),
+                                   timed(lambda s, e, c: [g for g in groups if g["camera"] == c and
+                                                          g["epoch_end"] >= s and g["epoch_start"] <= e],
+                                         windows[:args.scan_queries])))
+
+
+if __name__ == '__main__':
+    main()
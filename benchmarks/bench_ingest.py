@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Image-directory ingestion benchmark: images/sec for a directory of JPEGs, comparing
+sequential decoding against the thread-pooled ImageIngestor.
+
+    python benchmarks/bench_ingest.py --generate 100000 --directory /tmp/ingest_bench
+    ALPRSTREAM_LIBRARY=/path/to/libalprstream.so python benchmarks/bench_ingest.py \
+        --directory /tmp/ingest_bench --workers 1 4 8
+
+--generate writes synthetic JPEGs with OpenCV first.  --decode-only skips the stream and
+measures scanning and decoding alone.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream_ingest import ImageIngestor, iter_image_paths
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def generate(directory, count, width, height):
+    import cv2
+    import numpy
+    os.makedirs(directory, exist_ok=True)
+    image = numpy.random.randint(0, 255, (height, width, 3), dtype=numpy.uint8)
+    encoded = cv2.imencode(".jpg", image)[1].tobytes()
+    for index in range(count):
+        with open(os.path.join(directory, "%08d.jpg" % index), "wb") as f:
+            f.write(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--directory", default="/tmp/ingest_bench")
+    parser.add_argument("--generate", type=int, default=0, help="Write this many JPEGs before benchmarking")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--limit", type=int, default=0, help="Only ingest the first N images")
+    parser.add_argument("--decode-only", action="store_true")
+    args = parser.parse_args()
+
+    if args.generate:
+        start = time.perf_counter()
+        generate(args.directory, args.generate, args.width, args.height)
+        print("Generated %d images in %.1fs" % (args.generate, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_image_paths(args.directory))
+    print("Scanned %d paths in %.3fs" % (count, time.perf_counter() - start))
+
+    for workers in args.workers:
+        paths = iter_image_paths(args.directory)
+        if args.limit:
+            paths = (path for index, path in zip(range(args.limit), paths))
+        if args.decode_only:
+            ingestor = ImageIngestor(None, workers=workers)
+            start = time.perf_counter()
+            decoded = sum(1 for _ in ingestor.decoded_frames(paths))
+            elapsed = time.perf_counter() - start
+            print("%2d decode worker(s): %10.1f images/s" % (workers, decoded / elapsed))
+        else:
+            from alprstream import AlprStream
+            stream = AlprStream(15, False)
+            ingestor = ImageIngestor(stream, workers=workers)
+            ingestor.process(paths, NullAlpr())
+            print("%2d decode worker(s): %r" % (workers, ingestor.stats()))
+            stream.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Overhead of the optional AlprStream metrics on the hot-path calls.
+
+Runs the same push_frame / process_batch / pop_completed_groups loop with metrics
+disabled and enabled and reports the time per frame of each, then prints the recorded
+metrics in the Prometheus text format.
+
+    ALPRSTREAM_LIBRARY=/path/to/libalprstream.so python benchmarks/bench_metrics.py --frames 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import AlprStream
+from alprstream_metrics import MetricsRegistry
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def run(stream, frames, batch_size, width, height):
+    alpr = NullAlpr()
+    frame = bytearray(width * height * 3)
+    start = time.perf_counter()
+    for index in range(frames):
+        stream.push_frame(frame, 3, width, height, index)
+        if stream.get_queue_size() >= batch_size:
+            stream.process_batch(alpr)
+            stream.pop_completed_groups()
+    while stream.get_queue_size() > 0:
+        stream.process_batch(alpr)
+    stream.pop_completed_groups()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=48)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--print-metrics", action="store_true", help="Print the Prometheus text afterwards")
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    results = {}
+    for _ in range(args.repeat):
+        for mode in ("disabled", "enabled"):
+            stream = AlprStream(args.batch_size, False)
+            if mode == "enabled":
+                stream.enable_metrics("bench", registry)
+            elapsed = run(stream, args.frames, args.batch_size, args.width, args.height)
+            stream.close()
+            results[mode] = min(results.get(mode, elapsed), elapsed)
+
+    for mode in ("disabled", "enabled"):
+        print("metrics %-8s %8.2f us/frame" % (mode, results[mode] / args.frames * 1e6))
+    print("overhead         %8.2f us/frame" % ((results["enabled"] - results["disabled"]) / args.frames * 1e6))
+    if args.print_metrics:
+        sys.stdout.write(registry.render())
+
+
+if __name__ == '__main__':
+    main()
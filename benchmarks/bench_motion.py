@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Motion pre-filter benchmark: cost of MotionFilter.check per frame, the share of frames
+dropped, and the total push + process time of a mostly static scene with and without
+the filter.
+
+The synthetic scene is a noisy static background that a bright block (the "vehicle")
+crosses during --moving percent of the frames.  Recognition time is simulated by the
+stand-in library in proportion to the pixels processed.
+
+    python benchmarks/bench_motion.py --frames 1000 --moving 20
+"""
+import argparse
+import sys
+import time
+
+import numpy
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_motion import MotionFilter, MotionFilteredStream
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def scene(args):
+    random = numpy.random.RandomState(1)
+    background = random.randint(60, 120, (args.height, args.width, 3)).astype(numpy.uint8)
+    moving = args.frames * args.moving // 100
+    block = args.height // 4
+    for index in range(args.frames):
+        frame = background + random.randint(0, 4, background.shape).astype(numpy.uint8)
+        if index < moving:
+            x = (args.width - block) * index // moving
+            frame[args.height // 2:args.height // 2 + block, x:x + block] = 230
+        yield frame
+
+
+def run(args, frames, motion_filter):
+    stublib.reset_options(PLATE_EVERY=5, JPEG_SIZE=0, BATCH_SIZE=args.queue_size,
+                          MEGAPIXEL_DELAY_US=args.megapixel_delay_us)
+    stream = AlprStream(args.queue_size, False)
+    target = MotionFilteredStream(stream, motion_filter) if motion_filter is not None else stream
+    alpr = NullAlpr()
+    start = time.perf_counter()
+    for index, frame in enumerate(frames):
+        target.push_frame(frame, 3, args.width, args.height, 1500000000000 + index * 100)
+        if stream.get_queue_size() >= args.queue_size:
+            stream.process_batch(alpr)
+    while stream.get_queue_size():
+        stream.process_batch(alpr)
+    elapsed = time.perf_counter() - start
+    stream.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--moving", type=int, default=20, help="Percent of frames with motion")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--downsample", type=int, default=8)
+    parser.add_argument("--megapixel-delay-us", type=int, default=10000,
+                        help="Simulated recognition time per megapixel processed")
+    args = parser.parse_args()
+
+    frames = list(scene(args))
+
+    motion_filter = MotionFilter(downsample=args.downsample)
+    start = time.perf_counter()
+    for index, frame in enumerate(frames):
+        motion_filter.check(frame, 3, args.width, args.height, 1500000000000 + index * 100)
+    check_us = (time.perf_counter() - start) / len(frames) * 1e6
+    print("check: %.1f us/frame, %s" % (check_us, motion_filter.stats()))
+
+    unfiltered = run(args, frames, None)
+    motion_filter = MotionFilter(downsample=args.downsample)
+    filtered = run(args, frames, motion_filter)
+    stats = motion_filter.stats()
+    print("%-12s %10s %16s" % ("", "pushed", "total ms/frame"))
+    print("%-12s %10d %16.2f" % ("unfiltered", len(frames), unfiltered / len(frames) * 1e3))
+    print("%-12s %10d %16.2f" % ("filtered", stats["pushed"], filtered / len(frames) * 1e3))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
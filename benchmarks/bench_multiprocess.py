@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark for MultiProcessRuntime: frames/sec for a fixed set of cameras as the
+number of worker processes grows.
+
+    ALPRSTREAM_LIBRARY=/path/to/libalprstream.so python benchmarks/bench_multiprocess.py \
+        --cameras 16 --frames 200 --workers 1 2 4 8
+
+Without OpenALPR installed, --null-alpr passes a null Alpr pointer, which only makes
+sense against a stand-in library that ignores it.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream_multiprocess import MultiProcessRuntime
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def make_null_alpr():
+    return NullAlpr()
+
+
+def make_openalpr():
+    from openalpr import Alpr
+    return Alpr("us", "", "")
+
+
+def run(workers, args):
+    alpr_factory = make_null_alpr if args.null_alpr else make_openalpr
+    runtime = MultiProcessRuntime(alpr_factory, workers=workers, frame_queue_size=args.queue_size,
+                                  slot_count=args.slots, max_frame_bytes=args.width * args.height * 3)
+    cameras = ["cam%d" % i for i in range(args.cameras)]
+    for camera_id in cameras:
+        runtime.add_camera(camera_id)
+    frame = bytearray(args.width * args.height * 3)
+
+    runtime.start()
+    groups = 0
+    start = time.perf_counter()
+    for index in range(args.frames):
+        for camera_id in cameras:
+            runtime.push_frame(camera_id, frame, 3, args.width, args.height, 1500000000000 + index * 100)
+        groups += sum(1 for _ in runtime.completed_groups())
+    groups += len(runtime.stop())
+    elapsed = time.perf_counter() - start
+    return args.frames * args.cameras / elapsed, groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cameras", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=200, help="Frames pushed per camera")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--queue-size", type=int, default=15)
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--null-alpr", action="store_true")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        fps, groups = run(workers, args)
+        baseline = baseline or fps / workers
+        print("%3d worker(s): %10.1f frames/s  %6d groups  scaling %.2fx of linear" %
+              (workers, fps, groups, fps / (baseline * workers)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Native memory stress benchmark: process millions of batches and check that RSS stays flat.
+
+Each batch pushes --batch-size frames and processes them with process_batch; every
+--side-every batches the stream also runs process_frame, pop_completed_groups,
+pop_completed_groups_raw, peek_active_groups and get_stream_url, so every kind of native
+response is taken and freed.  RSS is sampled --samples times after a warm-up and
+reported next to the stand-in library's count of unfreed allocations and, with --track,
+the binding's own NativeAllocations counters.  --leak-every takes a peek_active_groups
+response without freeing it every N batches, to show what a leak looks like.
+
+    python benchmarks/bench_native_memory.py --batches 1000000
+    python benchmarks/bench_native_memory.py --batches 200000 --track --leak-every 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def rss_bytes():
+    # Current resident set size.  Falls back to the peak where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(args):
+    stublib.reset_options(BATCH_SIZE=args.batch_size, PLATE_EVERY=3, GROUP_FRAMES=12, JPEG_SIZE=args.jpeg_size)
+    stream = AlprStream(args.batch_size * 2, False)
+    if args.track:
+        stream.enable_allocation_tracking()
+    alpr = NullAlpr()
+    pixels = bytes(args.width * args.height * 3)
+    warmup = max(1, args.batches // 20)
+    sample_every = max(1, (args.batches - warmup) // args.samples)
+    epoch_ms = 1500000000000
+    started = time.perf_counter()
+    try:
+        for batch in range(args.batches):
+            for _ in range(args.batch_size):
+                stream.push_frame(pixels, 3, args.width, args.height, epoch_ms)
+                epoch_ms += 40
+            stream.process_batch(alpr)
+            if batch % args.side_every == 0:
+                stream.push_frame(pixels, 3, args.width, args.height, epoch_ms)
+                epoch_ms += 40
+                stream.process_frame(alpr)
+                stream.pop_completed_groups()
+                stream.pop_completed_groups_raw()
+                stream.peek_active_groups()
+                stream.get_stream_url()
+            if args.leak_every and batch % args.leak_every == 0:
+                stream._lib.peek_active_groups_func(stream.alprstream_pointer)
+            done = batch + 1
+            if done >= warmup and (done - warmup) % sample_every == 0:
+                allocations = stream.native_allocations
+                yield (done, time.perf_counter() - started, rss_bytes(), stublib.outstanding_allocations(),
+                       allocations.snapshot() if allocations is not None else None)
+    finally:
+        stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batches", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=48)
+    parser.add_argument("--jpeg-size", type=int, default=4096)
+    parser.add_argument("--side-every", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--track", action="store_true", help="Enable the binding's allocation counters")
+    parser.add_argument("--leak-every", type=int, default=0)
+    parser.add_argument("--max-growth-mb", type=float, default=8.0)
+    args = parser.parse_args()
+
+    print("%12s %10s %12s %10s %18s %18s" % ("batches", "seconds", "rss MB", "us/batch", "native unfreed",
+                                            "tracked unfreed"))
+    previous = None
+    rows = []
+    for row in run(args):
+        done, elapsed, rss, native, tracked = row
+        per_batch = "-" if previous is None else "%.1f" % ((elapsed - previous[1]) / (done - previous[0]) * 1e6)
+        print("%12d %10.1f %12.1f %10s %18s %18s" % (
+            done, elapsed, rss / 1048576.0, per_batch, "%d / %d B" % native,
+            "-" if tracked is None else "%d / %d B" % (tracked["outstanding"], tracked["outstanding_bytes"])))
+        sys.stdout.flush()
+        previous = row
+        rows.append(row)
+    growth = (rows[-1][2] - rows[0][2]) / 1048576.0
+    print("RSS growth after warm-up: %.1f MB over %d batches (%s)" % (
+        growth, rows[-1][0] - rows[0][0], "flat" if growth <= args.max_growth_mb else "GROWING"))
+    if rows[-1][4] is not None:
+        print("tracked: %s" % rows[-1][4])
+    leaked = stublib.outstanding_allocations()
+    print("native allocations left after close: %d (%d bytes)" % leaked)
+    return 0 if growth <= args.max_growth_mb and leaked[0] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
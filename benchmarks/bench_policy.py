@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Ingest policy benchmark: an overloaded camera (frames arriving faster than they can be
+recognized) under each ingestion policy.
+
+A producer thread pushes frames at --fps while the main thread runs process_batch against
+the stand-in library, whose per-frame delay caps recognition at about --capacity-fps.
+Reports frames processed, the age of frames when they were processed and the drop
+counters of each policy.
+
+    python benchmarks/bench_policy.py --fps 60 --capacity-fps 25 --seconds 3
+"""
+import argparse
+import sys
+import threading
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_policy import (DROP_NEWEST, DROP_OLDEST, AdaptiveDecimation, EveryNthFrame, PolicyChain,
+                               QueueFullPolicy, TargetFps)
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def run(args, policy):
+    stublib.reset_options(PLATE_EVERY=1000, JPEG_SIZE=0, BATCH_SIZE=args.batch_size,
+                          FRAME_DELAY_US=int(1e6 / args.capacity_fps))
+    stream = AlprStream(args.queue_size, False)
+    stream.set_ingest_policy(policy)
+    frame = bytes(64 * 48 * 3)
+    stop = threading.Event()
+
+    def produce():
+        interval = 1.0 / args.fps
+        next_time = time.monotonic()
+        while not stop.is_set():
+            stream.push_frame(frame, 3, 64, 48, -1)
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    alpr = NullAlpr()
+    ages = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        frames = stream.process_batch(alpr)
+        now_ms = time.time() * 1000
+        ages.extend(now_ms - result.frame_epoch_time_ms for result in frames)
+        if not frames:
+            time.sleep(0.001)
+    stop.set()
+    producer.join()
+    stream.close()
+    ages.sort()
+    return len(ages), ages[len(ages) // 2] if ages else 0.0, ages[-1] if ages else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--capacity-fps", type=float, default=25)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--queue-size", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=5)
+    args = parser.parse_args()
+
+    policies = (("none", lambda: None),
+                ("drop oldest", lambda: QueueFullPolicy(DROP_OLDEST)),
+                ("drop newest", lambda: QueueFullPolicy(DROP_NEWEST)),
+                ("every 3rd", lambda: EveryNthFrame(3)),
+                ("target 20fps", lambda: TargetFps(20)),
+                ("adaptive", lambda: PolicyChain(AdaptiveDecimation(target_latency=0.2), QueueFullPolicy())))
+    print("%-14s %10s %14s %12s  %s" % ("policy", "processed", "median age ms", "max age ms", "counters"))
+    for name, factory in policies:
+        policy = factory()
+        processed, median, worst = run(args, policy)
+        counters = policy.stats() if policy is not None else {}
+        if counters:
+            counters = {"admitted": counters["admitted"], "dropped": counters["dropped"]}
+        print("%-14s %10d %14.0f %12.0f  %s" % (name, processed, median, worst, counters))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark for the push_frame marshalling path.
+
+Compares the old behaviour (copy every frame into a bytes object and pass it as char*)
+against the zero-copy path used by AlprStream.push_frame.  The native call is replaced
+by a zero-length memmove so only the Python-side cost is measured.
+
+    python benchmarks/bench_push_frame.py --width 1920 --height 1080 --frames 2000
+"""
+import argparse
+import ctypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import _pixel_buffer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_SINK = ctypes.create_string_buffer(1)
+
+
+def _native_call(pointer):
+    ctypes.memmove(_SINK, pointer, 0)
+
+
+def bench_copy(frame, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        data = bytes(frame)
+        _native_call(data)
+    return time.perf_counter() - start
+
+
+def bench_zero_copy(frame, frames, bytes_per_pixel, width, height):
+    start = time.perf_counter()
+    for _ in range(frames):
+        pointer, keepalive = _pixel_buffer(frame, bytes_per_pixel, width, height)
+        _native_call(pointer)
+        del keepalive
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--bpp", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=1000)
+    args = parser.parse_args()
+
+    frame_size = args.width * args.height * args.bpp
+    if numpy is not None:
+        frame = numpy.zeros((args.height, args.width, args.bpp), dtype=numpy.uint8)
+        kind = "numpy.ndarray"
+    else:
+        frame = bytearray(frame_size)
+        kind = "bytearray"
+
+    print("Frame: %dx%dx%d (%s, %.1f MB)" % (args.width, args.height, args.bpp, kind, frame_size / 1e6))
+    for name, elapsed in (("copy", bench_copy(frame, args.frames)),
+                          ("zero-copy", bench_zero_copy(frame, args.frames, args.bpp, args.width, args.height))):
+        print("%-10s %10.1f frames/s %12.1f MB/s" % (name, args.frames / elapsed,
+                                                      frame_size * args.frames / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
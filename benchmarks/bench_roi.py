@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Region-of-interest benchmark: pixels pushed and push + process time per frame for full
+frames versus a full-width band (zero copy) and two rectangles (mosaic copy).
+
+Runs against the stand-in library, with its simulated recognition time set proportional
+to the pixels of each frame (--megapixel-delay-us), as a real detector's roughly is.
+
+    python benchmarks/bench_roi.py --frames 500
+"""
+import argparse
+import sys
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_roi import RoiStream
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def run(args, regions, frame):
+    stublib.reset_options(PLATE_EVERY=1, JPEG_SIZE=0, BATCH_SIZE=args.queue_size,
+                          MEGAPIXEL_DELAY_US=args.megapixel_delay_us)
+    stream = AlprStream(args.queue_size, False)
+    target = RoiStream(stream, regions) if regions else stream
+    alpr = NullAlpr()
+    push = process = 0.0
+    for offset in range(0, args.frames, args.queue_size):
+        start = time.perf_counter()
+        for index in range(args.queue_size):
+            target.push_frame(frame, 3, args.width, args.height, offset + index)
+        pushed = time.perf_counter()
+        target.process_batch(alpr)
+        process += time.perf_counter() - pushed
+        push += pushed - start
+        target.pop_completed_groups()
+    pixels = target.stats()["pushed_fraction"] if regions else 1.0
+    stream.close()
+    return push / args.frames * 1e6, process / args.frames * 1e6, pixels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--megapixel-delay-us", type=int, default=10000,
+                        help="Simulated recognition time per megapixel pushed")
+    args = parser.parse_args()
+
+    frame = bytearray(args.width * args.height * 3)
+    cases = (("full frame", None),
+             ("band 1/3", [(0, args.height * 2 // 3, args.width, args.height // 3)]),
+             ("2 rects 1/8", [(0, args.height // 2, args.width // 4, args.height // 4),
+                              (args.width // 2, args.height * 3 // 4, args.width // 4, args.height // 4)]))
+    print("%-14s %10s %16s %18s" % ("case", "pixels", "push us/frame", "process us/frame"))
+    for name, regions in cases:
+        push, process, pixels = run(args, regions, frame)
+        print("%-14s %9.0f%% %16.1f %18.1f" % (name, pixels * 100.0, push, process))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Segmented video benchmark: frames/sec for one video file processed by SegmentedVideoProcessor
+with 1..N worker processes.
+
+A synthetic MJPEG file is written with OpenCV first (--generate).  Recognition time is
+simulated by the stand-in library per megapixel, so with enough cores the throughput
+should scale with the number of workers until decoding or the disk becomes the limit.
+
+    python benchmarks/bench_segments.py --generate 3000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream_segments import SegmentedVideoProcessor
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def make_alpr():
+    return NullAlpr()
+
+
+def generate(path, frames, width, height, fps):
+    import cv2
+    import numpy
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    random = numpy.random.RandomState(1)
+    background = random.randint(0, 255, (height, width, 3)).astype(numpy.uint8)
+    for index in range(frames):
+        frame = background.copy()
+        x = index * 7 % (width - 64)
+        frame[height // 2:height // 2 + 32, x:x + 64] = 255
+        writer.write(frame)
+    writer.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--video", default="/tmp/alprstream_segments.avi")
+    parser.add_argument("--generate", type=int, default=0, help="Write a synthetic video of this many frames first")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--segment-seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--megapixel-delay-us", type=int, default=20000,
+                        help="Simulated recognition time per megapixel processed")
+    args = parser.parse_args()
+
+    if args.generate or not os.path.exists(args.video):
+        generate(args.video, args.generate or 3000, args.width, args.height, args.fps)
+    stublib.reset_options(PLATE_EVERY=3, JPEG_SIZE=0, MEGAPIXEL_DELAY_US=args.megapixel_delay_us)
+
+    print("cpus: %d" % (os.cpu_count() or 1))
+    print("%-8s %10s %10s %10s %12s" % ("workers", "segments", "groups", "stitched", "frames/s"))
+    for workers in args.workers:
+        processor = SegmentedVideoProcessor(make_alpr, workers=workers, segment_seconds=args.segment_seconds)
+        result = processor.process(args.video, video_start_time=1500000000000)
+        print("%-8d %10d %10d %10d %12.1f" % (workers, len(result.segments), len(result.groups), result.stitched,
+                                             result.frames_per_second))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Result sink benchmark: rows/sec persisted, and time the recognition loop spends handing
+records over.
+
+Compares one autocommitted INSERT per group against ResultSink with SQLiteWriter (WAL)
+and with SegmentLogWriter, for groups alone and for frames carrying JPEG images, inline
+or spilled to a DirectoryBlobStore.
+
+    python benchmarks/bench_sink.py --groups 50000 --directory /tmp/sink_bench
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import AlprStreamRecognizedFrame
+from alprstream_sink import DirectoryBlobStore, ResultSink, SegmentLogWriter, SQLiteWriter
+
+
+def make_group(index):
+    plate = "ABC%04d" % (index % 10000)
+    return {"data_type": "alpr_group", "epoch_start": 1500000000000 + index * 100,
+            "epoch_end": 1500000000000 + index * 100 + 2000, "best_plate_number": plate, "best_confidence": 91.5,
+            "best_uuid": "1500000000000-%08x" % index, "camera": "camera-%d" % (index % 16),
+            "candidates": [{"plate": plate, "confidence": 91.5 - c} for c in range(5)],
+            "best_plate": {"plate": plate, "coordinates": [{"x": 10, "y": 20}] * 4}}
+
+
+def make_frame(index, jpeg):
+    results = json.dumps({"epoch_time": 1500000000000 + index * 100, "results": []}).encode("utf-8")
+    return AlprStreamRecognizedFrame(True, jpeg, 1500000000000 + index * 100, index, results)
+
+
+def bench_naive(path, groups):
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE groups (uuid TEXT, camera TEXT, plate TEXT, epoch_start INTEGER, "
+                       "epoch_end INTEGER, json TEXT)")
+    start = time.perf_counter()
+    for group in groups:
+        connection.execute("INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)",
+                           (group["best_uuid"], group["camera"], group["best_plate_number"], group["epoch_start"],
+                            group["epoch_end"], json.dumps(group)))
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed, elapsed
+
+
+def bench_sink(sink, groups=(), frames=(), chunk=20):
+    start = time.perf_counter()
+    submit = 0.0
+    for offset in range(0, max(len(groups), len(frames)), chunk):
+        before = time.perf_counter()
+        if groups:
+            sink.write_groups(groups[offset:offset + chunk])
+        if frames:
+            sink.write_frames(frames[offset:offset + chunk], "camera-0")
+        submit += time.perf_counter() - before
+    sink.close()
+    return time.perf_counter() - start, submit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--groups", type=int, default=20000)
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--jpeg-size", type=int, default=65536)
+    parser.add_argument("--max-batch", type=int, default=1000)
+    parser.add_argument("--directory", default="/tmp/sink_bench")
+    args = parser.parse_args()
+
+    shutil.rmtree(args.directory, ignore_errors=True)
+    os.makedirs(args.directory)
+    groups = [make_group(index) for index in range(args.groups)]
+    jpeg = b"\xff\xd8" + b"\x00" * (args.jpeg_size - 2)
+    frames = [make_frame(index, jpeg) for index in range(args.frames)]
+
+    def path(name):
+        return os.path.join(args.directory, name)
+
+    runs = [
+        ("groups, INSERT per group", len(groups), lambda: bench_naive(path("naive.db"), groups)),
+        ("groups, SQLite batches", len(groups),
+         lambda: bench_sink(ResultSink(SQLiteWriter(path("groups.db")), max_batch=args.max_batch), groups)),
+        ("groups, segment log", len(groups),
+         lambda: bench_sink(ResultSink(SegmentLogWriter(path("groups_log")), max_batch=args.max_batch), groups)),
+        ("frames, SQLite inline JPEG", len(frames),
+         lambda: bench_sink(ResultSink(SQLiteWriter(path("frames.db")), max_batch=args.max_batch), frames=frames)),
+        ("frames, SQLite + blob files", len(frames),
+         lambda: bench_sink(ResultSink(SQLiteWriter(path("frames_blobs.db")), max_batch=args.max_batch,
+                                       blob_store=DirectoryBlobStore(path("blobs"))), frames=frames)),
+        ("frames, segment log inline", len(frames),
+         lambda: bench_sink(ResultSink(SegmentLogWriter(path("frames_log")), max_batch=args.max_batch),
+                            frames=frames)),
+    ]
+    print("%-30s %12s %22s" % ("", "rows/s", "caller time per row"))
+    for name, count, run in runs:
+        elapsed, submit = run()
+        print("%-30s %12.0f %19.2f us" % (name, count / elapsed, submit / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Canonical-size benchmark: cameras of many resolutions sharing one library, pushed as-is
+versus normalized to a few canonical sizes by CanonicalSizeStream.
+
+The stand-in library models the per-size caches of the real one: processing a frame whose
+size is not among the few most recently seen costs --size-miss-us, and every megapixel
+costs --megapixel-delay-us, so the padding added by normalization is charged too.
+
+    python benchmarks/bench_sizes.py --cameras 12 --frames 50
+"""
+import argparse
+import sys
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_sizes import CanonicalSizes, CanonicalSizeStream
+
+RESOLUTIONS = [(1920, 1080), (1280, 720), (1280, 960), (1296, 972), (1600, 1200), (1024, 768), (800, 600),
+               (704, 576), (720, 480), (640, 480), (2048, 1536), (1440, 1080), (960, 540), (1280, 1024),
+               (2560, 1440), (352, 288)]
+CANONICAL = [(640, 480), (1280, 720), (1920, 1080)]
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def run(args, canonical):
+    stublib.reset_options(PLATE_EVERY=1, JPEG_SIZE=0, BATCH_SIZE=args.queue_size,
+                          MEGAPIXEL_DELAY_US=args.megapixel_delay_us, SIZE_MISS_US=args.size_miss_us)
+    sizes = CanonicalSizes(CANONICAL) if canonical else None
+    resolutions = RESOLUTIONS[:args.cameras]
+    cameras = []
+    for width, height in resolutions:
+        stream = AlprStream(args.queue_size, False)
+        target = CanonicalSizeStream(stream, sizes) if canonical else stream
+        cameras.append((target, width, height, bytearray(width * height * 3)))
+    alpr = NullAlpr()
+    push = process = 0.0
+    # Cameras take turns, one batch each, as a scheduler sharing one Alpr would run them
+    for offset in range(0, args.frames, args.queue_size):
+        for target, width, height, frame in cameras:
+            start = time.perf_counter()
+            for index in range(args.queue_size):
+                target.push_frame(frame, 3, width, height, 1500000000000 + (offset + index) * 100)
+            pushed = time.perf_counter()
+            target.process_batch(alpr)
+            process += time.perf_counter() - pushed
+            push += pushed - start
+    frames = args.frames * len(cameras)
+    for target, _, _, _ in cameras:
+        target.close()
+    native_sizes = sizes.stats()["native_sizes"] if canonical else len(set(resolutions))
+    return native_sizes, push / frames * 1e3, process / frames * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cameras", type=int, default=12, help="Number of cameras, each with its own resolution")
+    parser.add_argument("--frames", type=int, default=50, help="Frames per camera")
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--size-miss-us", type=int, default=20000)
+    parser.add_argument("--megapixel-delay-us", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("%-12s %14s %16s %18s" % ("", "native sizes", "push ms/frame", "process ms/frame"))
+    for name, canonical in (("as-is", False), ("canonical", True)):
+        native_sizes, push, process = run(args, canonical)
+        print("%-12s %14d %16.3f %18.3f" % (name, native_sizes, push, process))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark: time to construct N AlprStream instances.
+
+The first construction loads the library and binds the function prototypes, every
+later one only calls alprstream_init.  Streams can be created from several threads at
+once to show that construction no longer serialises on a global lock.
+
+    ALPRSTREAM_LIBRARY=/path/to/libalprstream.so python benchmarks/bench_startup.py --streams 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import AlprStream
+
+
+def construct(count, queue_size, library, streams):
+    for _ in range(count):
+        streams.append(AlprStream(queue_size, False, library_path=library))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=15)
+    parser.add_argument("--library", default=None, help="Path to libalprstream (defaults to $ALPRSTREAM_LIBRARY)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    first = AlprStream(args.queue_size, False, library_path=args.library)
+    first_elapsed = time.perf_counter() - start
+
+    streams = [first]
+    per_thread = [args.streams // args.threads + (1 if i < args.streams % args.threads else 0)
+                  for i in range(args.threads)]
+    threads = [threading.Thread(target=construct, args=(count, args.queue_size, args.library, streams)) for count in per_thread]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print("First stream (library load): %8.3f ms" % (first_elapsed * 1000))
+    print("%d streams on %d thread(s):   %8.3f ms total, %.1f us/stream" %
+          (args.streams, args.threads, elapsed * 1000, elapsed * 1e6 / max(args.streams, 1)))
+
+
+if __name__ == '__main__':
+    main()
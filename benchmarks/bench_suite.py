@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Repeatable benchmark suite for the bindings, run against the stand-in library.
+
+Builds benchmarks/stub (see stublib.py) and measures:
+
+    push           push_frame throughput for full-size raw frames
+    batch_decode   process_batch result copying, with and without parsing each frame's JSON
+    group_json     pop_completed_groups JSON decoding, parsed and raw
+    multistream    aggregate throughput of a BatchScheduler over 1..N streams fed by video sources
+
+Every benchmark is run --repeat times and the median is reported.  Results can be saved
+and compared between commits:
+
+    python benchmarks/bench_suite.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_suite.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_scheduler import BatchScheduler
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def bench_push(args):
+    stublib.reset_options()
+    stream = AlprStream(args.queue_size, False)
+    frame = bytearray(args.width * args.height * 3)
+    start = time.perf_counter()
+    for index in range(args.frames):
+        stream.push_frame(frame, 3, args.width, args.height, index)
+    elapsed = time.perf_counter() - start
+    stream.close()
+    return {"push_frames_per_second": (args.frames / elapsed, "frames/s")}
+
+
+def bench_batch_decode(args):
+    stublib.reset_options(PLATE_EVERY=1, PLATES_PER_FRAME=2, JPEG_SIZE=args.jpeg_size, BATCH_SIZE=args.queue_size)
+    alpr = NullAlpr()
+    frame = bytes(64 * 48 * 3)
+    results = {}
+    for parse in (False, True):
+        stream = AlprStream(args.queue_size, False)
+        elapsed = 0.0
+        processed = 0
+        while processed < args.frames:
+            for index in range(args.queue_size):
+                stream.push_frame(frame, 3, 64, 48, processed + index)
+            start = time.perf_counter()
+            frames = stream.process_batch(alpr)
+            if parse:
+                for result in frames:
+                    result.results
+            elapsed += time.perf_counter() - start
+            processed += len(frames)
+            stream.pop_completed_groups_raw()
+        stream.close()
+        name = "batch_decode_parsed_us_per_frame" if parse else "batch_decode_us_per_frame"
+        results[name] = (elapsed / processed * 1e6, "us/frame")
+    return results
+
+
+def bench_group_json(args):
+    stublib.reset_options(PLATE_EVERY=1, PLATES_PER_FRAME=4, GROUP_FRAMES=1, JPEG_SIZE=0,
+                          CANDIDATES=args.candidates)
+    alpr = NullAlpr()
+    frame = bytes(64 * 48 * 3)
+    results = {}
+    for raw in (False, True):
+        stream = AlprStream(args.queue_size, False)
+        elapsed = 0.0
+        groups = 0
+        while groups < args.groups:
+            # Fill the grouping queue with a few hundred groups, then time a single pop
+            for _ in range(100 // args.queue_size + 1):
+                for index in range(args.queue_size):
+                    stream.push_frame(frame, 3, 64, 48, index)
+                stream.process_batch(alpr)
+            start = time.perf_counter()
+            if raw:
+                popped = stream.pop_completed_groups_raw()
+                groups += popped.count(b'"data_type":"alpr_group"')
+            else:
+                groups += len(stream.pop_completed_groups())
+            elapsed += time.perf_counter() - start
+        stream.close()
+        name = "group_json_raw_us_per_group" if raw else "group_json_us_per_group"
+        results[name] = (elapsed / groups * 1e6, "us/group")
+    return results
+
+
+def bench_multistream(args):
+    stublib.reset_options(VIDEO_FRAMES=args.video_frames, VIDEO_WIDTH=64, VIDEO_HEIGHT=48,
+                          BATCH_DELAY_US=args.batch_delay_us, BATCH_SIZE=args.queue_size)
+    results = {}
+    for count in args.streams:
+        streams = [AlprStream(args.queue_size, False) for _ in range(count)]
+        scheduler = BatchScheduler([NullAlpr() for _ in range(args.workers)], idle_wait=0.001)
+        for index, stream in enumerate(streams):
+            scheduler.add_stream(stream, name="camera-%d" % index)
+        start = time.perf_counter()
+        for stream in streams:
+            stream.connect_video_file("synthetic.mp4", 0)
+        scheduler.run(until_idle=True)
+        elapsed = time.perf_counter() - start
+        frames = sum(stat.frames for stat in scheduler.stats())
+        for stream in streams:
+            stream.close()
+        results["multistream_%d_frames_per_second" % count] = (frames / elapsed, "frames/s")
+    return results
+
+
+BENCHMARKS = (("push", bench_push), ("batch_decode", bench_batch_decode), ("group_json", bench_group_json),
+              ("multistream", bench_multistream))
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--queue-size", type=int, default=10)
+    parser.add_argument("--jpeg-size", type=int, default=65536)
+    parser.add_argument("--groups", type=int, default=5000)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int, default=2, help="Alpr instances shared by the multistream scheduler")
+    parser.add_argument("--video-frames", type=int, default=200)
+    parser.add_argument("--batch-delay-us", type=int, default=2000, help="Simulated recognition time per batch")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --output to compare against")
+    args = parser.parse_args()
+
+    selected = args.benchmarks or [name for name, _ in BENCHMARKS]
+    unknown = set(selected) - set(name for name, _ in BENCHMARKS)
+    if unknown:
+        parser.error("Unknown benchmark(s): %s" % ", ".join(sorted(unknown)))
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, function in BENCHMARKS:
+        if name not in selected:
+            continue
+        runs = [function(args) for _ in range(args.repeat)]
+        for metric in sorted(runs[0]):
+            value = _median([run[metric][0] for run in runs])
+            unit = runs[0][metric][1]
+            results[metric] = {"value": value, "unit": unit}
+            line = "%-40s %14.2f %-9s" % (metric, value, unit)
+            if metric in baseline:
+                before = baseline[metric]["value"]
+                line += "  was %12.2f  (%+.1f%%)" % (before, (value - before) / before * 100.0 if before else 0.0)
+            print(line)
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": _commit(), "python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "time": time.time(), "arguments": vars(args), "results": results},
+                      f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
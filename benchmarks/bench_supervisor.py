@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Supervisor benchmark: frames processed from a fleet of misbehaving cameras, with and
+without StreamSupervisor.
+
+The stand-in library's stream source takes its behaviour from the URL (see the top of
+alprstream_stub.c): some cameras connect slowly, some hang after a number of frames and
+some fail their first connects.  "unsupervised" connects every camera once, as the
+samples do; "supervised" lets StreamSupervisor stagger, cap, time out and reconnect them.
+Reports the frames processed per camera and the supervisor's counters.
+
+    python benchmarks/bench_supervisor.py --cameras 12 --seconds 10
+"""
+import argparse
+import sys
+import threading
+import time
+
+import stublib
+
+stublib.use_stub()
+
+from alprstream import AlprStream
+from alprstream_supervisor import CONNECTING, CameraConfig, StreamSupervisor
+
+# Camera behaviours, cycled over the cameras
+BEHAVIOURS = (("healthy", ""), ("slow connect", "connect_ms=1500"), ("hangs", "stall_after=60"),
+              ("fails twice", "fail_first=2"))
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def cameras(count, fps):
+    configs = []
+    for index in range(count):
+        label, query = BEHAVIOURS[index % len(BEHAVIOURS)]
+        url = "stub://camera-%d?fps=%d%s" % (index, fps, "&" + query if query else "")
+        configs.append((label, CameraConfig("camera-%d" % index, url, frame_queue_size=30,
+                                            use_motion_detection=False)))
+    return configs
+
+
+def consume(streams, seconds):
+    alpr = NullAlpr()
+    counts = dict((name, 0) for name in streams)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        idle = True
+        for name, stream in streams.items():
+            frames = stream.process_batch(alpr)
+            counts[name] += len(frames)
+            idle = idle and not frames
+        if idle:
+            time.sleep(0.005)
+    return counts
+
+
+def run_unsupervised(configs, seconds):
+    streams = {}
+    for label, config in configs:
+        stream = AlprStream(config.frame_queue_size, config.use_motion_detection)
+        stream.connect_video_stream_url(config.url)
+        streams[config.name] = stream
+    counts = consume(streams, seconds)
+    for stream in streams.values():
+        stream.disconnect_video_stream()
+        stream.close()
+    return counts, None, None
+
+
+def run_supervised(configs, seconds, args):
+    peak = [0]
+    lock = threading.Lock()
+
+    def on_state_change(supervised, old_state, new_state):
+        with lock:
+            peak[0] = max(peak[0], sum(1 for item in supervisor.cameras() if item.state == CONNECTING))
+
+    supervisor = StreamSupervisor([config for label, config in configs],
+                                  max_concurrent_connects=args.max_concurrent, stagger=args.stagger,
+                                  connect_timeout=args.connect_timeout, stall_timeout=args.stall_timeout,
+                                  backoff_initial=0.5, backoff_maximum=4.0, check_interval=0.1, seed=1,
+                                  on_state_change=on_state_change)
+    supervisor.start()
+    counts = consume(dict((item.name, item) for item in supervisor.cameras()), seconds)
+    status = dict((item["name"], item) for item in supervisor.status())
+    stats = supervisor.stats()
+    supervisor.stop()
+    stats["peak_connecting"] = peak[0]
+    return counts, status, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cameras", type=int, default=12)
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--max-concurrent", type=int, default=3)
+    parser.add_argument("--stagger", type=float, default=0.2)
+    parser.add_argument("--connect-timeout", type=float, default=2.5)
+    parser.add_argument("--stall-timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    stublib.reset_options(PLATE_EVERY=1000, JPEG_SIZE=0, VIDEO_WIDTH=64, VIDEO_HEIGHT=48)
+    configs = cameras(args.cameras, args.fps)
+    unsupervised, _, _ = run_unsupervised(configs, args.seconds)
+    supervised, status, stats = run_supervised(configs, args.seconds, args)
+
+    print("%-10s %-13s %13s %11s %9s %7s %7s" % ("camera", "behaviour", "unsupervised", "supervised", "connects",
+                                                 "failed", "stalls"))
+    for label, config in configs:
+        camera = status[config.name]
+        print("%-10s %-13s %13d %11d %9d %7d %7d" % (config.name, label, unsupervised[config.name],
+                                                     supervised[config.name], camera["connects"],
+                                                     camera["failed_connects"], camera["stalls"]))
+    print("total frames: unsupervised %d, supervised %d (ideal %d)" % (
+        sum(unsupervised.values()), sum(supervised.values()), int(args.cameras * args.fps * args.seconds)))
+    print("supervisor: %s" % stats)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Consumer loop benchmark: sleep-polling on get_queue_size() against wait_for_frames().
+
+A producer thread pushes frames at random (Poisson) intervals.  The consumer processes
+them either by polling the queue with a fixed sleep, or by blocking in wait_for_frames.
+For each mode the consumer thread's CPU time and the frame-to-result latency are
+reported.
+
+    ALPRSTREAM_LIBRARY=/path/to/libalprstream.so python benchmarks/bench_wait.py --rate 30 --seconds 5
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import AlprStream
+
+
+class NullAlpr(object):
+    alpr_pointer = None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else float("nan")
+
+
+def run(mode, args):
+    stream = AlprStream(args.queue_size, False)
+    alpr = NullAlpr()
+    frame = bytearray(args.width * args.height * 3)
+    done = threading.Event()
+    latencies = []
+    iterations = [0]
+
+    def produce():
+        rng = random.Random(1)
+        deadline = time.time() + args.seconds
+        while time.time() < deadline:
+            time.sleep(rng.expovariate(args.rate))
+            stream.push_frame(frame, 3, args.width, args.height, int(time.time() * 1000))
+        done.set()
+
+    def consume():
+        start_cpu = time.thread_time()
+        while not done.is_set() or stream.get_queue_size() > 0:
+            iterations[0] += 1
+            if mode == "sleep":
+                if stream.get_queue_size() == 0:
+                    time.sleep(args.poll)
+                    continue
+            elif not stream.wait_for_frames(1, timeout=0.1):
+                continue
+            for result in stream.process_batch(alpr):
+                latencies.append(time.time() * 1000 - result.frame_epoch_time_ms)
+        iterations.append(time.thread_time() - start_cpu)
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stream.close()
+    cpu = iterations.pop()
+    print("%-6s %6d frames  cpu %7.1f ms  loops %7d  latency p50 %6.1f ms  p99 %6.1f ms" %
+          (mode, len(latencies), cpu * 1000, iterations[0], percentile(latencies, 50), percentile(latencies, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=30.0, help="Mean frames per second pushed")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--poll", type=float, default=0.01, help="Sleep of the polling consumer, in seconds")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--queue-size", type=int, default=15)
+    args = parser.parse_args()
+
+    for mode in ("sleep", "wait"):
+        run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
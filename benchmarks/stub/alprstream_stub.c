@@ -0,0 +1,851 @@
+/*
+ * Stand-in for libalprstream implementing the C ABI bound by alprstream.py.
+ *
+ * No recognition happens here.  Pushed frames are queued (and copied, like the real
+ * library does), batches return synthetic AlprStreamRecognizedFrameC arrays and plate
+ * groups are produced on a fixed cadence so that every Python code path can be exercised
+ * and profiled without the proprietary library.
+ *
+ * Behaviour is controlled with environment variables read by alprstream_init, or at
+ * runtime with alprstream_stub_set_option():
+ *
+ *   ALPRSTREAM_STUB_BATCH_SIZE        frames returned per process_batch call     (10)
+ *   ALPRSTREAM_STUB_BATCH_DELAY_US    sleep per process_batch call               (0)
+ *   ALPRSTREAM_STUB_FRAME_DELAY_US    additional sleep per processed frame       (0)
+ *   ALPRSTREAM_STUB_MEGAPIXEL_DELAY_US additional sleep per megapixel processed  (0)
+ *   ALPRSTREAM_STUB_SIZE_MISS_US      sleep when a frame's size is not among the (0)
+ *                                     4 most recently processed sizes, modelling
+ *                                     the library's per-size buffer caches
+ *   ALPRSTREAM_STUB_PLATE_EVERY       a plate is found on every Nth frame        (5)
+ *   ALPRSTREAM_STUB_PLATES_PER_FRAME  plates in each frame that has plates       (1)
+ *   ALPRSTREAM_STUB_CANDIDATES        candidates per plate                        (3)
+ *   ALPRSTREAM_STUB_GROUP_FRAMES      frames belonging to one plate group        (20)
+ *   ALPRSTREAM_STUB_JPEG_SIZE         size of the synthetic JPEG blobs            (65536)
+ *   ALPRSTREAM_STUB_COPY_FRAMES       copy pushed pixels into the queue           (1)
+ *   ALPRSTREAM_STUB_VIDEO_FRAMES      frames produced by connect_video_file      (300)
+ *   ALPRSTREAM_STUB_VIDEO_FPS         frame rate of the synthetic video sources  (30)
+ *   ALPRSTREAM_STUB_VIDEO_WIDTH       width of the synthetic video frames        (1280)
+ *   ALPRSTREAM_STUB_VIDEO_HEIGHT      height of the synthetic video frames       (720)
+ *
+ * connect_video_stream_url accepts any URL.  Query parameters of the URL simulate a
+ * misbehaving camera, e.g. "stub://gate-1?connect_ms=800&stall_after=300&fail_first=2":
+ *
+ *   fps=N            frame rate of this stream instead of VIDEO_FPS
+ *   connect_ms=N     delay before the first frame of each connection
+ *   stall_after=N    the connection hangs after N frames: no more frames, but the
+ *                    source thread keeps running, like a dead RTSP session
+ *   fail_first=N     the first N connections of the stream never produce a frame
+ *
+ * Build with benchmarks/stublib.py, or by hand:
+ *
+ *   cc -O2 -shared -fPIC -pthread -o libalprstream.so alprstream_stub.c
+ */
+#include <stdarg.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <pthread.h>
+#include <unistd.h>
+#include <sys/time.h>
+
+#if defined(_WIN32)
+#define STUB_EXPORT __declspec(dllexport)
+#else
+#define STUB_EXPORT __attribute__((visibility("default")))
+#endif
+
+typedef struct {
+    bool image_available;
+    void *jpeg_bytes;
+    long long jpeg_bytes_size;
+    long long frame_epoch_time_ms;
+    long long frame_number;
+    char *results_str;
+} AlprStreamRecognizedFrameC;
+
+typedef struct {
+    AlprStreamRecognizedFrameC *results_array;
+    int results_size;
+} AlprStreamRecognizedBatchC;
+
+/* ------------------------------------------------------------------------------------ */
+/* Options                                                                              */
+
+enum {
+    OPT_BATCH_SIZE, OPT_BATCH_DELAY_US, OPT_FRAME_DELAY_US, OPT_PLATE_EVERY, OPT_PLATES_PER_FRAME,
+    OPT_CANDIDATES, OPT_GROUP_FRAMES, OPT_JPEG_SIZE, OPT_COPY_FRAMES, OPT_VIDEO_FRAMES, OPT_VIDEO_FPS,
+    OPT_VIDEO_WIDTH, OPT_VIDEO_HEIGHT, OPT_MEGAPIXEL_DELAY_US, OPT_SIZE_MISS_US, OPT_COUNT
+};
+
+static const char *option_names[OPT_COUNT] = {
+    "BATCH_SIZE", "BATCH_DELAY_US", "FRAME_DELAY_US", "PLATE_EVERY", "PLATES_PER_FRAME",
+    "CANDIDATES", "GROUP_FRAMES", "JPEG_SIZE", "COPY_FRAMES", "VIDEO_FRAMES", "VIDEO_FPS",
+    "VIDEO_WIDTH", "VIDEO_HEIGHT", "MEGAPIXEL_DELAY_US", "SIZE_MISS_US"
+};
+
+static long long options[OPT_COUNT] = {10, 0, 0, 5, 1, 3, 20, 65536, 1, 300, 30, 1280, 720, 0, 0};
+static pthread_once_t options_once = PTHREAD_ONCE_INIT;
+
+static void load_env_options(void)
+{
+    char name[64];
+    for (int i = 0; i < OPT_COUNT; i++) {
+        snprintf(name, sizeof(name), "ALPRSTREAM_STUB_%s", option_names[i]);
+        const char *value = getenv(name);
+        if (value != NULL && *value != '\0')
+            options[i] = atoll(value);
+    }
+}
+
+STUB_EXPORT int alprstream_stub_set_option(const char *name, long long value)
+{
+    pthread_once(&options_once, load_env_options);
+    for (int i = 0; i < OPT_COUNT; i++) {
+        if (strcmp(name, option_names[i]) == 0) {
+            __atomic_store_n(&options[i], value, __ATOMIC_RELAXED);
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static long long opt(int index)
+{
+    return __atomic_load_n(&options[index], __ATOMIC_RELAXED);
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Allocation accounting, so bindings can be checked for leaks                          */
+
+static long long outstanding_allocations = 0;
+static long long outstanding_bytes = 0;
+
+static void *tracked_malloc(size_t size)
+{
+    size_t *block = malloc(size + sizeof(size_t) * 2);
+    if (block == NULL) {
+        abort();
+    }
+    block[0] = size;
+    __atomic_add_fetch(&outstanding_allocations, 1, __ATOMIC_RELAXED);
+    __atomic_add_fetch(&outstanding_bytes, (long long) size, __ATOMIC_RELAXED);
+    return block + 2;
+}
+
+static void tracked_free(void *ptr)
+{
+    if (ptr == NULL)
+        return;
+    size_t *block = ((size_t *) ptr) - 2;
+    __atomic_sub_fetch(&outstanding_allocations, 1, __ATOMIC_RELAXED);
+    __atomic_sub_fetch(&outstanding_bytes, (long long) block[0], __ATOMIC_RELAXED);
+    free(block);
+}
+
+STUB_EXPORT long long alprstream_stub_outstanding_allocations(void)
+{
+    return __atomic_load_n(&outstanding_allocations, __ATOMIC_RELAXED);
+}
+
+STUB_EXPORT long long alprstream_stub_outstanding_bytes(void)
+{
+    return __atomic_load_n(&outstanding_bytes, __ATOMIC_RELAXED);
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Growable string buffer used to build JSON                                            */
+
+typedef struct {
+    char *data;
+    size_t length;
+    size_t capacity;
+} strbuf;
+
+static void sb_reserve(strbuf *sb, size_t extra)
+{
+    if (sb->length + extra + 1 <= sb->capacity)
+        return;
+    size_t capacity = sb->capacity ? sb->capacity : 256;
+    while (capacity < sb->length + extra + 1)
+        capacity *= 2;
+    sb->data = realloc(sb->data, capacity);
+    sb->capacity = capacity;
+}
+
+static void sb_printf(strbuf *sb, const char *format, ...) __attribute__((format(printf, 2, 3)));
+
+static void sb_printf(strbuf *sb, const char *format, ...)
+{
+    va_list args;
+    va_start(args, format);
+    va_list copy;
+    va_copy(copy, args);
+    int needed = vsnprintf(NULL, 0, format, copy);
+    va_end(copy);
+    sb_reserve(sb, (size_t) needed);
+    vsnprintf(sb->data + sb->length, (size_t) needed + 1, format, args);
+    sb->length += (size_t) needed;
+    va_end(args);
+}
+
+/* Moves the buffer into a tracked allocation owned by the caller */
+static char *sb_detach(strbuf *sb)
+{
+    char *out = tracked_malloc(sb->length + 1);
+    if (sb->length)
+        memcpy(out, sb->data, sb->length);
+    out[sb->length] = '\0';
+    free(sb->data);
+    sb->data = NULL;
+    sb->length = sb->capacity = 0;
+    return out;
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Stream state                                                                         */
+
+typedef struct {
+    unsigned char *pixels;
+    int bytes_per_pixel;
+    int width;
+    int height;
+    long long epoch_time_ms;
+    long long frame_number;
+} queued_frame;
+
+typedef struct {
+    char plate[16];
+    long long epoch_start;
+    long long epoch_end;
+    long long frame_start;
+    long long frame_end;
+    long long group_index;
+    int frames_seen;
+    double best_confidence;
+    char first_uuid[64];
+    char uuid[64];
+} plate_group;
+
+typedef struct AlprStream {
+    pthread_mutex_t lock;
+    unsigned int capacity;
+    unsigned int use_motion_detection;
+
+    queued_frame *queue;
+    unsigned int head;
+    unsigned int count;
+    long long next_frame_number;
+
+    plate_group *active;
+    int active_count;
+    int active_capacity;
+
+    plate_group *completed;
+    int completed_count;
+    int completed_capacity;
+
+    struct AlprStream *grouping_parent;
+
+    int encode_jpeg;
+    int jpeg_compression;
+    char uuid_format[128];
+    char camera[128];
+
+    pthread_t source_thread;
+    volatile int source_running;
+    volatile int source_stop;
+    int source_is_file;
+    long long source_start_time;
+    char source_url[512];
+    long long source_connects;
+} AlprStream;
+
+static long long now_ms(void)
+{
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return (long long) tv.tv_sec * 1000 + tv.tv_usec / 1000;
+}
+
+static void sleep_us(long long microseconds)
+{
+    if (microseconds <= 0)
+        return;
+    struct timespec ts;
+    ts.tv_sec = microseconds / 1000000;
+    ts.tv_nsec = (microseconds % 1000000) * 1000;
+    nanosleep(&ts, NULL);
+}
+
+/* Process-wide, like the library's per-size caches.  Returns the simulated cost of a frame's size */
+#define SIZE_CACHE_ENTRIES 4
+static pthread_mutex_t size_cache_lock = PTHREAD_MUTEX_INITIALIZER;
+static long long size_cache[SIZE_CACHE_ENTRIES];
+
+static long long size_cache_cost(const queued_frame *frame)
+{
+    if (opt(OPT_SIZE_MISS_US) <= 0)
+        return 0;
+    long long key = ((long long) frame->width << 32) | (unsigned int) frame->height;
+    pthread_mutex_lock(&size_cache_lock);
+    int found = SIZE_CACHE_ENTRIES - 1;
+    for (int i = 0; i < SIZE_CACHE_ENTRIES; i++) {
+        if (size_cache[i] == key) {
+            found = i;
+            break;
+        }
+    }
+    int hit = size_cache[found] == key;
+    /* Move to front, evicting the least recently used entry on a miss */
+    memmove(&size_cache[1], &size_cache[0], sizeof(long long) * (size_t) found);
+    size_cache[0] = key;
+    pthread_mutex_unlock(&size_cache_lock);
+    return hit ? 0 : opt(OPT_SIZE_MISS_US);
+}
+
+STUB_EXPORT AlprStream *alprstream_init(unsigned int frame_queue_size, unsigned int use_motion_detection)
+{
+    pthread_once(&options_once, load_env_options);
+    AlprStream *stream = calloc(1, sizeof(AlprStream));
+    pthread_mutex_init(&stream->lock, NULL);
+    stream->capacity = frame_queue_size ? frame_queue_size : 1;
+    stream->use_motion_detection = use_motion_detection;
+    stream->queue = calloc(stream->capacity, sizeof(queued_frame));
+    stream->encode_jpeg = 1;
+    stream->jpeg_compression = 85;
+    strcpy(stream->uuid_format, "{time}-{random}");
+    return stream;
+}
+
+/* Caller holds the lock */
+static unsigned int enqueue_frame(AlprStream *stream, const unsigned char *pixels, int bytes_per_pixel,
+                                  int width, int height, long long epoch_time_ms)
+{
+    if (stream->count >= stream->capacity) {
+        /* Drop the oldest frame, the same way the real library behaves when overrun */
+        queued_frame *oldest = &stream->queue[stream->head];
+        tracked_free(oldest->pixels);
+        oldest->pixels = NULL;
+        stream->head = (stream->head + 1) % stream->capacity;
+        stream->count--;
+    }
+    queued_frame *slot = &stream->queue[(stream->head + stream->count) % stream->capacity];
+    size_t size = (size_t) bytes_per_pixel * (size_t) width * (size_t) height;
+    slot->pixels = NULL;
+    if (opt(OPT_COPY_FRAMES) && size > 0) {
+        slot->pixels = tracked_malloc(size);
+        if (pixels != NULL)
+            memcpy(slot->pixels, pixels, size);
+        else
+            memset(slot->pixels, 0, size);
+    }
+    slot->bytes_per_pixel = bytes_per_pixel;
+    slot->width = width;
+    slot->height = height;
+    slot->epoch_time_ms = epoch_time_ms >= 0 ? epoch_time_ms : now_ms();
+    slot->frame_number = stream->next_frame_number++;
+    stream->count++;
+    return stream->count;
+}
+
+STUB_EXPORT unsigned int alprstream_push_frame(AlprStream *stream, unsigned char *pixelData, int bytesPerPixel,
+                                                int imgWidth, int imgHeight, long long frame_epoch_time)
+{
+    pthread_mutex_lock(&stream->lock);
+    unsigned int size = enqueue_frame(stream, pixelData, bytesPerPixel, imgWidth, imgHeight, frame_epoch_time);
+    pthread_mutex_unlock(&stream->lock);
+    return size;
+}
+
+STUB_EXPORT unsigned int alprstream_push_frame_encoded(AlprStream *stream, unsigned char *bytearray,
+                                                        long long arraySize, long long frame_epoch_time)
+{
+    (void) bytearray;
+    (void) arraySize;
+    pthread_mutex_lock(&stream->lock);
+    unsigned int size = enqueue_frame(stream, NULL, 3, (int) opt(OPT_VIDEO_WIDTH), (int) opt(OPT_VIDEO_HEIGHT),
+                                      frame_epoch_time);
+    pthread_mutex_unlock(&stream->lock);
+    return size;
+}
+
+STUB_EXPORT unsigned int alprstream_get_queue_size(AlprStream *stream)
+{
+    pthread_mutex_lock(&stream->lock);
+    unsigned int size = stream->count;
+    pthread_mutex_unlock(&stream->lock);
+    return size;
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Synthetic video sources                                                              */
+
+/* Integer query parameter of a stream URL, e.g. url_param("stub://a?fps=5", "fps", 30) == 5 */
+static long long url_param(const char *url, const char *name, long long fallback)
+{
+    size_t length = strlen(name);
+    for (const char *p = strchr(url, '?'); p != NULL; p = strchr(p + 1, '&')) {
+        if (strncmp(p + 1, name, length) == 0 && p[1 + length] == '=')
+            return atoll(p + 2 + length);
+    }
+    return fallback;
+}
+
+static void *source_thread_main(void *arg)
+{
+    AlprStream *stream = arg;
+    long long fps = opt(OPT_VIDEO_FPS) > 0 ? opt(OPT_VIDEO_FPS) : 30;
+    long long total = stream->source_is_file ? opt(OPT_VIDEO_FRAMES) : -1;
+    long long stall_after = -1;
+    int width = (int) opt(OPT_VIDEO_WIDTH), height = (int) opt(OPT_VIDEO_HEIGHT);
+
+    if (!stream->source_is_file) {
+        const char *url = stream->source_url;
+        fps = url_param(url, "fps", fps) > 0 ? url_param(url, "fps", fps) : fps;
+        stall_after = url_param(url, "stall_after", -1);
+        if (stream->source_connects <= url_param(url, "fail_first", 0))
+            stall_after = 0;
+        for (long long waited = 0; waited < url_param(url, "connect_ms", 0) && !stream->source_stop; waited++)
+            sleep_us(1000);
+    }
+    for (long long i = 0; !stream->source_stop && (total < 0 || i < total); i++) {
+        if (stream->source_is_file) {
+            /* Video files wait for room in the queue instead of dropping frames */
+            while (!stream->source_stop && alprstream_get_queue_size(stream) >= stream->capacity)
+                sleep_us(1000);
+            if (stream->source_stop)
+                break;
+        } else {
+            sleep_us(1000000 / fps);
+            if (stall_after >= 0 && i >= stall_after)
+                continue;
+        }
+        long long epoch = stream->source_is_file ? stream->source_start_time + i * 1000 / fps : now_ms();
+        pthread_mutex_lock(&stream->lock);
+        enqueue_frame(stream, NULL, 3, width, height, epoch);
+        pthread_mutex_unlock(&stream->lock);
+    }
+    stream->source_running = 0;
+    return NULL;
+}
+
+static void stop_source(AlprStream *stream)
+{
+    if (stream->source_thread) {
+        stream->source_stop = 1;
+        pthread_join(stream->source_thread, NULL);
+        stream->source_thread = 0;
+        stream->source_running = 0;
+    }
+}
+
+static void start_source(AlprStream *stream, int is_file, long long start_time)
+{
+    stop_source(stream);
+    stream->source_stop = 0;
+    stream->source_is_file = is_file;
+    stream->source_start_time = start_time;
+    stream->source_running = 1;
+    pthread_create(&stream->source_thread, NULL, source_thread_main, stream);
+}
+
+STUB_EXPORT void alprstream_connect_video_stream_url(AlprStream *stream, const char *url,
+                                                      const char *gstreamer_pipeline_format)
+{
+    (void) gstreamer_pipeline_format;
+    snprintf(stream->source_url, sizeof(stream->source_url), "%s", url ? url : "");
+    stream->source_connects++;
+    start_source(stream, 0, 0);
+}
+
+STUB_EXPORT void alprstream_disconnect_video_stream(AlprStream *stream)
+{
+    if (!stream->source_is_file)
+        stop_source(stream);
+}
+
+STUB_EXPORT void alprstream_connect_video_file(AlprStream *stream, const char *video_file_path,
+                                                long long video_start_time)
+{
+    snprintf(stream->source_url, sizeof(stream->source_url), "%s", video_file_path ? video_file_path : "");
+    start_source(stream, 1, video_start_time);
+}
+
+STUB_EXPORT void alprstream_disconnect_video_file(AlprStream *stream)
+{
+    if (stream->source_is_file)
+        stop_source(stream);
+}
+
+STUB_EXPORT unsigned int alprstream_video_file_active(AlprStream *stream)
+{
+    return stream->source_is_file && stream->source_running;
+}
+
+STUB_EXPORT double alprstream_get_video_file_fps(AlprStream *stream)
+{
+    (void) stream;
+    return (double) opt(OPT_VIDEO_FPS);
+}
+
+STUB_EXPORT char *alprstream_get_stream_url(AlprStream *stream)
+{
+    strbuf sb = {0};
+    sb_printf(&sb, "%s", stream->source_is_file ? "" : stream->source_url);
+    return sb_detach(&sb);
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Recognition                                                                          */
+
+/* Distinct for every plate_index, so PLATES_PER_FRAME above 24 still gives that many groups */
+static void plate_for_group(long long group_index, int plate_index, char *out, size_t size)
+{
+    int length = snprintf(out, size, "%c%c%c%04lld", 'A' + (int) (group_index % 26), 'B' + plate_index % 24,
+                          'C' + (int) ((group_index / 26) % 23), group_index % 10000);
+    if (plate_index >= 24 && length > 0 && (size_t) length < size)
+        snprintf(out + length, size - (size_t) length, "%d", plate_index / 24);
+}
+
+static void write_candidates(strbuf *sb, const char *plate, double confidence)
+{
+    static const char swaps[][2] = {{'B', '8'}, {'0', 'O'}, {'1', 'I'}, {'5', 'S'}, {'2', 'Z'}};
+    sb_printf(sb, "\"candidates\":[{\"plate\":\"%s\",\"confidence\":%.3f,\"matches_template\":0}", plate,
+              confidence);
+    long long candidates = opt(OPT_CANDIDATES);
+    for (long long c = 1; c < candidates; c++) {
+        char variant[16];
+        snprintf(variant, sizeof(variant), "%s", plate);
+        const char *swap = swaps[(c - 1) % 5];
+        for (char *p = variant; *p; p++) {
+            if (*p == swap[0]) { *p = swap[1]; break; }
+        }
+        variant[(c - 1) % strlen(variant)] = (char) ('A' + (c % 26));
+        sb_printf(sb, ",{\"plate\":\"%s\",\"confidence\":%.3f,\"matches_template\":0}", variant,
+                  confidence - 5.0 * (double) c);
+    }
+    sb_printf(sb, "]");
+}
+
+static void write_coordinates(strbuf *sb, int width, int height, int plate_index)
+{
+    int x = width / 4 + plate_index * width / 8, y = height / 2;
+    int w = width / 10 > 4 ? width / 10 : 4, h = height / 20 > 2 ? height / 20 : 2;
+    sb_printf(sb, "\"coordinates\":[{\"x\":%d,\"y\":%d},{\"x\":%d,\"y\":%d},{\"x\":%d,\"y\":%d},{\"x\":%d,\"y\":%d}]",
+              x, y, x + w, y, x + w, y + h, x, y + h);
+}
+
+/* Caller holds the lock */
+static void record_group(AlprStream *stream, const char *plate, long long group_index, const queued_frame *frame,
+                         double confidence)
+{
+    AlprStream *owner = stream->grouping_parent ? stream->grouping_parent : stream;
+    for (int i = 0; i < owner->active_count; i++) {
+        plate_group *g = &owner->active[i];
+        if (strcmp(g->plate, plate) == 0) {
+            g->epoch_end = frame->epoch_time_ms;
+            g->frame_end = frame->frame_number;
+            g->frames_seen++;
+            if (confidence > g->best_confidence) {
+                /* Like the library, best_uuid follows the frame of the best read */
+                g->best_confidence = confidence;
+                snprintf(g->uuid, sizeof(g->uuid), "%lld-%08x", frame->epoch_time_ms, (unsigned) rand());
+            }
+            return;
+        }
+    }
+    if (owner->active_count == owner->active_capacity) {
+        owner->active_capacity = owner->active_capacity ? owner->active_capacity * 2 : 16;
+        owner->active = realloc(owner->active, sizeof(plate_group) * owner->active_capacity);
+    }
+    plate_group *g = &owner->active[owner->active_count++];
+    memset(g, 0, sizeof(*g));
+    snprintf(g->plate, sizeof(g->plate), "%s", plate);
+    g->epoch_start = g->epoch_end = frame->epoch_time_ms;
+    g->frame_start = g->frame_end = frame->frame_number;
+    g->group_index = group_index;
+    g->frames_seen = 1;
+    g->best_confidence = confidence;
+    snprintf(g->uuid, sizeof(g->uuid), "%lld-%08x", frame->epoch_time_ms, (unsigned) rand());
+    memcpy(g->first_uuid, g->uuid, sizeof(g->uuid));
+}
+
+/* Caller holds the lock.  Groups close once the stream has moved past their window */
+static void close_groups(AlprStream *stream, long long current_group_index)
+{
+    AlprStream *owner = stream->grouping_parent ? stream->grouping_parent : stream;
+    int kept = 0;
+    for (int i = 0; i < owner->active_count; i++) {
+        plate_group *g = &owner->active[i];
+        if (g->group_index < current_group_index) {
+            if (owner->completed_count == owner->completed_capacity) {
+                owner->completed_capacity = owner->completed_capacity ? owner->completed_capacity * 2 : 16;
+                owner->completed = realloc(owner->completed, sizeof(plate_group) * owner->completed_capacity);
+            }
+            owner->completed[owner->completed_count++] = *g;
+        } else {
+            owner->active[kept++] = *g;
+        }
+    }
+    owner->active_count = kept;
+}
+
+static void fill_frame_result(AlprStream *stream, const queued_frame *frame, AlprStreamRecognizedFrameC *out)
+{
+    long long plate_every = opt(OPT_PLATE_EVERY);
+    long long group_frames = opt(OPT_GROUP_FRAMES) > 0 ? opt(OPT_GROUP_FRAMES) : 1;
+    long long group_index = frame->frame_number / group_frames;
+    int has_plate = plate_every > 0 && frame->frame_number % plate_every == 0;
+    int plates = has_plate ? (int) opt(OPT_PLATES_PER_FRAME) : 0;
+
+    strbuf sb = {0};
+    sb_printf(&sb, "{\"version\":2,\"data_type\":\"alpr_results\",\"epoch_time\":%lld,\"img_width\":%d,"
+              "\"img_height\":%d,\"processing_time_ms\":%.3f,\"results\":[", frame->epoch_time_ms, frame->width,
+              frame->height, (double) opt(OPT_FRAME_DELAY_US) / 1000.0);
+    for (int p = 0; p < plates; p++) {
+        char plate[16];
+        plate_for_group(group_index, p, plate, sizeof(plate));
+        double confidence = 80.0 + (double) ((frame->frame_number + p) % 19);
+        sb_printf(&sb, "%s{\"plate\":\"%s\",\"confidence\":%.3f,\"matches_template\":0,\"plate_index\":%d,"
+                  "\"region\":\"\",\"region_confidence\":0,\"processing_time_ms\":0.0,\"requested_topn\":%lld,",
+                  p ? "," : "", plate, confidence, p, opt(OPT_CANDIDATES));
+        write_coordinates(&sb, frame->width, frame->height, p);
+        sb_printf(&sb, ",");
+        write_candidates(&sb, plate, confidence);
+        sb_printf(&sb, "}");
+        record_group(stream, plate, group_index, frame, confidence);
+    }
+    sb_printf(&sb, "]}");
+
+    out->frame_epoch_time_ms = frame->epoch_time_ms;
+    out->frame_number = frame->frame_number;
+    out->results_str = sb_detach(&sb);
+    out->image_available = (plates > 0 && stream->encode_jpeg >= 1) || stream->encode_jpeg == 2;
+    out->jpeg_bytes = NULL;
+    out->jpeg_bytes_size = 0;
+    if (out->image_available && opt(OPT_JPEG_SIZE) > 0) {
+        long long size = opt(OPT_JPEG_SIZE);
+        unsigned char *jpeg = tracked_malloc((size_t) size);
+        memset(jpeg, (int) (frame->frame_number & 0xff), (size_t) size);
+        jpeg[0] = 0xFF;
+        if (size > 1)
+            jpeg[1] = 0xD8;
+        out->jpeg_bytes = jpeg;
+        out->jpeg_bytes_size = size;
+    }
+    close_groups(stream, group_index);
+}
+
+static int pop_frames(AlprStream *stream, queued_frame *out, int max_frames)
+{
+    int taken = 0;
+    while (taken < max_frames && stream->count > 0) {
+        out[taken++] = stream->queue[stream->head];
+        stream->queue[stream->head].pixels = NULL;
+        stream->head = (stream->head + 1) % stream->capacity;
+        stream->count--;
+    }
+    return taken;
+}
+
+STUB_EXPORT AlprStreamRecognizedBatchC *alprstream_process_batch(AlprStream *stream, void *alpr)
+{
+    (void) alpr;
+    int batch_size = opt(OPT_BATCH_SIZE) > 0 ? (int) opt(OPT_BATCH_SIZE) : 1;
+    queued_frame *frames = malloc(sizeof(queued_frame) * (size_t) batch_size);
+
+    pthread_mutex_lock(&stream->lock);
+    int taken = pop_frames(stream, frames, batch_size);
+    pthread_mutex_unlock(&stream->lock);
+
+    long long pixels = 0, misses = 0;
+    for (int i = 0; i < taken; i++) {
+        pixels += (long long) frames[i].width * frames[i].height;
+        misses += size_cache_cost(&frames[i]);
+    }
+    sleep_us(opt(OPT_BATCH_DELAY_US) + opt(OPT_FRAME_DELAY_US) * taken +
+             opt(OPT_MEGAPIXEL_DELAY_US) * pixels / 1000000 + misses);
+
+    AlprStreamRecognizedBatchC *batch = tracked_malloc(sizeof(AlprStreamRecognizedBatchC));
+    batch->results_size = taken;
+    batch->results_array = taken ? tracked_malloc(sizeof(AlprStreamRecognizedFrameC) * (size_t) taken) : NULL;
+
+    pthread_mutex_lock(&stream->lock);
+    for (int i = 0; i < taken; i++) {
+        fill_frame_result(stream, &frames[i], &batch->results_array[i]);
+        tracked_free(frames[i].pixels);
+    }
+    pthread_mutex_unlock(&stream->lock);
+    free(frames);
+    return batch;
+}
+
+STUB_EXPORT AlprStreamRecognizedFrameC *alprstream_process_frame(AlprStream *stream, void *alpr)
+{
+    (void) alpr;
+    queued_frame frame;
+    pthread_mutex_lock(&stream->lock);
+    int taken = pop_frames(stream, &frame, 1);
+    pthread_mutex_unlock(&stream->lock);
+    if (!taken)
+        return NULL;
+
+    sleep_us(opt(OPT_FRAME_DELAY_US) + opt(OPT_MEGAPIXEL_DELAY_US) * frame.width * frame.height / 1000000 +
+             size_cache_cost(&frame));
+    AlprStreamRecognizedFrameC *result = tracked_malloc(sizeof(AlprStreamRecognizedFrameC));
+    pthread_mutex_lock(&stream->lock);
+    fill_frame_result(stream, &frame, result);
+    pthread_mutex_unlock(&stream->lock);
+    tracked_free(frame.pixels);
+    return result;
+}
+
+static void free_frame_contents(AlprStreamRecognizedFrameC *frame)
+{
+    tracked_free(frame->jpeg_bytes);
+    tracked_free(frame->results_str);
+}
+
+STUB_EXPORT void alprstream_free_frame_response(AlprStreamRecognizedFrameC *response)
+{
+    if (response == NULL)
+        return;
+    free_frame_contents(response);
+    tracked_free(response);
+}
+
+STUB_EXPORT void alprstream_free_batch_response(AlprStreamRecognizedBatchC *response)
+{
+    if (response == NULL)
+        return;
+    for (int i = 0; i < response->results_size; i++)
+        free_frame_contents(&response->results_array[i]);
+    tracked_free(response->results_array);
+    tracked_free(response);
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Groups                                                                               */
+
+static void write_group(strbuf *sb, const AlprStream *stream, const plate_group *g)
+{
+    sb_printf(sb, "{\"data_type\":\"alpr_group\",\"version\":2,\"epoch_start\":%lld,\"epoch_end\":%lld,"
+              "\"frame_start\":%lld,\"frame_end\":%lld,\"best_plate_number\":\"%s\",\"best_confidence\":%.3f,"
+              "\"best_uuid\":\"%s\",\"matches_template\":false,\"is_parked\":false,\"camera\":\"%s\",",
+              g->epoch_start, g->epoch_end, g->frame_start, g->frame_end, g->plate, g->best_confidence, g->uuid,
+              stream->camera);
+    /* Only the first and the best frame's UUIDs; the library lists every frame of the group */
+    if (strcmp(g->first_uuid, g->uuid) == 0)
+        sb_printf(sb, "\"uuids\":[\"%s\"],", g->first_uuid);
+    else
+        sb_printf(sb, "\"uuids\":[\"%s\",\"%s\"],", g->first_uuid, g->uuid);
+    write_candidates(sb, g->plate, g->best_confidence);
+    sb_printf(sb, ",\"best_plate\":{\"plate\":\"%s\",\"confidence\":%.3f,", g->plate, g->best_confidence);
+    write_coordinates(sb, (int) opt(OPT_VIDEO_WIDTH), (int) opt(OPT_VIDEO_HEIGHT), 0);
+    sb_printf(sb, "}}");
+}
+
+static char *groups_json(const AlprStream *stream, const plate_group *groups, int count)
+{
+    strbuf sb = {0};
+    sb_printf(&sb, "[");
+    for (int i = 0; i < count; i++) {
+        if (i)
+            sb_printf(&sb, ",");
+        write_group(&sb, stream, &groups[i]);
+    }
+    sb_printf(&sb, "]");
+    return sb_detach(&sb);
+}
+
+STUB_EXPORT char *alprstream_pop_completed_groups(AlprStream *stream)
+{
+    pthread_mutex_lock(&stream->lock);
+    AlprStream *owner = stream->grouping_parent ? stream->grouping_parent : stream;
+    char *json = groups_json(stream, owner->completed, owner->completed_count);
+    owner->completed_count = 0;
+    pthread_mutex_unlock(&stream->lock);
+    return json;
+}
+
+STUB_EXPORT char *alprstream_peek_active_groups(AlprStream *stream)
+{
+    pthread_mutex_lock(&stream->lock);
+    AlprStream *owner = stream->grouping_parent ? stream->grouping_parent : stream;
+    char *json = groups_json(stream, owner->active, owner->active_count);
+    pthread_mutex_unlock(&stream->lock);
+    return json;
+}
+
+STUB_EXPORT void alprstream_free_response_string(char *response)
+{
+    tracked_free(response);
+}
+
+STUB_EXPORT void alprstream_combine_grouping(AlprStream *stream, AlprStream *other_stream)
+{
+    if (other_stream != NULL && other_stream != stream)
+        other_stream->grouping_parent = stream;
+}
+
+/* ------------------------------------------------------------------------------------ */
+/* Settings                                                                             */
+
+STUB_EXPORT void alprstream_set_uuid_format(AlprStream *stream, const char *format)
+{
+    snprintf(stream->uuid_format, sizeof(stream->uuid_format), "%s", format ? format : "");
+}
+
+STUB_EXPORT void alprstream_set_env_parameters(AlprStream *stream, const char *company_id, const char *camera_id,
+                                                int agent_id)
+{
+    (void) company_id;
+    (void) agent_id;
+    snprintf(stream->camera, sizeof(stream->camera), "%s", camera_id ? camera_id : "");
+}
+
+STUB_EXPORT void alprstream_set_detection_mask_encoded(AlprStream *stream, unsigned char *bytearray,
+                                                        long long arraySize, long long frame_epoch_time)
+{
+    (void) stream; (void) bytearray; (void) arraySize; (void) frame_epoch_time;
+}
+
+STUB_EXPORT void alprstream_set_detection_mask(AlprStream *stream, unsigned char *pixelData, int bytesPerPixel,
+                                                int imgWidth, int imgHeight, long long frame_epoch_time)
+{
+    (void) stream; (void) pixelData; (void) bytesPerPixel; (void) imgWidth; (void) imgHeight;
+    (void) frame_epoch_time;
+}
+
+STUB_EXPORT void alprstream_set_jpeg_compression(AlprStream *stream, int compression)
+{
+    stream->jpeg_compression = compression;
+}
+
+STUB_EXPORT void alprstream_set_encode_jpeg(AlprStream *stream, int always_return_jpeg)
+{
+    stream->encode_jpeg = always_return_jpeg;
+}
+
+STUB_EXPORT bool alprstream_cleanup(AlprStream *stream)
+{
+    if (stream == NULL)
+        return false;
+    stop_source(stream);
+    pthread_mutex_lock(&stream->lock);
+    while (stream->count > 0) {
+        tracked_free(stream->queue[stream->head].pixels);
+        stream->head = (stream->head + 1) % stream->capacity;
+        stream->count--;
+    }
+    pthread_mutex_unlock(&stream->lock);
+    free(stream->queue);
+    free(stream->active);
+    free(stream->completed);
+    pthread_mutex_destroy(&stream->lock);
+    free(stream);
+    return true;
+}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Builds and configures the stand-in libalprstream in benchmarks/stub.
+
+The stub implements the C ABI bound by alprstream.py and returns synthetic frames and
+plate groups, so the bindings can be benchmarked without the proprietary library:
+
+    python benchmarks/stublib.py            # builds and prints the library path
+    ALPRSTREAM_LIBRARY=$(python benchmarks/stublib.py) python benchmarks/bench_wait.py
+
+Options (see the top of alprstream_stub.c) are read from ALPRSTREAM_STUB_* environment
+variables when the first stream is created, or changed at any time with set_option().
+"""
+import ctypes
+import os
+import subprocess
+import sys
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub")
+SOURCE = os.path.join(STUB_DIR, "alprstream_stub.c")
+LIBRARY = os.path.join(STUB_DIR, "build", "libalprstream.dylib" if sys.platform == "darwin" else "libalprstream.so")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from alprstream import _load_library
+
+# The stub's built-in option values, restored by reset_options()
+DEFAULT_OPTIONS = {
+    "BATCH_SIZE": 10, "BATCH_DELAY_US": 0, "FRAME_DELAY_US": 0, "PLATE_EVERY": 5, "PLATES_PER_FRAME": 1,
+    "CANDIDATES": 3, "GROUP_FRAMES": 20, "JPEG_SIZE": 65536, "COPY_FRAMES": 1, "VIDEO_FRAMES": 300,
+    "VIDEO_FPS": 30, "VIDEO_WIDTH": 1280, "VIDEO_HEIGHT": 720, "MEGAPIXEL_DELAY_US": 0,
+    "SIZE_MISS_US": 0,
+}
+
+
+def build(force=False, compiler=None):
+    """
+    Compiles the stub unless an up to date build exists.
+    :param force: Rebuild even if the library is newer than the source
+    :param compiler: C compiler to use.  Defaults to $CC, then cc
+    :return: The path of the built library
+    """
+    if not force and os.path.exists(LIBRARY) and os.path.getmtime(LIBRARY) >= os.path.getmtime(SOURCE):
+        return LIBRARY
+    if not os.path.isdir(os.path.dirname(LIBRARY)):
+        os.makedirs(os.path.dirname(LIBRARY))
+    compiler = compiler or os.environ.get("CC", "cc")
+    subprocess.check_call([compiler, "-O2", "-shared", "-fPIC", "-pthread", "-o", LIBRARY, SOURCE])
+    return LIBRARY
+
+
+def use_stub(force=False):
+    """
+    Builds the stub and makes it the default library for AlprStream in this process.
+    :return: The path of the built library
+    """
+    path = build(force)
+    os.environ["ALPRSTREAM_LIBRARY"] = path
+    return path
+
+
+def _library(library_path=None):
+    return _load_library(library_path or os.environ.get("ALPRSTREAM_LIBRARY") or LIBRARY).library
+
+
+def set_option(name, value, library_path=None):
+    """
+    Changes a stub option for every stream in the process, e.g. set_option("BATCH_DELAY_US", 5000).
+    :param name: The option name without the ALPRSTREAM_STUB_ prefix
+    :param value: The new integer value
+    """
+    function = _library(library_path).alprstream_stub_set_option
+    function.argtypes = [ctypes.c_char_p, ctypes.c_longlong]
+    function.restype = ctypes.c_int
+    if not function(name.encode("ascii"), value):
+        raise ValueError("Unknown stub option %r" % (name,))
+
+
+def reset_options(library_path=None, **overrides):
+    """
+    Restores every stub option to its built-in default, then applies the overrides.
+    :param overrides: Option values to set instead, e.g. BATCH_DELAY_US=5000
+    """
+    for name, value in DEFAULT_OPTIONS.items():
+        set_option(name, overrides.pop(name, value), library_path)
+    for name, value in overrides.items():
+        set_option(name, value, library_path)
+
+
+def outstanding_allocations(library_path=None):
+    """
+    :return: (allocations, bytes) handed out by the stub and not yet freed
+    """
+    library = _library(library_path)
+    library.alprstream_stub_outstanding_allocations.restype = ctypes.c_longlong
+    library.alprstream_stub_outstanding_bytes.restype = ctypes.c_longlong
+    return library.alprstream_stub_outstanding_allocations(), library.alprstream_stub_outstanding_bytes()
+
+
+if __name__ == '__main__':
+    print(build(force="--force" in sys.argv[1:]))